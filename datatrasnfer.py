@@ -1,6 +1,29 @@
 import psycopg2
+import psycopg2.extras
 import logging
 import sys
+import os
+import io
+import json
+import struct
+import uuid
+import datetime
+import decimal
+import itertools
+import threading
+import collections
+import queue
+import concurrent.futures
+import asyncio
+import functools
+import time
+import re
+import select
+import tempfile
+
+LOAD_MODES = ('copy', 'insert', 'values', 'upsert', 'passthrough')
+COPY_FORMATS = ('text', 'csv', 'binary')
+TRIGGER_MODES = ('replica', 'user')
 
 def setup_logger(logfile="migrator.log", level=logging.INFO):
     logging.basicConfig(
@@ -9,66 +32,2493 @@ def setup_logger(logfile="migrator.log", level=logging.INFO):
         level=level
     )
 
+# Impostazioni di sessione predefinite, selezionabili con conf['preset']
+SESSION_PRESETS = {
+    # Lato target: commit asincrono (un crash del server può perdere gli ultimi commit, mai corromperli),
+    # più memoria per ordinamenti e indici, nessun timeout sulle transazioni lunghe del caricamento
+    'bulk_load': {
+        'synchronous_commit': 'off',
+        'work_mem': '64MB',
+        'maintenance_work_mem': '1GB',
+        'statement_timeout': '0',
+        'idle_in_transaction_session_timeout': '0',
+    },
+}
+
+_SETTING_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+
+def session_settings(conf):
+    # Preset e poi conf['settings'], che ha la precedenza
+    preset = conf.get('preset')
+    if preset and preset not in SESSION_PRESETS:
+        raise ValueError(f"preset non valido: {preset} (ammessi: {', '.join(SESSION_PRESETS)})")
+    settings = dict(SESSION_PRESETS.get(preset, {}))
+    settings.update(conf.get('settings') or {})
+    return settings
+
+
+def _connect_options(conf):
+    # Le impostazioni viaggiano nel pacchetto di avvio (-c nome=valore): applicate una volta, senza round trip
+    options = []
+    for name, value in session_settings(conf).items():
+        if not _SETTING_NAME.match(name):
+            raise ValueError(f"Nome di impostazione non valido: {name}")
+        value = str(value).replace('\\', '\\\\').replace(' ', '\\ ')
+        options.append(f'-c {name}={value}')
+    return {'options': ' '.join(options)} if options else {}
+
+
 def get_connection(conf):
     return psycopg2.connect(
         host=conf['host'],
         port=conf['port'],
         dbname=conf['database'],
         user=conf['user'],
-        password=conf['password']
+        password=conf['password'],
+        **_connect_options(conf)
     )
 
-def migrate_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, chunk_size=500):
-    setup_logger()
-    logging.info(f"Avvio migrazione da {src_schema}.{src_table} a {tgt_schema}.{tgt_table} con chunk={chunk_size}")
+def get_replication_connection(conf):
+    # Le connessioni di replica non passano dal pool: con un ConnectionPool se ne usa solo la conf
+    if isinstance(conf, ConnectionPool):
+        conf = conf.conf
+    return psycopg2.connect(
+        host=conf['host'],
+        port=conf['port'],
+        dbname=conf['database'],
+        user=conf['user'],
+        password=conf['password'],
+        connection_factory=psycopg2.extras.LogicalReplicationConnection,
+        **_connect_options(conf)
+    )
+
+# --- Pool di connessioni ---
+
+class ConnectionPool:
+    # Connessioni riutilizzabili verso un server (stessa conf). Al rilascio ogni connessione viene
+    # riportata allo stato iniziale: rollback, DISCARD ALL (impostazioni SET, tabelle temporanee,
+    # prepared statement) e caratteristiche di sessione di psycopg2. Restano le impostazioni di
+    # avvio della conf (preset/settings), che DISCARD ALL non tocca.
+
+    def __init__(self, conf, min_size=0, max_size=20, max_lifetime=3600, check_interval=30, timeout=60):
+        self.conf = conf
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._created = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        # Il posto nel pool è già stato riservato dal chiamante
+        try:
+            conn = get_connection(self.conf)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._created.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn):
+        return time.monotonic() - self._created.get(id(conn), 0) > self.max_lifetime
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Pool di connessioni chiuso")
+                if self._idle:
+                    conn, released = self._idle.popleft()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RuntimeError(f"Pool di connessioni esaurito ({self.max_size} connessioni in uso)")
+                    self._cond.wait(remaining)
+                    continue
+            if conn is None:
+                return self._open()
+            if conn.closed or self._expired(conn):
+                self._discard(conn)
+                continue
+            if time.monotonic() - released > self.check_interval:
+                # Connessione inattiva da tempo: verifica che il server la consideri ancora valida
+                try:
+                    conn.cursor().execute("SELECT 1")
+                    conn.rollback()
+                except Exception as e:
+                    logging.warning(f"Pool: connessione non valida scartata ({e})")
+                    self._discard(conn)
+                    continue
+            return conn
+
+    def putconn(self, conn):
+        if conn.closed or self._closed or self._expired(conn):
+            self._discard(conn)
+            return
+        try:
+            conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT', deferrable='DEFAULT', autocommit=True)
+            conn.cursor().execute("DISCARD ALL")
+            conn.autocommit = False
+        except Exception as e:
+            logging.warning(f"Pool: reset della connessione fallito, scartata ({e})")
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), collections.deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+def acquire(conf):
+    # conf può essere una configurazione (connessione nuova) o un ConnectionPool
+    return conf.getconn() if isinstance(conf, ConnectionPool) else get_connection(conf)
+
+
+def release(conf, conn):
+    if isinstance(conf, ConnectionPool):
+        conf.putconn(conn)
+    else:
+        conn.close()
+
+
+def _driver_pools(source_conf, target_conf, pool_size):
+    # Con pool_size le tabelle di un run multi-tabella condividono le connessioni; i pool creati
+    # qui vengono chiusi dal chiamante, quelli ricevuti dall'esterno restano aperti
+    if not pool_size:
+        return source_conf, target_conf, []
+    confs = (source_conf, target_conf)
+    pools = [conf if isinstance(conf, ConnectionPool) else ConnectionPool(conf, max_size=pool_size) for conf in confs]
+    return pools[0], pools[1], [pool for pool, conf in zip(pools, confs) if pool is not conf]
+
+
+def get_columns(cur, schema, table, catalog=None):
+    if catalog:
+        return catalog.columns(cur, schema, table)
+    cur.execute(f"""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position""", (schema, table))
+    return [row[0] for row in cur.fetchall()]
+
+
+def get_generated_columns(cur, schema, table, catalog=None):
+    # Colonne generate (GENERATED ALWAYS AS ... STORED): COPY e INSERT le rifiutano, vanno escluse dal caricamento
+    if catalog:
+        return catalog.generated(cur, schema, table)
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND is_generated = 'ALWAYS'
+        ORDER BY ordinal_position""", (schema, table))
+    return [row[0] for row in cur.fetchall()]
+
+
+# --- Cache dei metadati del catalogo ---
+
+# Impronta dello schema di una tabella: ogni DDL (colonne aggiunte, rimosse, rinominate o con tipo
+# diverso, chiave primaria) scrive nuove versioni di queste righe di catalogo e ne cambia lo xmin.
+# ANALYZE e VACUUM aggiornano pg_class sul posto e non la modificano.
+_CATALOG_FINGERPRINT = """(
+    SELECT md5(x.xmin::text || '/' || x.relnatts ||
+               '/' || (SELECT string_agg(f.xmin::text, ',' ORDER BY f.attnum) FROM pg_catalog.pg_attribute f
+                       WHERE f.attrelid = x.oid AND f.attnum > 0) ||
+               '/' || coalesce((SELECT p.xmin::text FROM pg_catalog.pg_index p
+                                WHERE p.indrelid = x.oid AND p.indisprimary), ''))
+    FROM pg_catalog.pg_class x WHERE x.oid = c.oid)"""
+
+
+class CatalogCache:
+    # Metadati (colonne con tipo e NOT NULL, chiave primaria, dimensioni stimate) di molte tabelle
+    # di uno stesso server, letti da pg_catalog con un'unica query invece di una serie di query su
+    # information_schema per ogni tabella. Con `path` la cache viene salvata su disco e riusata nei
+    # run successivi finché system_identifier e versione del catalogo del server coincidono; a ogni
+    # run un'unica query confronta l'impronta di ogni tabella (xmin delle righe di pg_class,
+    # pg_attribute e dell'indice della chiave primaria, che cambia con ogni DDL) e ricarica le voci diverse.
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tables = {}
+        self._server = None
+        self._lock = threading.Lock()
+
+    def _server_key(self, cur):
+        if self._server is None:
+            cur.execute("SELECT system_identifier, catalog_version_no FROM pg_control_system()")
+            self._server = '/'.join(str(value) for value in cur.fetchone())
+        return self._server
+
+    def _read_disk(self, cur):
+        state = _read_json(self.path)
+        if state.get('server') != self._server_key(cur):
+            return
+        entries = {(schema, table): entry for schema, table, entry in state.get('tables', [])}
+        if not entries:
+            return
+        cur.execute(f"""
+            SELECT n.nspname, c.relname, c.relpages, c.reltuples, {_CATALOG_FINGERPRINT}
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE (n.nspname, c.relname) IN (SELECT * FROM unnest(%s::text[], %s::text[]))""",
+                    ([schema for schema, _ in entries], [table for _, table in entries]))
+        stale = len(entries)
+        for schema, table, pages, tuples, fingerprint in cur.fetchall():
+            entry = entries[(schema, table)]
+            if entry.get('fingerprint') == fingerprint:
+                # Le dimensioni stimate arrivano aggiornate con lo stesso controllo
+                entry.update(pages=int(pages), tuples=max(float(tuples), 0.0))
+                self._tables.setdefault((schema, table), entry)
+                stale -= 1
+        if stale:
+            logging.info(f"Catalogo: {stale} tabelle modificate o rimosse dall'ultimo run, metadati da ricaricare")
+
+    def _write_disk(self):
+        tables = [[schema, table, entry] for (schema, table), entry in sorted(self._tables.items())]
+        _write_json(self.path, {'server': self._server, 'tables': tables})
+
+    def load(self, cur, tables):
+        # tables: coppie (schema, tabella); vengono interrogate solo quelle non ancora in cache
+        with self._lock:
+            if self.path and self._server is None:
+                self._read_disk(cur)
+            missing = sorted({(schema, table) for schema, table in tables} - set(self._tables))
+            if not missing:
+                return
+            cur.execute(f"""
+                SELECT n.nspname, c.relname, c.relpages, c.reltuples,
+                       array_agg(a.attname ORDER BY a.attnum), array_agg(t.typname ORDER BY a.attnum),
+                       array_agg(a.attnotnull ORDER BY a.attnum),
+                       array_remove(array_agg(CASE WHEN a.attgenerated <> '' THEN a.attname END ORDER BY a.attnum),
+                                    NULL),
+                       (SELECT array_agg(k.attname ORDER BY array_position(i.indkey::int2[], k.attnum))
+                        FROM pg_catalog.pg_index i
+                        JOIN pg_catalog.pg_attribute k ON k.attrelid = i.indrelid AND k.attnum = ANY(i.indkey)
+                        WHERE i.indrelid = c.oid AND i.indisprimary),
+                       {_CATALOG_FINGERPRINT}
+                FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+                WHERE (n.nspname, c.relname) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+                GROUP BY c.oid, n.nspname, c.relname, c.relpages, c.reltuples""",
+                        ([schema for schema, _ in missing], [table for _, table in missing]))
+            for schema, table, pages, tuples, names, types, not_null, generated, key, fingerprint in cur.fetchall():
+                self._tables[(schema, table)] = {
+                    'columns': [list(column) for column in zip(names, types, not_null)],
+                    'generated': list(generated or []),
+                    'primary_key': list(key or []), 'pages': int(pages), 'tuples': max(float(tuples), 0.0),
+                    'fingerprint': fingerprint}
+            if self.path:
+                self._server_key(cur)
+                self._write_disk()
+            logging.info(f"Catalogo: metadati di {len(missing)} tabelle caricati con una query")
+
+    def refresh(self):
+        with self._lock:
+            self._tables = {}
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def table(self, cur, schema, table):
+        entry = self._tables.get((schema, table))
+        if entry is None:
+            self.load(cur, [(schema, table)])
+            entry = self._tables.get((schema, table))
+            if entry is None:
+                raise ValueError(f"Tabella {schema}.{table} non trovata nel catalogo")
+        return entry
+
+    def columns(self, cur, schema, table):
+        return [name for name, _, _ in self.table(cur, schema, table)['columns']]
+
+    def generated(self, cur, schema, table):
+        return self.table(cur, schema, table).get('generated', [])
+
+    def column_types(self, cur, schema, table, columns):
+        types = {name: typname for name, typname, _ in self.table(cur, schema, table)['columns']}
+        return [types[column] for column in columns]
+
+    def primary_key(self, cur, schema, table):
+        entry = self.table(cur, schema, table)
+        types = {name: typname for name, typname, _ in entry['columns']}
+        return [(name, types[name]) for name in entry['primary_key']]
+
+    def size(self, schema, table):
+        # Solo dai metadati già caricati (load), senza query
+        entry = self._tables.get((schema, table))
+        return (entry['pages'], entry['tuples']) if entry else (0, 0.0)
+
+
+# --- Conversione dei valori Python nel formato di input di COPY ---
+
+_COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _array_literal(values):
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            items.append(_array_literal(value))
+        else:
+            text = _copy_literal(value).replace('\\', '\\\\').replace('"', '\\"')
+            items.append(f'"{text}"')
+    return '{' + ','.join(items) + '}'
+
+
+def _copy_literal(value):
+    # Rappresentazione testuale accettata dalle funzioni di input di PostgreSQL
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return f'{value.days} days {value.seconds} seconds {value.microseconds} microseconds'
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, (list, tuple)):
+        return _array_literal(value)
+    return str(value)
+
+
+def _copy_text_row(row):
+    return '\t'.join(
+        '\\N' if value is None else _copy_literal(value).translate(_COPY_TEXT_ESCAPES)
+        for value in row
+    ) + '\n'
+
+
+def _copy_csv_row(row):
+    # Campo vuoto non quotato = NULL, stringa vuota quotata = ''
+    return ','.join(
+        '' if value is None else '"' + _copy_literal(value).replace('"', '""') + '"'
+        for value in row
+    ) + '\n'
+
+
+# --- Formato binario di COPY (PGCOPY) ---
+
+_PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('!h', -1)
+_PG_EPOCH_DATE = datetime.date(2000, 1, 1)
+_PG_EPOCH = datetime.datetime(2000, 1, 1)
+_PG_EPOCH_UTC = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+_INT16 = struct.Struct('!h')
+_INT32 = struct.Struct('!i')
+_NULL_FIELD = _INT32.pack(-1)
+
+
+def _binary_text(value):
+    return _copy_literal(value).encode('utf-8')
+
+
+def _microseconds(delta):
+    # Aritmetica intera: total_seconds() è un float e perde i microsecondi sulle date lontane
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _binary_timestamptz(value):
+    # I valori senza fuso orario vengono considerati UTC
+    if value.tzinfo is None:
+        return _microseconds(value - _PG_EPOCH)
+    return _microseconds(value - _PG_EPOCH_UTC)
+
+
+def _binary_numeric(value):
+    # Formato binario di numeric: cifre in base 10000 con peso del primo gruppo, segno e scala
+    if not isinstance(value, decimal.Decimal):
+        value = decimal.Decimal(repr(value) if isinstance(value, float) else value)
+    sign, digits, exponent = value.as_tuple()
+    if exponent == 'n' or exponent == 'N':
+        return struct.pack('!hhHh', 0, 0, 0xC000, 0)
+    if exponent == 'F':
+        return struct.pack('!hhHh', 0, 0, 0xF000 if sign else 0xD000, 0)
+    scale = max(0, -exponent)
+    # Allinea la virgola a un multiplo di 4 cifre, poi raggruppa da sinistra
+    pad = exponent % 4
+    text = ''.join(map(str, digits)) + '0' * pad
+    exponent -= pad
+    text = text.zfill(-(-len(text) // 4) * 4)
+    groups = [int(text[i:i + 4]) for i in range(0, len(text), 4)]
+    weight = len(groups) + exponent // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    return struct.pack(f'!hhHh{len(groups)}h', len(groups), weight, 0x4000 if sign else 0, scale, *groups)
+
+
+def _fixed_writer(fmt, convert=None):
+    # Lunghezza e valore impacchettati insieme da una Struct precompilata
+    field = struct.Struct('!i' + fmt)
+    size = field.size - 4
+    pack = field.pack
+    if convert:
+        def write(buf, value):
+            buf += pack(size, convert(value))
+    else:
+        def write(buf, value):
+            buf += pack(size, value)
+    return write
+
+
+def _variable_writer(encode):
+    pack = _INT32.pack
+
+    def write(buf, value):
+        data = encode(value)
+        buf += pack(len(data))
+        buf += data
+    return write
+
+
+def _write_bytea(buf, value):
+    # memoryview: i bytea letti da psycopg2 vengono accodati al buffer senza copie intermedie
+    data = memoryview(value)
+    buf += _INT32.pack(data.nbytes)
+    buf += data
+
+
+# Scrittori per tipo: ognuno accoda al bytearray del chunk lunghezza e valore del campo
+_BINARY_ENCODERS = {
+    'bool': _fixed_writer('?', bool),
+    'int2': _fixed_writer('h'),
+    'int4': _fixed_writer('i'),
+    'int8': _fixed_writer('q'),
+    'float4': _fixed_writer('f'),
+    'float8': _fixed_writer('d'),
+    'bytea': _write_bytea,
+    'text': _variable_writer(_binary_text),
+    'varchar': _variable_writer(_binary_text),
+    'bpchar': _variable_writer(_binary_text),
+    'name': _variable_writer(_binary_text),
+    # psycopg2 decodifica json/jsonb in oggetti Python: si riserializzano come JSON, non come letterali
+    'json': _variable_writer(lambda v: json.dumps(v).encode('utf-8')),
+    'jsonb': _variable_writer(lambda v: b'\x01' + json.dumps(v).encode('utf-8')),
+    'uuid': _fixed_writer('16s', lambda v: (v if isinstance(v, uuid.UUID) else uuid.UUID(str(v))).bytes),
+    'date': _fixed_writer('i', lambda v: (v - _PG_EPOCH_DATE).days),
+    'timestamp': _fixed_writer('q', lambda v: _microseconds(v - _PG_EPOCH)),
+    'timestamptz': _fixed_writer('q', _binary_timestamptz),
+    'time': _fixed_writer('q', lambda v: ((v.hour * 60 + v.minute) * 60 + v.second) * 1000000 + v.microsecond),
+    'numeric': _variable_writer(_binary_numeric),
+}
+
+
+def get_column_types(cur, schema, table, columns, catalog=None):
+    if catalog:
+        return catalog.column_types(cur, schema, table, columns)
+    cur.execute("""
+        SELECT a.attname, t.typname
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped""",
+                (f'"{schema}"."{table}"',))
+    types = dict(cur.fetchall())
+    return [types[column] for column in columns]
+
+
+def get_json_columns(cur, schema, table, catalog=None):
+    if catalog:
+        return {name for name, typname, _ in catalog.table(cur, schema, table)['columns']
+                if typname in ('json', 'jsonb')}
+    cur.execute("""
+        SELECT a.attname FROM pg_catalog.pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+          AND a.atttypid IN ('json'::regtype, 'jsonb'::regtype)""", (f'"{schema}"."{table}"',))
+    return {row[0] for row in cur.fetchall()}
+
+
+def _binary_encoders(column_types):
+    unsupported = [t for t in column_types if t not in _BINARY_ENCODERS]
+    if unsupported:
+        raise ValueError(f"COPY binario non supportato per i tipi: {', '.join(unsupported)} (usa copy_format='text')")
+    return [_BINARY_ENCODERS[t] for t in column_types]
+
+
+def _copy_binary_chunk(rows, encoders):
+    # Tutto il chunk in un unico bytearray, scritto in place dagli scrittori di colonna
+    buf = bytearray(_PGCOPY_HEADER)
+    field_count = _INT16.pack(len(encoders))
+    for row in rows:
+        buf += field_count
+        for value, write in zip(row, encoders):
+            if value is None:
+                buf += _NULL_FIELD
+            else:
+                write(buf, value)
+    buf += _PGCOPY_TRAILER
+    return buf
+
+
+# --- Strategie di caricamento sul target ---
+
+def make_loader(tgt_cur, tgt_schema, tgt_table, columns, load_mode='copy', copy_format='text', page_size=1000,
+                catalog=None):
+    if load_mode not in LOAD_MODES or load_mode == 'passthrough':
+        raise ValueError(f"load_mode non valido: {load_mode} (ammessi: {', '.join(LOAD_MODES)})")
+    if copy_format not in COPY_FORMATS:
+        raise ValueError(f"copy_format non valido: {copy_format} (ammessi: {', '.join(COPY_FORMATS)})")
+    cols_str = ', '.join(columns)
+    target = f'"{tgt_schema}"."{tgt_table}"'
+
+    if load_mode == 'insert':
+        placeholders = ', '.join(['%s'] * len(columns))
+        insert_sql = f'INSERT INTO {target} ({cols_str}) VALUES ({placeholders})'
+
+        def load(cur, rows):
+            for row in rows:
+                cur.execute(insert_sql, row)
+        return load
+
+    if load_mode == 'values':
+        # INSERT multi-riga: page_size record per statement, utilizzabile dove COPY non è permesso
+        values_sql = f'INSERT INTO {target} ({cols_str}) VALUES %s'
 
+        def load(cur, rows):
+            psycopg2.extras.execute_values(cur, values_sql, rows, page_size=page_size)
+        return load
+
+    # Con COPY binario gli encoder seguono i tipi delle colonne del target (uguali nella staging).
+    # In testo e CSV contano solo le colonne json/jsonb: psycopg2 le decodifica in oggetti Python
+    # che vanno riserializzati come JSON, non come letterali (liste come array, bool come t/f)
+    if copy_format == 'binary':
+        encoders = _binary_encoders(get_column_types(tgt_cur, tgt_schema, tgt_table, columns, catalog))
+    else:
+        json_columns = get_json_columns(tgt_cur, tgt_schema, tgt_table, catalog)
+        encoders = [index for index, name in enumerate(columns) if name in json_columns]
+
+    if load_mode == 'upsert':
+        return _upsert_loader(tgt_cur, tgt_schema, tgt_table, columns, copy_format, encoders, catalog)
+
+    return _copy_loader(f"COPY {target} ({cols_str}) FROM STDIN WITH (FORMAT {copy_format})", copy_format, encoders)
+
+
+def _json_fields(rows, json_columns):
+    for row in rows:
+        row = list(row)
+        for index in json_columns:
+            if row[index] is not None:
+                row[index] = json.dumps(row[index])
+        yield row
+
+
+def _copy_loader(copy_sql, copy_format, encoders=None):
+    # encoders: scrittori di colonna in binario, indici delle colonne json/jsonb in testo e CSV
+    if copy_format == 'binary':
+        def load(cur, rows):
+            cur.copy_expert(copy_sql, io.BytesIO(_copy_binary_chunk(rows, encoders)))
+        return load
+
+    encode_row = _copy_csv_row if copy_format == 'csv' else _copy_text_row
+
+    def load(cur, rows):
+        if encoders:
+            rows = _json_fields(rows, encoders)
+        cur.copy_expert(copy_sql, io.StringIO(''.join(map(encode_row, rows))))
+    return load
+
+
+def _upsert_loader(tgt_cur, tgt_schema, tgt_table, columns, copy_format, encoders, catalog=None):
+    # COPY del chunk in una tabella temporanea di staging, poi un unico INSERT ... ON CONFLICT
+    # sulla chiave primaria del target: rieseguire la migrazione non genera chiavi duplicate
+    key_columns = [name for name, _ in get_primary_key(tgt_cur, tgt_schema, tgt_table, catalog)]
+    if not key_columns:
+        raise ValueError(f"load_mode='upsert' richiede una chiave primaria su {tgt_schema}.{tgt_table}")
+    cols_str = ', '.join(columns)
+    target = f'"{tgt_schema}"."{tgt_table}"'
+    staging = f'"pg_temp"."{f"datatransfer_stg_{tgt_table}"[:63]}"'
+    updates = [f'{name} = EXCLUDED.{name}' for name in columns if name not in key_columns]
+    conflict_action = f"DO UPDATE SET {', '.join(updates)}" if updates else 'DO NOTHING'
+    # La staging vive per connessione (ogni worker ha la sua) e si svuota a ogni commit
+    prepare_sql = (f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {target} INCLUDING DEFAULTS) '
+                   f'ON COMMIT DELETE ROWS; TRUNCATE {staging}')
+    # OVERRIDING SYSTEM VALUE: le chiavi GENERATED ALWAYS AS IDENTITY si caricano con i valori della sorgente,
+    # come fa COPY; sulle tabelle senza identity non ha effetto
+    merge_sql = (f'INSERT INTO {target} ({cols_str}) OVERRIDING SYSTEM VALUE SELECT {cols_str} FROM {staging} '
+                 f"ON CONFLICT ({', '.join(key_columns)}) {conflict_action}")
+    stage = _copy_loader(f"COPY {staging} ({cols_str}) FROM STDIN WITH (FORMAT {copy_format})",
+                         copy_format, encoders)
+
+    def load(cur, rows):
+        cur.execute(prepare_sql)
+        stage(cur, rows)
+        cur.execute(merge_sql)
+    return load
+
+
+# --- Passthrough: COPY TO sul sorgente -> COPY FROM sul target senza decodifica ---
+
+class CopyPipe:
+    # Buffer in memoria limitato a max_bytes tra il thread che esegue COPY TO
+    # (write) e il COPY FROM sul target (read)
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._blocks = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._eof = False
+        self._error = None
+        self._aborted = False
+
+    def write(self, data):
+        with self._cond:
+            while self._size >= self.max_bytes and not self._aborted:
+                self._cond.wait()
+            if self._aborted:
+                raise IOError("pipe COPY interrotta dal target")
+            self._blocks.append(memoryview(bytes(data)))
+            self._size += len(data)
+            self._cond.notify_all()
+        return len(data)
+
+    def read(self, size=-1):
+        with self._cond:
+            while not self._blocks and not self._eof:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            if size is None or size < 0:
+                size = self._size
+            out = []
+            taken = 0
+            while self._blocks and taken < size:
+                block = self._blocks[0]
+                if len(block) <= size - taken:
+                    self._blocks.popleft()
+                else:
+                    self._blocks[0] = block[size - taken:]
+                    block = block[:size - taken]
+                out.append(block)
+                taken += len(block)
+            self._size -= taken
+            self._cond.notify_all()
+            return b''.join(out)
+
+    def close(self, error=None):
+        # Fine dello stream; con un errore il lettore fallisce invece di vedere un EOF pulito
+        with self._cond:
+            self._eof = True
+            self._error = error
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._blocks.clear()
+            self._size = 0
+            self._cond.notify_all()
+
+
+def copy_passthrough(src_conn, tgt_cur, select_sql, tgt_schema, tgt_table, columns, copy_format='binary',
+                     buffer_bytes=8 * 1024 * 1024):
+    if copy_format not in COPY_FORMATS:
+        raise ValueError(f"copy_format non valido: {copy_format} (ammessi: {', '.join(COPY_FORMATS)})")
+    cols_str = ', '.join(columns)
+    pipe = CopyPipe(buffer_bytes)
+
+    def produce():
+        cur = src_conn.cursor()
+        try:
+            cur.copy_expert(f"COPY ({select_sql}) TO STDOUT WITH (FORMAT {copy_format})", pipe)
+            pipe.close()
+        except Exception as e:
+            pipe.close(IOError(f"COPY TO sul sorgente fallito: {e}"))
+        finally:
+            cur.close()
+
+    producer = threading.Thread(target=produce, name='datatransfer-copy-out', daemon=True)
+    producer.start()
     try:
-        src_conn = get_connection(source_conf)
-        tgt_conn = get_connection(target_conf)
+        tgt_cur.copy_expert(f'COPY "{tgt_schema}"."{tgt_table}" ({cols_str}) FROM STDIN WITH (FORMAT {copy_format})',
+                            pipe, size=64 * 1024)
+    except Exception:
+        pipe.abort()
+        raise
+    finally:
+        producer.join()
+    return tgt_cur.rowcount
+
+
+# --- Lettura dal sorgente ---
+
+def _row_bytes(row):
+    size = 24
+    for value in row:
+        if isinstance(value, (bytes, bytearray, memoryview, str)):
+            size += len(value) + 4
+        else:
+            size += 8
+    return size
+
+
+class AdaptiveChunker:
+    # Dimensione del fetch adattiva: punta a circa `chunk_bytes` byte per chunk (larghezza media
+    # dei record misurata sui chunk letti) e/o a `chunk_seconds` secondi di scrittura+commit
+    # (throughput misurato sul target). La prima lettura è una sonda di pochi record, così
+    # anche su tabelle con blob di diversi MB la memoria resta piatta fin dall'inizio.
+
+    PROBE_ROWS = 16
+    SAMPLE_ROWS = 64
+
+    def __init__(self, chunk_size=500, chunk_bytes=None, chunk_seconds=None, min_rows=1, max_rows=100000):
+        self.chunk_bytes = chunk_bytes
+        self.chunk_seconds = chunk_seconds
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.size = min(chunk_size, self.PROBE_ROWS) if chunk_bytes else chunk_size
+        self.row_bytes = None
+        self.rows_per_second = None
+
+    def observe_read(self, rows):
+        step = max(1, len(rows) // self.SAMPLE_ROWS)
+        sample = rows[::step]
+        self.row_bytes = sum(map(_row_bytes, sample)) / len(sample)
+        self._resize()
+
+    def observe_write(self, row_count, seconds):
+        if seconds > 0:
+            self.rows_per_second = row_count / seconds
+            self._resize()
+
+    def _resize(self):
+        targets = []
+        if self.chunk_bytes and self.row_bytes:
+            targets.append(self.chunk_bytes / self.row_bytes)
+        if self.chunk_seconds and self.rows_per_second:
+            # Al massimo raddoppio per chunk: i tempi di commit sono rumorosi
+            targets.append(min(self.rows_per_second * self.chunk_seconds, self.size * 2))
+        if targets:
+            self.size = int(max(self.min_rows, min(self.max_rows, *targets)))
+
+
+def read_chunks(cur, chunk_size, server_side=False, chunker=None):
+    rows_iter = iter(cur) if server_side else None
+    while True:
+        size = chunker.size if chunker else chunk_size
+        if server_side:
+            # Cursore con nome: i record arrivano dal server a blocchi di itersize,
+            # la memoria resta limitata al chunk corrente
+            if chunker:
+                cur.itersize = size
+            rows = list(itertools.islice(rows_iter, size))
+        else:
+            rows = cur.fetchmany(size)
+        if not rows:
+            return
+        if chunker:
+            chunker.observe_read(rows)
+        yield rows
+
+
+def prefetch(chunks, depth):
+    # Pipeline lettore/scrittore: il lettore gira in un thread e riempie una coda di al massimo
+    # `depth` chunk, così il fetch del chunk successivo si sovrappone a scrittura e commit
+    pending = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for rows in chunks:
+                if not put((rows, None)):
+                    return
+            put((None, None))
+        except Exception as e:
+            put((None, e))
+
+    reader = threading.Thread(target=produce, name='datatransfer-reader', daemon=True)
+    reader.start()
+    try:
+        while True:
+            rows, error = pending.get()
+            if error is not None:
+                raise error
+            if rows is None:
+                return
+            yield rows
+    finally:
+        stop.set()
+        reader.join()
+
+
+# --- Isolamento dei record errati ---
+
+class RejectFile:
+    # Dead-letter file: un oggetto JSON per riga con il record scartato e l'errore del target
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, label, chunk_num, rejects):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            for row, error in rejects:
+                f.write(json.dumps({
+                    'range': label.strip(),
+                    'chunk': chunk_num,
+                    'error': str(error).strip(),
+                    'row': [_checkpoint_value(value) for value in row],
+                }) + '\n')
+
+
+def bisect_load(tgt_cur, load, rows):
+    # Carica `rows` nella transazione corrente dividendo a metà i blocchi che falliscono, con un
+    # savepoint per tentativo, fino a isolare i singoli record errati. Restituisce (caricati, scartati).
+    rejects = []
+
+    def attempt(batch):
+        tgt_cur.execute("SAVEPOINT datatransfer_bisect")
+        try:
+            load(tgt_cur, batch)
+        except Exception as e:
+            tgt_cur.execute("ROLLBACK TO SAVEPOINT datatransfer_bisect")
+            tgt_cur.execute("RELEASE SAVEPOINT datatransfer_bisect")
+            if len(batch) == 1:
+                rejects.append((batch[0], e))
+                return
+            middle = len(batch) // 2
+            attempt(batch[:middle])
+            attempt(batch[middle:])
+        else:
+            tgt_cur.execute("RELEASE SAVEPOINT datatransfer_bisect")
+
+    if len(rows) == 1:
+        attempt(rows)
+    else:
+        # Il chunk intero è già fallito: si parte direttamente dalle due metà
+        middle = len(rows) // 2
+        attempt(rows[:middle])
+        attempt(rows[middle:])
+    return len(rows) - len(rejects), rejects
+
+
+def transfer_chunks(src_conn, tgt_conn, select_sql, load, chunk_size=500, server_cursor=False, itersize=None,
+                    cursor_name='datatransfer', label='', queue_depth=0, on_commit=None, chunker=None,
+                    params=None, checkpoint=None, rejects=None, on_failure=None):
+    if server_cursor:
+        src_cur = src_conn.cursor(name=cursor_name[:63])
+        src_cur.itersize = itersize or chunk_size
+    else:
         src_cur = src_conn.cursor()
-        tgt_cur = tgt_conn.cursor()
+    tgt_cur = tgt_conn.cursor()
+    src_cur.execute(select_sql, params)
+    chunks = read_chunks(src_cur, chunk_size, server_side=server_cursor, chunker=chunker)
+    if queue_depth > 0:
+        chunks = prefetch(chunks, queue_depth)
+    total = 0
+    chunk_num = 0
+    for rows in chunks:
+        chunk_num += 1
+        logging.info(f"{label}Chunk {chunk_num}: preparo trasferimento di {len(rows)} record")
+        try:
+            started = time.monotonic()
+            load(tgt_cur, rows)
+            tgt_conn.commit()
+        except Exception as e:
+            tgt_conn.rollback()
+            logging.error(f"{label}Chunk {chunk_num}: errore durante l’inserimento (rollback eseguito). Dettaglio: {e}")
+            if rejects:
+                total += _isolate_rejects(tgt_conn, tgt_cur, load, rows, rejects, label, chunk_num,
+                                          checkpoint, on_commit)
+                continue
+            if on_failure:
+                on_failure(chunk_num)
+            # Decidi se vuoi continuare o interrompere:
+            #   continue    -> prosegue con chunk successivo
+            #   sys.exit(1) -> abortisce tutto
+            # Qui si continua, cambia come preferisci
+            continue
+        # Fuori dal try: un errore nel salvataggio del checkpoint non deve trattare come fallito
+        # un chunk già committato
+        if chunker:
+            chunker.observe_write(len(rows), time.monotonic() - started)
+        total += len(rows)
+        logging.info(f"{label}Chunk {chunk_num}: commit completato, totale record trasferiti finora: {total}")
+        if checkpoint:
+            checkpoint(rows)
+        if on_commit:
+            on_commit(len(rows))
+    src_cur.close()
+    tgt_cur.close()
+    return total
+
+
+def _isolate_rejects(tgt_conn, tgt_cur, load, rows, reject_file, label, chunk_num, checkpoint, on_commit):
+    # Secondo tentativo sul chunk fallito: carica i record validi e scrive gli altri nel dead-letter file
+    try:
+        loaded, rejects = bisect_load(tgt_cur, load, rows)
+        tgt_conn.commit()
+    except Exception as e:
+        tgt_conn.rollback()
+        logging.error(f"{label}Chunk {chunk_num}: isolamento dei record errati fallito (rollback eseguito). "
+                      f"Dettaglio: {e}")
+        return 0
+    reject_file.write(label, chunk_num, rejects)
+    logging.warning(f"{label}Chunk {chunk_num}: caricati {loaded} record, {len(rejects)} scartati "
+                    f"in {reject_file.path}")
+    if checkpoint:
+        checkpoint(rows)
+    if on_commit:
+        on_commit(loaded)
+    return loaded
 
-        src_cur.execute(f"""
-            SELECT column_name FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            ORDER BY ordinal_position""", (src_schema, src_table))
-        columns = [row[0] for row in src_cur.fetchall()]
-        cols_str = ', '.join(columns)
-        placeholders = ', '.join(['%s'] * len(columns))
 
-        src_cur.execute(f'SELECT {cols_str} FROM "{src_schema}"."{src_table}"')
+def transfer_passthrough(src_conn, tgt_conn, select_sql, tgt_schema, tgt_table, columns, copy_format='binary',
+                         buffer_bytes=8 * 1024 * 1024, label='', on_commit=None):
+    # Un'unica transazione sul target: i dati non passano mai da tuple Python
+    tgt_cur = tgt_conn.cursor()
+    try:
+        total = copy_passthrough(src_conn, tgt_cur, select_sql, tgt_schema, tgt_table, columns,
+                                 copy_format, buffer_bytes)
+        tgt_conn.commit()
+    except Exception as e:
+        tgt_conn.rollback()
+        logging.error(f"{label}Passthrough: errore durante il COPY (rollback eseguito). Dettaglio: {e}")
+        raise
+    finally:
+        tgt_cur.close()
+    logging.info(f"{label}Passthrough: commit completato, {total} record trasferiti")
+    if on_commit:
+        on_commit(total)
+    return total
+
+
+def repair_range(src_conn, tgt_conn, select_sql, load, tgt_schema, tgt_table, predicate, chunk_size=500,
+                 label='', on_commit=None):
+    # Riallinea un intervallo: cancella e ricopia in un'unica transazione sul target
+    src_cur = src_conn.cursor()
+    tgt_cur = tgt_conn.cursor()
+    try:
+        tgt_cur.execute(f'DELETE FROM "{tgt_schema}"."{tgt_table}" WHERE {predicate}')
+        deleted = tgt_cur.rowcount
+        src_cur.execute(_with_predicate(select_sql, predicate))
         total = 0
-        chunk_num = 0
-        while True:
-            rows = src_cur.fetchmany(chunk_size)
-            if not rows:
-                break
-            chunk_num += 1
-            logging.info(f"Chunk {chunk_num}: preparo trasferimento di {len(rows)} record")
-            insert_sql = f'INSERT INTO "{tgt_schema}"."{tgt_table}" ({cols_str}) VALUES ({placeholders})'
-            try:
-                for idx, row in enumerate(rows, start=1):
-                    tgt_cur.execute(insert_sql, row)
-                tgt_conn.commit()
-                total += len(rows)
-                logging.info(f"Chunk {chunk_num}: commit completato, totale record trasferiti finora: {total}")
-            except Exception as e:
-                tgt_conn.rollback()
-                logging.error(f"Chunk {chunk_num}: errore durante l’inserimento (rollback eseguito). Dettaglio: {e}")
-                # Decidi se vuoi continuare o interrompere:
-                #   continue    -> prosegue con chunk successivo
-                #   sys.exit(1) -> abortisce tutto
-                # Qui si continua, cambia come preferisci
-
-        logging.info(f"Trasferiti in totale {total} record da {src_schema}.{src_table} a {tgt_schema}.{tgt_table}")
+        for rows in read_chunks(src_cur, chunk_size):
+            load(tgt_cur, rows)
+            total += len(rows)
+        tgt_conn.commit()
+    except Exception as e:
+        tgt_conn.rollback()
+        logging.error(f"{label}Sync: errore nel riallineamento di {predicate} (rollback eseguito). Dettaglio: {e}")
+        raise
+    finally:
         src_cur.close()
-        src_conn.close()
         tgt_cur.close()
-        tgt_conn.close()
+    logging.info(f"{label}Sync: {predicate} riallineato, {deleted} record cancellati e {total} ricopiati")
+    if on_commit:
+        on_commit(total)
+    return total
+
+
+# --- Lettura parallela per intervalli con snapshot condiviso ---
+
+_INTEGER_TYPES = ('int2', 'int4', 'int8')
+
+
+def get_primary_key(cur, schema, table, catalog=None):
+    if catalog:
+        return catalog.primary_key(cur, schema, table)
+    cur.execute("""
+        SELECT a.attname, t.typname
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey::int2[], a.attnum)""", (f'"{schema}"."{table}"',))
+    return cur.fetchall()
+
+
+def _split_bounds(low, high, parts):
+    # Estremi [inizio, fine) di al massimo `parts` intervalli che coprono low..high
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, start + step) for start in range(low, high + 1, step)]
+
+
+def plan_ranges(cur, schema, table, workers, catalog=None):
+    # Intervalli sulla chiave primaria intera se presente, altrimenti blocchi di ctid
+    primary_key = get_primary_key(cur, schema, table, catalog)
+    if len(primary_key) == 1 and primary_key[0][1] in _INTEGER_TYPES:
+        key = primary_key[0][0]
+        cur.execute(f'SELECT min({key}), max({key}) FROM "{schema}"."{table}"')
+        low, high = cur.fetchone()
+        if low is None:
+            return [None]
+        bounds = _split_bounds(int(low), int(high), workers)
+        ranges = [f'{key} >= {start} AND {key} < {end}' for start, end in bounds[:-1]]
+        ranges.append(f'{key} >= {bounds[-1][0]}')
+        return ranges
+
+    cur.execute("SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::int",
+                (f'"{schema}"."{table}"',))
+    blocks = int(cur.fetchone()[0])
+    if blocks == 0:
+        return [None]
+    bounds = _split_bounds(0, blocks - 1, workers)
+    ranges = [f"ctid >= '({start},0)'::tid AND ctid < '({end},0)'::tid" for start, end in bounds[:-1]]
+    ranges.append(f"ctid >= '({bounds[-1][0]},0)'::tid")
+    return ranges
+
+
+def _and_predicates(*predicates):
+    predicates = [p for p in predicates if p]
+    if len(predicates) <= 1:
+        return predicates[0] if predicates else None
+    return ' AND '.join(f'({p})' for p in predicates)
+
+
+def _with_predicate(select_sql, predicate):
+    return f'{select_sql} WHERE {predicate}' if predicate else select_sql
+
+
+def migrate_ranges(source_conf, target_conf, snapshot, ranges, transfer, workers, prepare_target=None):
+    # Ogni intervallo ha la sua connessione sorgente (che importa lo snapshot) e la sua connessione target
+    def run(index, predicate):
+        label = f"[intervallo {index}/{len(ranges)}] "
+        src_conn = acquire(source_conf)
+        tgt_conn = acquire(target_conf)
+        try:
+            if prepare_target:
+                prepare_target(tgt_conn)
+            src_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            src_conn.cursor().execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            logging.info(f"{label}Avvio lettura con predicato: {predicate or 'nessuno'}")
+            return transfer(src_conn, tgt_conn, predicate, label)
+        finally:
+            release(source_conf, src_conn)
+            release(target_conf, tgt_conn)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='datatransfer') as pool:
+        futures = [pool.submit(run, index, predicate) for index, predicate in enumerate(ranges, start=1)]
+        return sum(future.result() for future in futures)
+
+
+# --- Checkpoint e ripresa ---
+
+def _checkpoint_value(value):
+    # I valori di chiave non JSON vengono salvati nella loro forma testuale e riconvertiti da PostgreSQL
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return _copy_literal(value)
+
+
+# Un lock per file di stato: checkpoint, watermark e DDL differito sono condivisi dalle tabelle
+# copiate in parallelo da migrate_jobs/migrate_tables
+_JSON_LOCKS = {}
+_JSON_LOCKS_GUARD = threading.Lock()
+
+
+def _json_lock(path):
+    with _JSON_LOCKS_GUARD:
+        return _JSON_LOCKS.setdefault(os.path.abspath(path), threading.RLock())
+
+
+def _write_json(path, data):
+    # File temporaneo univoco nella stessa directory, poi rename atomico
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{name}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _update_json(path, update):
+    # Rilegge il file sotto lock, applica update(stato) e lo riscrive: le voci delle altre tabelle,
+    # scritte nel frattempo, restano. Restituisce il valore di update
+    with _json_lock(path):
+        state = _read_json(path)
+        result = update(state)
+        _write_json(path, state)
+        return result
+
+
+class CheckpointStore:
+    # Stato persistente (file JSON locale) della migrazione: per ogni tabella il piano degli
+    # intervalli e, per ogni intervallo, l'ultima chiave committata, record e byte trasferiti.
+    # Il file viene riscritto in modo atomico dopo ogni commit, aggiornando solo le tabelle di questo
+    # store: più tabelle in parallelo possono usare lo stesso file.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        with _json_lock(path):
+            self._state = _read_json(path)
+
+    def _save(self, table_key):
+        entry = self._state[table_key]
+        _update_json(self.path, lambda state: state.update({table_key: entry}))
+
+    def reset(self, table_key):
+        with self._lock:
+            self._state[table_key] = {'ranges': None, 'progress': {}}
+            self._save(table_key)
+
+    def ranges(self, table_key):
+        with self._lock:
+            return self._state.get(table_key, {}).get('ranges')
+
+    def set_ranges(self, table_key, ranges):
+        with self._lock:
+            self._state.setdefault(table_key, {'ranges': None, 'progress': {}})['ranges'] = ranges
+            self._save(table_key)
+
+    def get(self, table_key, range_key):
+        with self._lock:
+            return dict(self._state.get(table_key, {}).get('progress', {}).get(range_key, {}))
+
+    def _progress(self, table_key, range_key):
+        table = self._state.setdefault(table_key, {'ranges': None, 'progress': {}})
+        return table['progress'].setdefault(range_key, {'last_key': None, 'rows': 0, 'bytes': 0, 'done': False})
+
+    def advance(self, table_key, range_key, key_indexes, rows):
+        last_key = [_checkpoint_value(rows[-1][i]) for i in key_indexes]
+        size = sum(map(_row_bytes, rows))
+        with self._lock:
+            progress = self._progress(table_key, range_key)
+            progress['last_key'] = last_key
+            progress['rows'] += len(rows)
+            progress['bytes'] += size
+            self._save(table_key)
+
+    def finish(self, table_key, range_key):
+        with self._lock:
+            self._progress(table_key, range_key)['done'] = True
+            self._save(table_key)
+
+
+def _keyset_query(select_sql, predicate, key_columns, last_key):
+    # Riparte dopo l'ultima chiave committata, in ordine di chiave, senza riscandire la parte già copiata
+    keys = ', '.join(key_columns)
+    conditions = [f'({predicate})'] if predicate else []
+    params = None
+    if last_key is not None:
+        conditions.append(f"({keys}) > ({', '.join(['%s'] * len(key_columns))})")
+        params = tuple(last_key)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{select_sql}{where} ORDER BY {keys}', params
+
+
+# --- Sincronizzazione incrementale con watermark ---
+
+def _watermark_expression(watermark_column):
+    # xmin è a 32 bit e non è ordinabile: lo si confronta come intero (attenzione al wraparound)
+    return 'xmin::text::bigint' if watermark_column == 'xmin' else watermark_column
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_watermark(path, table_key):
+    return _read_json(path).get(table_key)
+
+
+def write_watermark(path, table_key, value):
+    # Il file è condiviso dalle tabelle di migrate_jobs: si aggiorna solo la voce di questa tabella
+    value = _checkpoint_value(value)
+    _update_json(path, lambda state: state.update({table_key: value}))
+
+
+# --- Indici e vincoli differiti durante il caricamento ---
+
+def get_deferrable_ddl(cur, schema, table):
+    # Indici secondari (esclusi quelli che appartengono a un vincolo) e vincoli unique/exclude/foreign key.
+    # La chiave primaria resta: serve all'upsert e al checkpoint. I vincoli usati da foreign key
+    # di altre tabelle non si possono togliere senza CASCADE e restano anch'essi.
+    relation = f'"{schema}"."{table}"'
+    cur.execute("""
+        SELECT i.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass AND NOT x.indisprimary
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid AND c.conrelid = x.indrelid)
+        ORDER BY i.relname""", (relation,))
+    indexes = [{'name': name, 'definition': definition} for name, definition in cur.fetchall()]
+    cur.execute("""
+        SELECT c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.conrelid = %s::regclass AND c.contype IN ('u', 'x', 'f')
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint r
+                          WHERE r.contype = 'f' AND r.confrelid = c.conrelid AND r.conindid = c.conindid
+                            AND c.contype <> 'f')
+        ORDER BY c.contype DESC, c.conname""", (relation,))
+    constraints = [{'name': name, 'definition': definition} for name, definition in cur.fetchall()]
+    return {'indexes': indexes, 'constraints': constraints}
+
+
+def _merge_ddl(ddl, saved):
+    # Unisce al DDL quello salvato da un run precedente, senza duplicare gli oggetti con lo stesso nome
+    if not saved:
+        return ddl
+    merged = {}
+    for kind in ('indexes', 'constraints'):
+        names = {item['name'] for item in ddl[kind]}
+        merged[kind] = ddl[kind] + [item for item in saved[kind] if item['name'] not in names]
+    return merged
+
+
+def drop_deferred(cur, schema, table, ddl):
+    # IF EXISTS: in ripresa parte degli oggetti può essere già stata rimossa dal run precedente
+    for constraint in ddl['constraints']:
+        cur.execute(f'ALTER TABLE "{schema}"."{table}" DROP CONSTRAINT IF EXISTS "{constraint["name"]}"')
+    for index in ddl['indexes']:
+        cur.execute(f'DROP INDEX IF EXISTS "{schema}"."{index["name"]}"')
+
+
+def rebuild_deferred(target_conf, schema, table, ddl, workers=4, maintenance_work_mem='1GB',
+                     parallel_workers=None):
+    # Indici in parallelo, una connessione ciascuno (CREATE INDEX prende un lock SHARE, compatibile
+    # con gli altri CREATE INDEX), poi i vincoli in sequenza perché ALTER TABLE li serializza comunque.
+    # Gli oggetti già presenti vengono saltati, così la funzione si può rieseguire dopo un errore.
+    def session():
+        conn = acquire(target_conf)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+        if parallel_workers is not None:
+            cur.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false)", (str(parallel_workers),))
+        return conn, cur
+
+    conn, cur = session()
+    try:
+        cur.execute("SELECT relname FROM pg_class WHERE relnamespace = %s::regnamespace AND relkind = 'i'",
+                    (f'"{schema}"',))
+        existing_indexes = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass", (f'"{schema}"."{table}"',))
+        existing_constraints = {row[0] for row in cur.fetchall()}
+    finally:
+        release(target_conf, conn)
+    indexes = [index for index in ddl['indexes'] if index['name'] not in existing_indexes]
+    constraints = [constraint for constraint in ddl['constraints'] if constraint['name'] not in existing_constraints]
+
+    def build(index):
+        conn, cur = session()
+        try:
+            started = time.monotonic()
+            cur.execute(index['definition'])
+            logging.info(f"Indice {index['name']} ricreato in {time.monotonic() - started:.1f}s")
+        finally:
+            release(target_conf, conn)
+
+    if indexes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                   thread_name_prefix='datatransfer-index') as pool:
+            for future in [pool.submit(build, index) for index in indexes]:
+                future.result()
+    if constraints:
+        conn, cur = session()
+        try:
+            for constraint in constraints:
+                started = time.monotonic()
+                cur.execute(f'ALTER TABLE "{schema}"."{table}" ADD CONSTRAINT "{constraint["name"]}" '
+                            f'{constraint["definition"]}')
+                logging.info(f"Vincolo {constraint['name']} ricreato in {time.monotonic() - started:.1f}s")
+        finally:
+            release(target_conf, conn)
+    return len(indexes) + len(constraints)
+
+
+def restore_deferred(target_conf, ddl_file, workers=4, maintenance_work_mem='1GB'):
+    # Ricrea indici e vincoli rimasti nel file dopo un run fallito; restituisce il numero di oggetti ricreati
+    setup_logger()
+    state = _read_json(ddl_file)
+    restored = 0
+    for relation in list(state):
+        schema, table = relation.split('.', 1)
+        restored += rebuild_deferred(target_conf, schema, table, state[relation], workers, maintenance_work_mem)
+        _update_json(ddl_file, lambda current: current.pop(relation, None))
+        logging.info(f"Indici e vincoli di {relation} ripristinati da {ddl_file}")
+    return restored
+
+
+# --- Creazione della tabella target dai metadati della sorgente ---
+
+def get_table_ddl(cur, schema, table):
+    # Definizione della tabella sorgente dal catalogo: colonne (tipo, NOT NULL, default, identity,
+    # colonna generata, sequenza serial), chiave primaria, indici secondari e altri vincoli
+    relation = f'"{schema}"."{table}"'
+    cur.execute("""
+        SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.oid = %s::regclass""", (relation,))
+    qualified = cur.fetchone()[0]
+    cur.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull, pg_get_expr(d.adbin, d.adrelid),
+               a.attidentity, a.attgenerated,
+               (SELECT dep.objid::regclass::text FROM pg_depend dep
+                JOIN pg_class q ON q.oid = dep.objid AND q.relkind = 'S'
+                WHERE dep.refobjid = a.attrelid AND dep.refobjsubid = a.attnum AND dep.deptype = 'a')
+        FROM pg_attribute a LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum""", (relation,))
+    columns = cur.fetchall()
+    cur.execute("""
+        SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'x', 'c', 'f')
+        ORDER BY contype = 'f', conname""", (relation,))
+    constraints = cur.fetchall()
+    cur.execute("""
+        SELECT quote_ident(i.relname), i.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid AND c.conrelid = x.indrelid)
+        ORDER BY i.relname""", (relation,))
+    indexes = cur.fetchall()
+    return {'qualified': qualified, 'columns': columns, 'constraints': constraints, 'indexes': indexes}
+
+
+def _target_name(name, src_table, tgt_table):
+    # Indici e vincoli con il nome della tabella come prefisso seguono il nome della tabella target
+    if src_table != tgt_table and name.startswith(src_table):
+        return (tgt_table + name[len(src_table):])[:63]
+    return name
+
+
+def create_target_table(src_cur, tgt_cur, src_schema, src_table, tgt_schema, tgt_table):
+    # Crea il target con colonne, default, NOT NULL e chiave primaria; restituisce indici e vincoli
+    # secondari (nel formato di rebuild_deferred) da costruire dopo il caricamento.
+    # Se il target esiste già non fa nulla e restituisce None.
+    relation = f'"{tgt_schema}"."{tgt_table}"'
+    tgt_cur.execute("SELECT to_regclass(%s)", (relation,))
+    if tgt_cur.fetchone()[0] is not None:
+        logging.info(f"Creazione target: {tgt_schema}.{tgt_table} esiste già, nessuna modifica")
+        return None
+    ddl = get_table_ddl(src_cur, src_schema, src_table)
+
+    statements = [f'CREATE SCHEMA IF NOT EXISTS "{tgt_schema}"']
+    definitions, owned_sequences = [], []
+    for name, type_name, not_null, default, identity, generated, sequence in ddl['columns']:
+        definition = f'"{name}" {type_name}'
+        if identity:
+            definition += f" GENERATED {'ALWAYS' if identity == 'a' else 'BY DEFAULT'} AS IDENTITY"
+        elif generated:
+            definition += f' GENERATED ALWAYS AS ({default}) STORED'
+        elif sequence:
+            # La sequenza serial della sorgente non esiste sul target: se ne crea una per la colonna
+            target_sequence = f'"{tgt_schema}"."{_swap_name(f"{tgt_table}_{name}", "_seq")}"'
+            sequence_type = f' AS {type_name}' if type_name in ('smallint', 'integer', 'bigint') else ''
+            statements.append(f'CREATE SEQUENCE IF NOT EXISTS {target_sequence}{sequence_type}')
+            owned_sequences.append(f'ALTER SEQUENCE {target_sequence} OWNED BY {relation}."{name}"')
+            definition += f" DEFAULT nextval('{target_sequence}'::regclass)"
+        elif default is not None:
+            definition += f' DEFAULT {default}'
+        if not_null:
+            definition += ' NOT NULL'
+        definitions.append(definition)
+
+    deferred = {'indexes': [], 'constraints': []}
+    for name, contype, definition in ddl['constraints']:
+        name = _target_name(name, src_table, tgt_table)
+        if contype == 'p':
+            definitions.append(f'CONSTRAINT "{name}" {definition}')
+        else:
+            deferred['constraints'].append({'name': name, 'definition': definition})
+    for quoted, name, definition in ddl['indexes']:
+        name = _target_name(name, src_table, tgt_table)
+        definition = (definition.replace(f'INDEX {quoted} ON ', f'INDEX "{name}" ON ', 1)
+                      .replace(f' ON {ddl["qualified"]} USING ', f' ON {relation} USING ', 1))
+        deferred['indexes'].append({'name': name, 'definition': definition})
+
+    statements.append(f'CREATE TABLE {relation} (\n    ' + ',\n    '.join(definitions) + '\n)')
+    for statement in statements + owned_sequences:
+        tgt_cur.execute(statement)
+    logging.info(f"Creazione target: {tgt_schema}.{tgt_table} creata da {src_schema}.{src_table} "
+                 f"({len(definitions)} colonne e vincoli); {len(deferred['indexes'])} indici e "
+                 f"{len(deferred['constraints'])} vincoli rimandati a dopo il caricamento")
+    return deferred
+
+
+# --- Riallineamento di sequenze e identity dopo il caricamento ---
+
+def advance_sequences(cur, tables):
+    # Sequenze serial e identity delle tabelle target (coppie schema, tabella), portate al max della
+    # colonna con un'unica query: max() usa l'indice della colonna se c'è. Le sequenze non tornano
+    # mai indietro e quelle di tabelle vuote restano invariate. Restituisce {sequenza: nuovo valore}.
+    tables = list(tables)
+    if not tables:
+        return {}
+    cur.execute("""
+        SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), quote_ident(a.attname),
+               d.objid::regclass::text
+        FROM pg_depend d
+        JOIN pg_class q ON q.oid = d.objid AND q.relkind = 'S'
+        JOIN pg_class c ON c.oid = d.refobjid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.deptype IN ('a', 'i')
+          AND (n.nspname, c.relname) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+        ORDER BY 1, 2""", ([schema for schema, _ in tables], [table for _, table in tables]))
+    sequences = cur.fetchall()
+    if not sequences:
+        return {}
+    parts, params = [], []
+    for relation, column, sequence in sequences:
+        parts.append(f"""SELECT %s, setval(%s::regclass, m) FROM (SELECT max({column}) AS m FROM {relation}) x
+            WHERE m > coalesce(pg_sequence_last_value(%s::regclass), 0)""")
+        params.extend([sequence, sequence, sequence])
+    cur.execute('\nUNION ALL\n'.join(parts), params)
+    advanced = {sequence: value for sequence, value in cur.fetchall()}
+    logging.info(f"Sequenze: {len(sequences)} controllate, {len(advanced)} avanzate" +
+                 (f" ({', '.join(f'{name}={value}' for name, value in advanced.items())})" if advanced else ''))
+    return advanced
+
+
+# --- Caricamento in tabella UNLOGGED e scambio atomico ---
+
+def _swap_name(name, suffix):
+    # I nomi PostgreSQL sono limitati a 63 byte: si accorcia la parte variabile, non il suffisso
+    return name.encode()[:63 - len(suffix.encode())].decode(errors='ignore') + suffix
+
+
+def prepare_swap(cur, schema, table):
+    # Crea la tabella di appoggio UNLOGGED senza indici e raccoglie dal catalogo tutto ciò che va
+    # ricostruito prima dello scambio: indici (con nome temporaneo), vincoli, trigger, sequenze, grant.
+    relation = f'"{schema}"."{table}"'
+    staging = _swap_name(table, '__dt_new')
+    cur.execute("""
+        SELECT r.conrelid::regclass::text, r.conname FROM pg_constraint r
+        WHERE r.confrelid = %s::regclass AND r.contype = 'f' AND r.conrelid <> r.confrelid
+        UNION ALL
+        SELECT DISTINCT v.oid::regclass::text, 'view' FROM pg_depend d
+        JOIN pg_rewrite w ON w.oid = d.objid JOIN pg_class v ON v.oid = w.ev_class
+        WHERE d.refobjid = %s::regclass AND v.oid <> d.refobjid""", (relation, relation))
+    dependents = cur.fetchall()
+    if dependents:
+        raise ValueError(f"Scambio impossibile: {relation} è referenziata da "
+                         f"{', '.join(f'{name} ({kind})' for name, kind in dependents)}")
+
+    cur.execute("""
+        SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), pg_get_userbyid(c.relowner),
+               c.relowner = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.oid = %s::regclass""", (relation,))
+    qualified, owner, owned = cur.fetchone()
+
+    # Gli indici dei vincoli di esclusione nascono con il vincolo; p/u vengono agganciati con USING INDEX
+    cur.execute("""
+        SELECT quote_ident(i.relname), i.relname, pg_get_indexdef(x.indexrelid), c.conname, c.contype,
+               c.condeferrable, c.condeferred
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+        WHERE x.indrelid = %s::regclass AND (c.contype IS NULL OR c.contype <> 'x')
+        ORDER BY i.relname""", (relation,))
+    indexes, constraints, renames = [], [], []
+    for number, (quoted, name, definition, conname, contype, deferrable, deferred) in enumerate(cur.fetchall(), 1):
+        temp = _swap_name(staging, f'_{number}')
+        definition = (definition.replace(f'INDEX {quoted} ON ', f'INDEX "{temp}" ON ', 1)
+                      .replace(f' ON {qualified} USING ', f' ON "{schema}"."{staging}" USING ', 1))
+        indexes.append({'name': temp, 'definition': definition})
+        if contype:
+            clause = 'PRIMARY KEY' if contype == 'p' else 'UNIQUE'
+            constraints.append({'name': temp, 'definition': f'{clause} USING INDEX "{temp}"' +
+                                (' DEFERRABLE' if deferrable else '') + (' INITIALLY DEFERRED' if deferred else '')})
+            renames.append(f'ALTER TABLE {relation} RENAME CONSTRAINT "{temp}" TO "{conname}"')
+        else:
+            renames.append(f'ALTER INDEX "{schema}"."{temp}" RENAME TO "{name}"')
+
+    cur.execute("""
+        SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('x', 'f') ORDER BY contype DESC, conname""", (relation,))
+    for number, (conname, contype, definition) in enumerate(cur.fetchall(), len(indexes) + 1):
+        if contype == 'x':
+            temp = _swap_name(staging, f'_{number}')
+            constraints.append({'name': temp, 'definition': definition})
+            renames.append(f'ALTER TABLE {relation} RENAME CONSTRAINT "{temp}" TO "{conname}"')
+        else:
+            # Le foreign key in uscita hanno nomi univoci solo per tabella: si usano quelli originali
+            constraints.append({'name': conname, 'definition': definition})
+
+    cur.execute("""
+        SELECT pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = %s::regclass AND NOT tgisinternal ORDER BY tgname""", (relation,))
+    triggers = [definition.replace(f' ON {qualified} ', f' ON "{schema}"."{staging}" ', 1)
+                for definition, in cur.fetchall()]
+
+    # Sequenze legate alle colonne: 'a' = serial (OWNED BY), 'i' = identity
+    cur.execute("""
+        SELECT d.objid::regclass::text, a.attname, d.deptype FROM pg_depend d
+        JOIN pg_class q ON q.oid = d.objid AND q.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = %s::regclass AND d.deptype IN ('a', 'i')""", (relation,))
+    sequences = cur.fetchall()
+
+    cur.execute("""
+        SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE a.grantee::regrole::text END,
+               a.privilege_type, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = %s::regclass AND a.grantee <> c.relowner""",
+                (relation,))
+    grants = [f'GRANT {privilege} ON "{schema}"."{staging}" TO {grantee}' + (' WITH GRANT OPTION' if grantable else '')
+              for grantee, privilege, grantable in cur.fetchall()]
+
+    cur.execute(f'DROP TABLE IF EXISTS "{schema}"."{staging}"')
+    cur.execute(f'CREATE UNLOGGED TABLE "{schema}"."{staging}" (LIKE {relation} INCLUDING ALL EXCLUDING INDEXES)')
+    return {'staging': staging, 'owner': None if owned else owner,
+            'ddl': {'indexes': indexes, 'constraints': constraints}, 'triggers': triggers, 'grants': grants,
+            'sequences': sequences, 'renames': renames}
+
+
+def finish_swap(target_conf, tgt_conn, schema, table, plan, index_workers=4, maintenance_work_mem='1GB',
+                parallel_maintenance_workers=None):
+    # Dopo il caricamento: tabella LOGGED, indici in parallelo, vincoli, trigger e grant sulla tabella
+    # di appoggio; poi una transazione breve sostituisce il target. Fino al commit il target resta leggibile.
+    staging = plan['staging']
+    relation = f'"{schema}"."{table}"'
+    cur = tgt_conn.cursor()
+    started = time.monotonic()
+    cur.execute(f'ALTER TABLE "{schema}"."{staging}" SET LOGGED')
+    tgt_conn.commit()
+    logging.info(f"Swap: {schema}.{staging} resa LOGGED in {time.monotonic() - started:.1f}s")
+    rebuild_deferred(target_conf, schema, staging, plan['ddl'], index_workers, maintenance_work_mem,
+                     parallel_maintenance_workers)
+    for statement in plan['triggers'] + plan['grants']:
+        cur.execute(statement)
+    if plan['owner']:
+        cur.execute(f'ALTER TABLE "{schema}"."{staging}" OWNER TO "{plan["owner"]}"')
+    tgt_conn.commit()
+    cur.execute(f'ANALYZE "{schema}"."{staging}"')
+    tgt_conn.commit()
+
+    try:
+        started = time.monotonic()
+        cur.execute(f'LOCK TABLE {relation} IN ACCESS EXCLUSIVE MODE')
+        for sequence, column, kind in plan['sequences']:
+            if kind == 'a':
+                # La sequenza serial passa alla nuova tabella, altrimenti il DROP la eliminerebbe
+                cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{schema}"."{staging}"."{column}"')
+            else:
+                cur.execute(f"SELECT setval(pg_get_serial_sequence(%s, %s), last_value, is_called) FROM {sequence}",
+                            (f'"{schema}"."{staging}"', column))
+        cur.execute(f'DROP TABLE {relation}')
+        cur.execute(f'ALTER TABLE "{schema}"."{staging}" RENAME TO "{table}"')
+        for statement in plan['renames']:
+            cur.execute(statement)
+        tgt_conn.commit()
+    except Exception:
+        tgt_conn.rollback()
+        raise
+    logging.info(f"Swap: {schema}.{staging} ha sostituito {schema}.{table} "
+                 f"(lock esclusivo per {time.monotonic() - started:.2f}s)")
+
+
+def drop_staging(tgt_conn, schema, plan):
+    try:
+        tgt_conn.rollback()
+        tgt_conn.cursor().execute(f'DROP TABLE IF EXISTS "{schema}"."{plan["staging"]}"')
+        tgt_conn.commit()
+    except Exception as e:
+        logging.warning(f"Swap: rimozione di {schema}.{plan['staging']} non riuscita: {e}")
+
+
+# --- Sospensione dei trigger durante il caricamento ---
+
+_TRIGGER_ENABLE = {'O': 'ENABLE TRIGGER', 'R': 'ENABLE REPLICA TRIGGER', 'A': 'ENABLE ALWAYS TRIGGER'}
+
+
+def get_triggers(cur, schema, table):
+    # (nome, tgenabled, interno) dei trigger della tabella; gli interni sono i controlli delle foreign key
+    cur.execute("""
+        SELECT tgname, tgenabled, tgisinternal FROM pg_trigger
+        WHERE tgrelid = %s::regclass ORDER BY tgname""", (f'"{schema}"."{table}"',))
+    return [(name, enabled, internal) for name, enabled, internal in cur.fetchall()]
+
+
+def set_replication_role(conn, role):
+    # SET è transazionale: il commit evita che il rollback di un chunk fallito lo annulli
+    conn.cursor().execute(f"SET session_replication_role = {role}")
+    conn.commit()
+
+
+def suppress_table_triggers(target_conf, tgt_conn, schema, table, mode):
+    # 'replica': session_replication_role sulla sessione di caricamento, che salta trigger utente
+    # e controlli delle foreign key (richiede superuser o il relativo privilegio).
+    # 'user': ALTER TABLE ... DISABLE TRIGGER per i soli trigger utente attivi, su una connessione
+    # dedicata; è visibile a tutte le sessioni finché restore_table_triggers non li riattiva.
+    # Restituisce i trigger disattivati come (nome, tgenabled).
+    if mode not in TRIGGER_MODES:
+        raise ValueError(f"suppress_triggers non valido: {mode} (ammessi: {', '.join(TRIGGER_MODES)})")
+    cur = tgt_conn.cursor()
+    triggers = get_triggers(cur, schema, table)
+    tgt_conn.commit()
+    if mode == 'replica':
+        suppressed = [(name, enabled) for name, enabled, internal in triggers if enabled == 'O' and not internal]
+        checks = sum(1 for _, enabled, internal in triggers if enabled == 'O' and internal)
+        still_active = [name for name, enabled, _ in triggers if enabled in ('R', 'A')]
+        set_replication_role(tgt_conn, 'replica')
+        logging.info(f"Trigger sospesi su {schema}.{table} (session_replication_role=replica): "
+                     f"{', '.join(name for name, _ in suppressed) or 'nessuno'}; "
+                     f"{checks} trigger interni di foreign key sospesi")
+        if still_active:
+            logging.warning(f"Trigger ENABLE REPLICA/ALWAYS ancora attivi su {schema}.{table}: "
+                            f"{', '.join(still_active)}")
+        return suppressed
+
+    suppressed = [(name, enabled) for name, enabled, internal in triggers if enabled != 'D' and not internal]
+    if suppressed:
+        conn = acquire(target_conf)
+        try:
+            ddl_cur = conn.cursor()
+            for name, _ in suppressed:
+                ddl_cur.execute(f'ALTER TABLE "{schema}"."{table}" DISABLE TRIGGER "{name}"')
+            conn.commit()
+        finally:
+            release(target_conf, conn)
+    logging.info(f"Trigger utente disattivati su {schema}.{table}: "
+                 f"{', '.join(name for name, _ in suppressed) or 'nessuno'}")
+    return suppressed
+
+
+def restore_table_triggers(target_conf, tgt_conn, schema, table, mode, suppressed):
+    if mode == 'replica':
+        # La sessione potrebbe essere già chiusa: in quel caso l'impostazione è scomparsa con lei
+        try:
+            tgt_conn.rollback()
+            tgt_conn.cursor().execute("RESET session_replication_role")
+            tgt_conn.commit()
+        except Exception as e:
+            logging.warning(f"Ripristino di session_replication_role non riuscito: {e}")
+        logging.info(f"session_replication_role ripristinato su {schema}.{table}")
+        return
+    if not suppressed:
+        return
+    # Ogni trigger torna nello stato precedente (ENABLE, ENABLE REPLICA o ENABLE ALWAYS)
+    statements = [f'ALTER TABLE "{schema}"."{table}" {_TRIGGER_ENABLE.get(enabled, "ENABLE TRIGGER")} "{name}"'
+                  for name, enabled in suppressed]
+    try:
+        conn = acquire(target_conf)
+        try:
+            cur = conn.cursor()
+            for statement in statements:
+                cur.execute(statement)
+            conn.commit()
+        finally:
+            release(target_conf, conn)
+    except Exception as e:
+        logging.error(f"Riattivazione dei trigger di {schema}.{table} non riuscita, eseguire a mano: "
+                      f"{'; '.join(statements)}. Dettaglio: {e}")
+        raise
+    logging.info(f"Trigger utente riattivati su {schema}.{table}: {', '.join(name for name, _ in suppressed)}")
+
+
+def transfer_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, chunk_size=500,
+                   load_mode=None, copy_format='text', server_cursor=False, itersize=None,
+                   buffer_bytes=8 * 1024 * 1024, workers=1, queue_depth=0, chunk_bytes=None, chunk_seconds=None,
+                   checkpoint_file=None, resume=False, reject_file=None, page_size=1000,
+                   watermark_column=None, watermark_file='watermarks.json', snapshot=None, on_commit=None,
+                   sync=False, min_range=1000, defer_indexes=False, ddl_file='deferred_ddl.json',
+                   index_workers=4, maintenance_work_mem='1GB', parallel_maintenance_workers=None,
+                   suppress_triggers=None, swap=False, catalog=None, target_catalog=None, create_target=False,
+                   resync_sequences=False):
+    # Come migrate_table, ma restituisce il numero di record e propaga gli errori al chiamante
+    # La sincronizzazione incrementale aggiorna righe già presenti: di default usa l'upsert
+    load_mode = load_mode or ('upsert' if watermark_column else 'copy')
+    # Con il cursore lato client execute() scarica l'intero risultato prima del primo chunk:
+    # il budget in byte limiterebbe solo i batch, non la memoria
+    server_cursor = server_cursor or bool(chunk_bytes)
+    logging.info(f"Avvio migrazione da {src_schema}.{src_table} a {tgt_schema}.{tgt_table} con chunk={chunk_size}, "
+                 f"modalità={load_mode}" + (f"/{copy_format}" if load_mode == 'copy' else '') +
+                 (f"/page_size={page_size}" if load_mode == 'values' else '') +
+                 (", cursore lato server" if server_cursor else '') +
+                 (f", {workers} worker" if workers > 1 else '') +
+                 (f", pipeline con coda di {queue_depth} chunk" if queue_depth > 0 else '') +
+                 (f", chunk adattivo (byte={chunk_bytes}, secondi={chunk_seconds})"
+                  if chunk_bytes or chunk_seconds else '') +
+                 (f", checkpoint su {checkpoint_file}" + (" (ripresa)" if resume else '') if checkpoint_file else '') +
+                 (f", record errati in {reject_file}" if reject_file else '') +
+                 (f", incrementale su {watermark_column}" if watermark_column else '') +
+                 (", sync degli intervalli divergenti" if sync else '') +
+                 (", indici e vincoli differiti" if defer_indexes else '') +
+                 (f", trigger sospesi ({suppress_triggers})" if suppress_triggers else '') +
+                 (", caricamento UNLOGGED con scambio" if swap else '') +
+                 (", creazione del target" if create_target else ''))
+    if swap and (watermark_column or sync or checkpoint_file or defer_indexes or suppress_triggers or
+                 load_mode == 'upsert'):
+        raise ValueError("swap non è compatibile con watermark_column, sync, checkpoint_file, defer_indexes, "
+                         "suppress_triggers e upsert")
+    if sync and (watermark_column or checkpoint_file or load_mode == 'passthrough'):
+        raise ValueError("sync non è compatibile con watermark_column, checkpoint_file e passthrough")
+
+    src_conn = acquire(source_conf)
+    try:
+        tgt_conn = acquire(target_conf)
+        try:
+            if workers > 1 or snapshot:
+                # Lo snapshot esportato resta valido finché questa transazione è aperta
+                src_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            src_cur = src_conn.cursor()
+            tgt_cur = tgt_conn.cursor()
+            if snapshot:
+                # Snapshot esterno (es. quello dello slot di replica): la copia vede esattamente quei dati
+                src_cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+
+            columns = get_columns(src_cur, src_schema, src_table, catalog)
+            created = None
+            if create_target:
+                # Il target nasce senza indici secondari: vengono costruiti in parallelo a fine caricamento.
+                # Il loro DDL va su file prima del commit del CREATE TABLE: se il run si ferma prima della
+                # costruzione, il run successivo (o restore_deferred) li ritrova
+                relation = f'{tgt_schema}.{tgt_table}'
+                created = create_target_table(src_cur, tgt_cur, src_schema, src_table, tgt_schema, tgt_table)
+                if created is not None:
+                    _update_json(ddl_file, lambda state: state.update(
+                        {relation: _merge_ddl(created, state.get(relation))}))
+                else:
+                    created = _read_json(ddl_file).get(relation)
+                    if created is not None:
+                        logging.info(f"Creazione target: indici e vincoli di {relation} non ancora costruiti "
+                                     f"da un run precedente, ripresi da {ddl_file}")
+                tgt_conn.commit()
+            # Un target creato qui ha le colonne generate della sorgente; con target_catalog il controllo è gratuito
+            generated = (get_generated_columns(tgt_cur, tgt_schema, tgt_table, target_catalog)
+                         if create_target or target_catalog else [])
+            if generated:
+                # Il target le calcola da sé: non si leggono dalla sorgente né si caricano
+                logging.info(f"Colonne generate di {tgt_schema}.{tgt_table} escluse dal caricamento: "
+                             f"{', '.join(generated)}")
+                columns = [column for column in columns if column not in generated]
+            cols_str = ', '.join(columns)
+            select_sql = f'SELECT {cols_str} FROM "{src_schema}"."{src_table}"'
+            table_key = f'{src_schema}.{src_table}->{tgt_schema}.{tgt_table}'
+
+            # Filtro comune a tutti gli intervalli (sincronizzazione incrementale)
+            base_filter = None
+            high_water = None
+            failures = []
+            if watermark_column:
+                expression = _watermark_expression(watermark_column)
+                low_water = read_watermark(watermark_file, table_key)
+                # Limite superiore fissato all'inizio: le modifiche successive finiscono nel run seguente
+                src_cur.execute(f'SELECT max({expression}) FROM "{src_schema}"."{src_table}"')
+                high_water = src_cur.fetchone()[0]
+                if high_water is None:
+                    logging.info(f"Incrementale: {src_schema}.{src_table} è vuota, nessun record da trasferire")
+                    return 0
+                conditions = [src_cur.mogrify(f'{expression} <= %s', (high_water,)).decode()]
+                if low_water is not None:
+                    conditions.insert(0, src_cur.mogrify(f'{expression} > %s', (low_water,)).decode())
+                base_filter = ' AND '.join(conditions)
+                logging.info(f"Incrementale: record con {watermark_column} in ({low_water}, {high_water}]")
+
+            store = None
+            if resume and not checkpoint_file:
+                raise ValueError("resume richiede checkpoint_file")
+            if checkpoint_file:
+                key_columns = [name for name, _ in get_primary_key(src_cur, src_schema, src_table, catalog)]
+                if not key_columns:
+                    raise ValueError(f"Il checkpoint richiede una chiave primaria su {src_schema}.{src_table}")
+                key_indexes = [columns.index(name) for name in key_columns]
+                store = CheckpointStore(checkpoint_file)
+                if not resume:
+                    store.reset(table_key)
+
+            swap_plan = None
+            load_table = tgt_table
+            if swap:
+                # Si carica nella tabella di appoggio; il target resta intatto fino allo scambio
+                swap_plan = prepare_swap(tgt_cur, tgt_schema, tgt_table)
+                tgt_conn.commit()
+                load_table = swap_plan['staging']
+                logging.info(f"Swap: caricamento in {tgt_schema}.{load_table} (UNLOGGED, senza indici)")
+
+            def resume_point(predicate, label):
+                # Restituisce (saltare, ultima chiave) per l'intervallo in base al checkpoint
+                if not store:
+                    return False, None
+                progress = store.get(table_key, predicate or '*')
+                if progress.get('done'):
+                    logging.info(f"{label}Intervallo già completato ({progress['rows']} record), salto")
+                    return True, None
+                if progress.get('last_key') is not None:
+                    logging.info(f"{label}Ripresa dopo la chiave {progress['last_key']} "
+                                 f"({progress['rows']} record già trasferiti)")
+                return False, progress.get('last_key')
+
+            # In ripresa si riusa il piano salvato: gli intervalli devono coincidere con i checkpoint
+            ranges = store.ranges(table_key) if store and resume else None
+            if load_mode != 'passthrough':
+                load = make_loader(tgt_cur, tgt_schema, load_table, columns, load_mode, copy_format, page_size,
+                                   target_catalog)
+            if sync:
+                # Solo gli intervalli con checksum diverso vengono cancellati e ricopiati
+                key, mismatches = compare_ranges(source_conf, target_conf, src_schema, src_table, tgt_schema,
+                                                 tgt_table, workers, min_range=min_range)
+                if not mismatches:
+                    logging.info(f"Sync: {src_schema}.{src_table} e {tgt_schema}.{tgt_table} coincidono")
+                    return 0
+                ranges = [f'{key} >= {low} AND {key} < {high}' for low, high in _merge_ranges(mismatches)]
+                logging.info(f"Sync: {len(mismatches)} intervalli divergenti, {len(ranges)} da riallineare")
+
+                def transfer(src, tgt, predicate=None, label=''):
+                    return repair_range(src, tgt, select_sql, load, tgt_schema, tgt_table, predicate,
+                                        chunk_size, label, on_commit)
+            elif load_mode == 'passthrough':
+                def transfer(src, tgt, predicate=None, label=''):
+                    # Il passthrough è atomico per intervallo: in ripresa si salta solo ciò che è completo
+                    skip, _ = resume_point(predicate, label)
+                    if skip:
+                        return 0
+                    sql = _with_predicate(select_sql, _and_predicates(base_filter, predicate))
+                    total = transfer_passthrough(src, tgt, sql, tgt_schema, load_table, columns, copy_format,
+                                                 buffer_bytes, label, on_commit)
+                    if store:
+                        store.finish(table_key, predicate or '*')
+                    return total
+            else:
+                rejects = RejectFile(reject_file) if reject_file else None
+
+                def transfer(src, tgt, predicate=None, label=''):
+                    # Un chunker per flusso di lettura: ogni intervallo misura i propri record
+                    chunker = (AdaptiveChunker(chunk_size, chunk_bytes, chunk_seconds)
+                               if chunk_bytes or chunk_seconds else None)
+                    where = _and_predicates(base_filter, predicate)
+                    sql, params, checkpoint = _with_predicate(select_sql, where), None, None
+                    if store:
+                        skip, last_key = resume_point(predicate, label)
+                        if skip:
+                            return 0
+                        sql, params = _keyset_query(select_sql, where, key_columns, last_key)
+                        checkpoint = functools.partial(store.advance, table_key, predicate or '*', key_indexes)
+                    total = transfer_chunks(src, tgt, sql, load, chunk_size, server_cursor, itersize,
+                                            f'datatransfer_{src_table}', label, queue_depth, on_commit, chunker,
+                                            params, checkpoint, rejects, failures.append)
+                    if store:
+                        store.finish(table_key, predicate or '*')
+                    return total
+
+            deferred = None
+            if defer_indexes or created is not None:
+                # Il DDL viene salvato prima del DROP; se il file lo contiene già (run precedente
+                # fallito) si riusa quello, perché sul target gli oggetti potrebbero essere già stati rimossi.
+                # Un target appena creato non ha ancora oggetti secondari: valgono quelli di create_target_table
+                relation = f'{tgt_schema}.{tgt_table}'
+
+                def save(state):
+                    # Sotto il lock del file, condiviso con le altre tabelle del run
+                    if created is not None:
+                        state[relation] = _merge_ddl(created, state.get(relation))
+                    else:
+                        state[relation] = state.get(relation) or get_deferrable_ddl(tgt_cur, tgt_schema, tgt_table)
+                    return state[relation]
+                deferred = _update_json(ddl_file, save)
+                if created is None:
+                    drop_deferred(tgt_cur, tgt_schema, tgt_table, deferred)
+                    tgt_conn.commit()
+                logging.info(f"Rimandati {len(deferred['indexes'])} indici e {len(deferred['constraints'])} vincoli "
+                             f"di {relation} alla fine del caricamento (DDL in {ddl_file})")
+
+            suppressed = None
+            prepare_target = None
+            if suppress_triggers:
+                # Anche le connessioni dei worker caricano con session_replication_role=replica
+                suppressed = suppress_table_triggers(target_conf, tgt_conn, tgt_schema, tgt_table, suppress_triggers)
+                if suppress_triggers == 'replica':
+                    prepare_target = functools.partial(set_replication_role, role='replica')
+            try:
+                if workers > 1:
+                    if not snapshot:
+                        src_cur.execute("SELECT pg_export_snapshot()")
+                        snapshot = src_cur.fetchone()[0]
+                    if ranges is None:
+                        ranges = plan_ranges(src_cur, src_schema, src_table, workers, catalog)
+                        if store:
+                            store.set_ranges(table_key, ranges)
+                    logging.info(f"Snapshot {snapshot} condiviso, tabella divisa in {len(ranges)} intervalli")
+                    total = migrate_ranges(source_conf, target_conf, snapshot, ranges, transfer, workers,
+                                           prepare_target)
+                elif ranges:
+                    total = sum(transfer(src_conn, tgt_conn, predicate, f"[intervallo {index}/{len(ranges)}] ")
+                                for index, predicate in enumerate(ranges, start=1))
+                else:
+                    total = transfer(src_conn, tgt_conn)
+            except Exception:
+                if swap_plan:
+                    drop_staging(tgt_conn, tgt_schema, swap_plan)
+                raise
+            finally:
+                if suppress_triggers:
+                    restore_table_triggers(target_conf, tgt_conn, tgt_schema, tgt_table, suppress_triggers, suppressed)
+
+            logging.info(f"Trasferiti in totale {total} record da {src_schema}.{src_table} a {tgt_schema}.{tgt_table}")
+            if swap_plan:
+                if failures:
+                    drop_staging(tgt_conn, tgt_schema, swap_plan)
+                    raise RuntimeError(f"Swap annullato: {len(failures)} chunk falliti, "
+                                       f"{tgt_schema}.{tgt_table} non è stata modificata")
+                try:
+                    finish_swap(target_conf, tgt_conn, tgt_schema, tgt_table, swap_plan, index_workers,
+                                maintenance_work_mem, parallel_maintenance_workers)
+                except Exception:
+                    drop_staging(tgt_conn, tgt_schema, swap_plan)
+                    raise
+            if deferred:
+                # Nessuna transazione aperta sul target: ALTER TABLE ... ADD CONSTRAINT richiede lock esclusivi
+                tgt_conn.commit()
+                rebuild_deferred(target_conf, tgt_schema, tgt_table, deferred, index_workers, maintenance_work_mem,
+                                 parallel_maintenance_workers)
+                _update_json(ddl_file, lambda state: state.pop(relation, None))
+            if resync_sequences:
+                advance_sequences(tgt_cur, [(tgt_schema, tgt_table)])
+                tgt_conn.commit()
+            if watermark_column:
+                if failures:
+                    # I chunk scartati andrebbero persi avanzando il watermark: il prossimo run li rilegge
+                    logging.warning(f"Incrementale: {len(failures)} chunk falliti, watermark non aggiornato")
+                else:
+                    write_watermark(watermark_file, table_key, high_water)
+                    logging.info(f"Incrementale: watermark di {table_key} aggiornato a {high_water}")
+            src_cur.close()
+            tgt_cur.close()
+            return total
+        finally:
+            release(target_conf, tgt_conn)
+    finally:
+        release(source_conf, src_conn)
+
+
+def migrate_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, chunk_size=500,
+                  **options):
+    # Le opzioni aggiuntive (load_mode, workers, checkpoint_file, ...) sono quelle di transfer_table
+    setup_logger()
+    try:
+        transfer_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, chunk_size,
+                       **options)
     except Exception as e:
         logging.error(f"Errore grave nella migrazione: {e}")
         sys.exit(1)
 
+
+# --- CDC: replica logica dopo la copia massiva ---
+
+# Una colonna nell'output di test_decoding: nome[tipo]:valore
+_DECODING_COLUMN = re.compile(r"""("(?:[^"]|"")+"|[^\[\s]+)\[((?:[^\[\]]|\[\])+)\]:('(?:[^']|'')*'|\S+)""")
+_DECODING_CHANGE = re.compile(r'^table ("(?:[^"]|"")+"|[^.]+)\.("(?:[^"]|"")+"|[^:]+): (INSERT|UPDATE|DELETE): (.*)$',
+                              re.S)
+# TRUNCATE: table s.a, s.b: TRUNCATE: (no-flags) | restart_seqs | cascade
+_DECODING_TRUNCATE = re.compile(r'^table (.+): TRUNCATE:(.*)$', re.S)
+_DECODING_RELATION = re.compile(r'("(?:[^"]|"")+"|[^.,\s]+)\.("(?:[^"]|"")+"|[^.,\s]+)')
+UNCHANGED_TOAST = object()
+
+
+def _unquote_ident(name):
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def _decoding_columns(text):
+    values = {}
+    for name, _, value in _DECODING_COLUMN.findall(text):
+        if value == 'null':
+            value = None
+        elif value == 'unchanged-toast-datum':
+            value = UNCHANGED_TOAST
+        elif value.startswith("'"):
+            value = value[1:-1].replace("''", "'")
+        values[_unquote_ident(name)] = value
+    return values
+
+
+def parse_test_decoding(payload):
+    # Restituisce None per BEGIN/COMMIT, altrimenti un dict con schema, tabella, operazione,
+    # valori nuovi e (se presenti) vecchi valori di chiave. I valori restano testo: è il target
+    # a convertirli nel tipo della colonna. TRUNCATE riguarda più tabelle: 'relations' le elenca.
+    match = _DECODING_TRUNCATE.match(payload)
+    if match:
+        relations, flags = match.groups()
+        return {'op': 'TRUNCATE', 'restart_seqs': 'restart_seqs' in flags.split(),
+                'relations': [(_unquote_ident(schema), _unquote_ident(table))
+                              for schema, table in _DECODING_RELATION.findall(relations)]}
+    match = _DECODING_CHANGE.match(payload)
+    if not match:
+        return None
+    schema, table, op, data = match.groups()
+    change = {'schema': _unquote_ident(schema), 'table': _unquote_ident(table), 'op': op, 'old': None, 'new': {}}
+    if data.startswith('(no-tuple-data)'):
+        return change
+    if op == 'UPDATE' and data.startswith('old-key: '):
+        old, _, new = data[len('old-key: '):].partition(' new-tuple: ')
+        change['old'] = _decoding_columns(old)
+        change['new'] = _decoding_columns(new)
+    else:
+        change['new'] = _decoding_columns(data)
+    return change
+
+
+def apply_change(cur, change, tgt_schema, tgt_table, key_columns):
+    target = f'"{tgt_schema}"."{tgt_table}"'
+    new = {name: value for name, value in change['new'].items() if value is not UNCHANGED_TOAST}
+    key_source = change['old'] or change['new']
+    if change['op'] != 'INSERT' and any(key not in key_source for key in key_columns):
+        logging.warning(f"CDC: {change['op']} su {change['schema']}.{change['table']} senza chiave "
+                        f"(REPLICA IDENTITY?), ignorato")
+        return
+    where = ' AND '.join(f'{key} = %s' for key in key_columns)
+    key_values = [key_source[key] for key in key_columns]
+
+    if change['op'] == 'INSERT':
+        # Idempotente: una transazione riletta dopo un riavvio non genera chiavi duplicate
+        columns = list(new)
+        updates = [f'{name} = EXCLUDED.{name}' for name in columns if name not in key_columns]
+        conflict_action = f"DO UPDATE SET {', '.join(updates)}" if updates else 'DO NOTHING'
+        cur.execute(f"INSERT INTO {target} ({', '.join(columns)}) OVERRIDING SYSTEM VALUE "
+                    f"VALUES ({', '.join(['%s'] * len(columns))}) "
+                    f"ON CONFLICT ({', '.join(key_columns)}) {conflict_action}", list(new.values()))
+    elif change['op'] == 'UPDATE':
+        # La chiave si assegna solo se è cambiata: una chiave GENERATED ALWAYS AS IDENTITY
+        # accetta in UPDATE solo DEFAULT
+        key_changed = change['old'] and any(key in new and new[key] != change['old'][key] for key in key_columns)
+        assigned = {name: value for name, value in new.items() if key_changed or name not in key_columns}
+        if not assigned:
+            return
+        assignments = ', '.join(f'{name} = %s' for name in assigned)
+        cur.execute(f'UPDATE {target} SET {assignments} WHERE {where}', list(assigned.values()) + key_values)
+    else:
+        cur.execute(f'DELETE FROM {target} WHERE {where}', key_values)
+
+
+def apply_truncate(cur, change):
+    # Solo le tabelle target mappate, in un unico statement; senza CASCADE: le tabelle svuotate in
+    # cascata sulla sorgente compaiono già nel messaggio
+    targets = ', '.join(f'"{schema}"."{table}"' for schema, table in change['targets'])
+    logging.warning(f"CDC: TRUNCATE dalla sorgente applicato a {targets}")
+    cur.execute(f"TRUNCATE {targets}" + (' RESTART IDENTITY' if change['restart_seqs'] else ''))
+
+
+def start_cdc(source_conf, target_conf, tables, slot_name='datatransfer', **options):
+    # Crea lo slot di replica logica (test_decoding) esportandone lo snapshot e copia ogni tabella
+    # esattamente a quello snapshot: le modifiche successive arrivano tutte dallo slot
+    setup_logger()
+    specs = [parse_table_spec(spec) for spec in tables]
+    repl_conn = get_replication_connection(source_conf)
+    try:
+        repl_cur = repl_conn.cursor()
+        repl_cur.execute(f'CREATE_REPLICATION_SLOT "{slot_name}" LOGICAL test_decoding EXPORT_SNAPSHOT')
+        _, consistent_point, snapshot, _ = repl_cur.fetchone()
+        logging.info(f"CDC: slot {slot_name} creato a {consistent_point}, snapshot {snapshot}")
+        # Lo snapshot resta valido finché la connessione di replica non esegue altri comandi
+        totals = {}
+        for src_schema, src_table, tgt_schema, tgt_table in specs:
+            totals[f'{src_schema}.{src_table}'] = transfer_table(
+                source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, snapshot=snapshot,
+                **options)
+        return totals
+    finally:
+        repl_conn.close()
+
+
+def follow_changes(source_conf, target_conf, tables, slot_name='datatransfer', batch_size=1000,
+                   idle_timeout=None, stop=None, poll_interval=1.0):
+    # Legge le modifiche dallo slot e le applica al target a transazioni sorgente intere, raggruppate
+    # fino a batch_size modifiche per transazione target. La posizione viene confermata allo slot
+    # solo dopo il commit sul target. Si ferma quando stop() è vero o dopo idle_timeout secondi senza dati.
+    setup_logger()
+    mapping = {}
+    for src_schema, src_table, tgt_schema, tgt_table in (parse_table_spec(spec) for spec in tables):
+        mapping[(src_schema, src_table)] = (tgt_schema, tgt_table)
+
+    tgt_conn = acquire(target_conf)
+    repl_conn = get_replication_connection(source_conf)
+    try:
+        tgt_cur = tgt_conn.cursor()
+        keys = {}
+        for tgt_schema, tgt_table in mapping.values():
+            keys[(tgt_schema, tgt_table)] = [name for name, _ in get_primary_key(tgt_cur, tgt_schema, tgt_table)]
+            if not keys[(tgt_schema, tgt_table)]:
+                raise ValueError(f"CDC richiede una chiave primaria su {tgt_schema}.{tgt_table}")
+        tgt_conn.commit()
+
+        repl_cur = repl_conn.cursor()
+        repl_cur.start_replication(slot_name=slot_name, decode=True,
+                                   options={'include-xids': '0', 'skip-empty-xacts': '1'})
+        pending = []
+        current = []
+        applied = 0
+        flush_lsn = None
+        last_message = time.monotonic()
+
+        def flush():
+            nonlocal applied, pending
+            if not pending:
+                return
+            for change in pending:
+                if change['op'] == 'TRUNCATE':
+                    apply_truncate(tgt_cur, change)
+                    continue
+                tgt_schema, tgt_table = mapping[(change['schema'], change['table'])]
+                apply_change(tgt_cur, change, tgt_schema, tgt_table, keys[(tgt_schema, tgt_table)])
+            tgt_conn.commit()
+            applied += len(pending)
+            logging.info(f"CDC: applicate {len(pending)} modifiche (totale {applied}), confermato fino a {flush_lsn}")
+            pending = []
+            repl_cur.send_feedback(flush_lsn=flush_lsn)
+
+        while not (stop and stop()):
+            message = repl_cur.read_message()
+            if message is None:
+                if idle_timeout is not None and time.monotonic() - last_message >= idle_timeout:
+                    break
+                flush()
+                select.select([repl_conn], [], [], poll_interval)
+                continue
+            last_message = time.monotonic()
+            if message.payload.startswith('BEGIN'):
+                current = []
+            elif message.payload.startswith('COMMIT'):
+                pending.extend(current)
+                current = []
+                flush_lsn = message.data_start
+                if len(pending) >= batch_size:
+                    flush()
+                elif not pending:
+                    repl_cur.send_feedback(flush_lsn=flush_lsn)
+            else:
+                change = parse_test_decoding(message.payload)
+                if change and change['op'] == 'TRUNCATE':
+                    targets = [mapping[relation] for relation in change['relations'] if relation in mapping]
+                    if targets:
+                        current.append(dict(change, targets=targets))
+                elif change and (change['schema'], change['table']) in mapping:
+                    current.append(change)
+        flush()
+        logging.info(f"CDC: terminato, {applied} modifiche applicate")
+        return applied
+    except Exception:
+        tgt_conn.rollback()
+        raise
+    finally:
+        repl_conn.close()
+        release(target_conf, tgt_conn)
+
+
+def drop_cdc_slot(source_conf, slot_name='datatransfer'):
+    repl_conn = get_replication_connection(source_conf)
+    try:
+        repl_conn.cursor().drop_replication_slot(slot_name)
+    finally:
+        repl_conn.close()
+
+
+# --- Verifica con checksum per intervalli ---
+
+# Stessa rappresentazione testuale delle righe su entrambi i server, qualunque sia la loro configurazione
+_VERIFY_SETTINGS = ("SET TimeZone = 'UTC'; SET DateStyle = 'ISO, YMD'; SET IntervalStyle = 'postgres'; "
+                    "SET extra_float_digits = 3; SET bytea_output = 'hex'")
+
+
+def key_bounds(cur, schema, table, key):
+    cur.execute(f'SELECT min({key}), max({key}) FROM "{schema}"."{table}"')
+    return cur.fetchone()
+
+
+def range_checksum(cur, schema, table, columns, key, low, high):
+    # Numero di righe e somma dei primi 64 bit dell'md5 di ogni riga: calcolati dal server,
+    # indipendenti dall'ordine (niente sort) e con memoria costante; in rete viaggiano due numeri
+    cur.execute(f"""
+        SELECT count(*), coalesce(sum(('x' || substr(md5(ROW({', '.join(columns)})::text), 1, 16))::bit(64)::bigint), 0)
+        FROM "{schema}"."{table}" WHERE {key} >= %s AND {key} < %s""", (low, high))
+    count, digest = cur.fetchone()
+    return int(count), int(digest)
+
+
+def compare_ranges(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, workers=4,
+                   segments=64, min_range=1000, fanout=16):
+    # Confronta i checksum per intervalli di chiave primaria e scende solo negli intervalli diversi,
+    # fino a intervalli di al massimo min_range chiavi. Restituisce (chiave, intervalli divergenti).
+    src_conn = acquire(source_conf)
+    tgt_conn = acquire(target_conf)
+    try:
+        src_cur = src_conn.cursor()
+        tgt_cur = tgt_conn.cursor()
+        columns = get_columns(src_cur, src_schema, src_table)
+        primary_key = get_primary_key(src_cur, src_schema, src_table)
+        if len(primary_key) != 1 or primary_key[0][1] not in _INTEGER_TYPES:
+            raise ValueError(f"La verifica richiede una chiave primaria intera su {src_schema}.{src_table}")
+        key = primary_key[0][0]
+        bounds = [b for b in (key_bounds(src_cur, src_schema, src_table, key),
+                              key_bounds(tgt_cur, tgt_schema, tgt_table, key)) if b[0] is not None]
+    finally:
+        release(source_conf, src_conn)
+        release(target_conf, tgt_conn)
+    if not bounds:
+        return key, []
+    low = min(int(b[0]) for b in bounds)
+    high = max(int(b[1]) for b in bounds)
+
+    # Una connessione per lato e per thread, in autocommit: nessuna transazione lunga
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+    sides = {'source': (source_conf, src_schema, src_table), 'target': (target_conf, tgt_schema, tgt_table)}
+
+    def checksum(side, start, end):
+        conf, schema, table = sides[side]
+        conn = getattr(local, side, None)
+        if conn is None:
+            conn = acquire(conf)
+            conn.autocommit = True
+            conn.cursor().execute(_VERIFY_SETTINGS)
+            setattr(local, side, conn)
+            with opened_lock:
+                opened.append((conf, conn))
+        cur = conn.cursor()
+        try:
+            return range_checksum(cur, schema, table, columns, key, start, end)
+        finally:
+            cur.close()
+
+    mismatches = []
+    pending = _split_bounds(low, high, segments)
+    checked = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers * 2,
+                                                   thread_name_prefix='datatransfer-verify') as pool:
+            while pending:
+                futures = [(start, end, pool.submit(checksum, 'source', start, end),
+                            pool.submit(checksum, 'target', start, end)) for start, end in pending]
+                checked += len(pending)
+                pending = []
+                for start, end, source_future, target_future in futures:
+                    source, target = source_future.result(), target_future.result()
+                    if source == target:
+                        continue
+                    if end - start > min_range:
+                        pending.extend(_split_bounds(start, end - 1, fanout))
+                    else:
+                        mismatches.append({'low': start, 'high': end,
+                                           'source_rows': source[0], 'target_rows': target[0]})
+    finally:
+        for conf, conn in opened:
+            release(conf, conn)
+    logging.info(f"Verifica {src_schema}.{src_table} -> {tgt_schema}.{tgt_table}: {checked} intervalli confrontati, "
+                 f"{len(mismatches)} divergenti")
+    return key, mismatches
+
+
+def _merge_ranges(mismatches):
+    # Intervalli divergenti contigui diventano un solo predicato (una sola transazione di riparazione)
+    merged = []
+    for mismatch in sorted(mismatches, key=lambda m: m['low']):
+        if merged and merged[-1][1] == mismatch['low']:
+            merged[-1][1] = mismatch['high']
+        else:
+            merged.append([mismatch['low'], mismatch['high']])
+    return merged
+
+
+def verify_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, workers=4,
+                 segments=64, min_range=1000):
+    setup_logger()
+    key, mismatches = compare_ranges(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table,
+                                     workers, segments, min_range)
+    for mismatch in mismatches:
+        logging.warning(f"Verifica: {key} in [{mismatch['low']}, {mismatch['high']}) diverge "
+                        f"(sorgente {mismatch['source_rows']} righe, target {mismatch['target_rows']} righe)")
+    return mismatches
+
+
+# --- Migrazione concorrente di più tabelle (asyncio) ---
+
+def _advance_migrated_sequences(target_conf, specs, results):
+    # Un solo passaggio sulle sequenze di tutte le tabelle copiate con successo
+    tables = [(spec[2], spec[3]) for spec in specs if not isinstance(results.get(f'{spec[0]}.{spec[1]}'), Exception)]
+    conn = acquire(target_conf)
+    try:
+        advance_sequences(conn.cursor(), tables)
+        conn.commit()
+    finally:
+        release(target_conf, conn)
+
+
+def preload_catalogs(source_conf, target_conf, specs, catalog=None, target_catalog=None):
+    # Una query per lato con i metadati di tutte le tabelle del run, prima che partano i singoli job
+    for conf, cache, tables in ((source_conf, catalog, [(spec[0], spec[1]) for spec in specs]),
+                                (target_conf, target_catalog, [(spec[2], spec[3]) for spec in specs])):
+        if cache:
+            conn = acquire(conf)
+            try:
+                cache.load(conn.cursor(), tables)
+            finally:
+                release(conf, conn)
+
+
+def parse_table_spec(spec):
+    # 'schema.tabella', 'schema.tabella:schema_dest.tabella_dest' oppure tupla di 2 o 4 elementi
+    if isinstance(spec, str):
+        parts = spec.split(':')
+        if len(parts) > 2:
+            raise ValueError(f"Specifica tabella non valida: {spec}")
+        names = [part.strip().split('.') for part in parts]
+        if any(len(name) != 2 for name in names):
+            raise ValueError(f"Specifica tabella non valida (atteso schema.tabella): {spec}")
+        spec = tuple(names[0] + names[-1])
+    spec = tuple(spec)
+    if len(spec) == 2:
+        spec = spec + spec
+    if len(spec) != 4:
+        raise ValueError(f"Specifica tabella non valida: {spec}")
+    return spec
+
+
+async def migrate_tables(source_conf, target_conf, tables, concurrency=4, on_progress=None, pool_size=None,
+                         resync_sequences=False, **options):
+    # Esegue più transfer_table in parallelo con al massimo `concurrency` tabelle (e quindi
+    # 2 * concurrency connessioni, moltiplicate per `workers` se usato) attive allo stesso tempo.
+    # psycopg2 rilascia il GIL durante l'I/O, per cui ogni copia gira in un thread dedicato.
+    setup_logger()
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                     thread_name_prefix='datatransfer-table')
+    specs = [parse_table_spec(spec) for spec in tables]
+    progress = {f'{s[0]}.{s[1]}': 0 for s in specs}
+
+    def committed(name, rows):
+        progress[name] += rows
+        if on_progress:
+            on_progress(name, progress[name])
+
+    async def run(src_schema, src_table, tgt_schema, tgt_table):
+        name = f'{src_schema}.{src_table}'
+        on_commit = functools.partial(loop.call_soon_threadsafe, committed, name)
+        async with limit:
+            try:
+                total = await loop.run_in_executor(executor, functools.partial(
+                    transfer_table, source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table,
+                    on_commit=on_commit, **options))
+            except Exception as e:
+                logging.error(f"Migrazione di {name} fallita: {e}")
+                return name, e
+        return name, total
+
+    logging.info(f"Avvio migrazione di {len(specs)} tabelle con concorrenza {concurrency}")
+    source_conf, target_conf, pools = _driver_pools(source_conf, target_conf, pool_size)
+    try:
+        await loop.run_in_executor(executor, functools.partial(
+            preload_catalogs, source_conf, target_conf, specs, options.get('catalog'), options.get('target_catalog')))
+        results = await asyncio.gather(*(run(*spec) for spec in specs))
+        if resync_sequences:
+            await loop.run_in_executor(executor, functools.partial(
+                _advance_migrated_sequences, target_conf, specs, dict(results)))
+    finally:
+        executor.shutdown(wait=True)
+        for pool in pools:
+            pool.close()
+    failed = [name for name, result in results if isinstance(result, Exception)]
+    logging.info(f"Migrazione completata: {len(results) - len(failed)} tabelle riuscite, {len(failed)} fallite"
+                 + (f" ({', '.join(failed)})" if failed else ''))
+    return dict(results)
+
+# --- Scheduler multi-tabella (largest-first) ---
+
+def estimate_table_sizes(cur, specs):
+    # Stima da pg_class: (relpages, reltuples) per ogni tabella sorgente, senza scansioni
+    cur.execute("""
+        SELECT n.nspname, c.relname, c.relpages, c.reltuples
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE (n.nspname, c.relname) IN (SELECT * FROM unnest(%s::text[], %s::text[]))""",
+                ([spec[0] for spec in specs], [spec[1] for spec in specs]))
+    sizes = {(schema, table): (int(pages), max(float(tuples), 0.0)) for schema, table, pages, tuples in cur.fetchall()}
+    return [sizes.get((spec[0], spec[1]), (0, 0.0)) for spec in specs]
+
+
+def migrate_jobs(source_conf, target_conf, tables, concurrency=4, pool_size=None, resync_sequences=False,
+                 **options):
+    # LPT: i job partono dal più grande, ognuno dei `concurrency` thread prende il successivo appena si libera.
+    # Le opzioni (compreso `workers`, gli intervalli paralleli di ogni tabella) vanno a transfer_table
+    setup_logger()
+    specs = [parse_table_spec(spec) for spec in tables]
+    source_conf, target_conf, pools = _driver_pools(source_conf, target_conf, pool_size)
+    try:
+        results = _run_jobs(source_conf, target_conf, specs, concurrency, **options)
+        if resync_sequences:
+            _advance_migrated_sequences(target_conf, specs, results)
+        return results
+    finally:
+        for pool in pools:
+            pool.close()
+
+
+def _run_jobs(source_conf, target_conf, specs, concurrency, **options):
+    catalog = options.get('catalog')
+    preload_catalogs(source_conf, target_conf, specs, catalog, options.get('target_catalog'))
+    if catalog:
+        # Le dimensioni arrivano già con i metadati della cache
+        sizes = [catalog.size(spec[0], spec[1]) for spec in specs]
+    else:
+        src_conn = acquire(source_conf)
+        try:
+            sizes = estimate_table_sizes(src_conn.cursor(), specs)
+        finally:
+            release(source_conf, src_conn)
+    jobs = sorted(zip(specs, sizes), key=lambda job: job[1], reverse=True)
+    logging.info(f"Pianificati {len(jobs)} job su {concurrency} thread, ordine: " +
+                 ', '.join(f"{spec[0]}.{spec[1]} ({pages} pagine)" for spec, (pages, _) in jobs))
+
+    def run(src_schema, src_table, tgt_schema, tgt_table):
+        try:
+            return transfer_table(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, **options)
+        except Exception as e:
+            logging.error(f"Migrazione di {src_schema}.{src_table} fallita: {e}")
+            return e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='datatransfer-job') as pool:
+        futures = [(spec, pool.submit(run, *spec)) for spec, _ in jobs]
+        results = {f'{spec[0]}.{spec[1]}': future.result() for spec, future in futures}
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    logging.info(f"Job completati: {len(results) - len(failed)} riusciti, {len(failed)} falliti"
+                 + (f" ({', '.join(failed)})" if failed else ''))
+    return results
+
+
 if __name__ == '__main__':
     # Configurazioni connessione (personalizza qui o carica da file/ambiente)
     source_conf = {
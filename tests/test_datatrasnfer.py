@@ -8,7 +8,13 @@ from unittest.mock import Mock, patch, MagicMock, call
 import sys
 import logging
 import tempfile
+import threading
+import asyncio
 import os
+import json
+import struct
+import datetime
+import decimal
 
 # Import the functions to test
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -260,7 +266,8 @@ class TestMigrateTable(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'test_table',
             'public', 'test_table',
-            chunk_size=10
+            chunk_size=10,
+            load_mode='insert'
         )
         
         # Verify rollback was called
@@ -448,7 +455,8 @@ class TestBlobDataTransfer(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'documents',
             'public', 'documents',
-            chunk_size=10
+            chunk_size=10,
+            load_mode='insert'
         )
         
         # Verify commit was called
@@ -485,7 +493,8 @@ class TestBlobDataTransfer(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'large_files',
             'public', 'large_files',
-            chunk_size=2
+            chunk_size=2,
+            load_mode='insert'
         )
         
         # Verify migration handled large data
@@ -519,7 +528,8 @@ class TestBlobDataTransfer(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'files',
             'public', 'files',
-            chunk_size=10
+            chunk_size=10,
+            load_mode='insert'
         )
         
         # Verify NULL values were preserved
@@ -577,7 +587,8 @@ class TestBlobDataTransfer(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'users',
             'public', 'users',
-            chunk_size=10
+            chunk_size=10,
+            load_mode='insert'
         )
         
         # Verify all data types were handled correctly
@@ -612,7 +623,8 @@ class TestBlobDataTransfer(unittest.TestCase):
             self.source_conf, self.target_conf,
             'public', 'binary_data',
             'public', 'binary_data',
-            chunk_size=10
+            chunk_size=10,
+            load_mode='insert'
         )
         
         # Verify special bytes were handled
@@ -620,5 +632,2253 @@ class TestBlobDataTransfer(unittest.TestCase):
         self.assertTrue(tgt_cur.execute.called)
 
 
+class TestCopyLoadEngine(unittest.TestCase):
+    """Test the COPY FROM STDIN load engine"""
+    
+    def setUp(self):
+        """Set up mocked source and target connections"""
+        self.conf = {'host': 'h', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+        self.src_conn = MagicMock()
+        self.tgt_conn = MagicMock()
+        self.src_cur = MagicMock()
+        self.tgt_cur = MagicMock()
+        self.src_conn.cursor.return_value = self.src_cur
+        self.tgt_conn.cursor.return_value = self.tgt_cur
+        # Capture the COPY payload, since the buffer is consumed by copy_expert
+        self.payloads = []
+        self.tgt_cur.copy_expert.side_effect = lambda sql, f: self.payloads.append((sql, f.read()))
+    
+    def _migrate(self, rows, columns, **kwargs):
+        self.src_cur.fetchall.return_value = [(c,) for c in columns]
+        self.src_cur.fetchmany.side_effect = [rows, []]
+        with patch('datatrasnfer.setup_logger'), \
+                patch('datatrasnfer.get_connection', side_effect=[self.src_conn, self.tgt_conn]):
+            dt.migrate_table(self.conf, self.conf, 'public', 'src', 'public', 'dst', chunk_size=10, **kwargs)
+    
+    def test_copy_is_default_load_mode(self):
+        """Test that chunks are streamed with COPY instead of per-row INSERT"""
+        self._migrate([(1, 'a'), (2, 'b')], ['id', 'name'])
+        
+        self.assertEqual(len(self.payloads), 1)
+        sql, data = self.payloads[0]
+        self.assertIn('COPY "public"."dst" (id, name) FROM STDIN WITH (FORMAT text)', sql)
+        self.assertEqual(data, '1\ta\n2\tb\n')
+        # Only the json/jsonb column lookup, no INSERT
+        self.tgt_cur.execute.assert_called_once()
+        self.assertIn("'json'::regtype", self.tgt_cur.execute.call_args[0][0])
+        self.tgt_conn.commit.assert_called_once()
+    
+    def test_copy_text_escaping_and_nulls(self):
+        """Test text format escaping of NULL, tabs, newlines, backslashes and bytea"""
+        self._migrate([(1, None, 'a\tb\nc\\d', b'\x00\xff')], ['id', 'note', 'body', 'blob'])
+        
+        self.assertEqual(self.payloads[0][1], '1\t\\N\ta\\tb\\nc\\\\d\t\\\\x00ff\n')
+    
+    def test_json_columns_are_serialized_as_json(self):
+        """Test that decoded json/jsonb values are written as JSON in text and CSV"""
+        self.tgt_cur.fetchall.return_value = [('doc',)]
+        self._migrate([(1, [1, 2]), (2, True), (3, 'abc'), (4, None)], ['id', 'doc'])
+        self.assertEqual(self.payloads[0][1], '1\t[1, 2]\n2\ttrue\n3\t"abc"\n4\t\\N\n')
+        
+        self.tgt_conn.reset_mock()
+        self.payloads.clear()
+        self._migrate([(1, {'a': 'x,"y"'})], ['id', 'doc'], copy_format='csv')
+        self.assertEqual(self.payloads[0][1], '"1","{""a"": ""x,\\""y\\""""}"\n')
+    
+    def test_copy_csv_format(self):
+        """Test CSV format distinguishes NULL from empty strings"""
+        self._migrate([(1, None, ''), (2, 'say "hi"', b'\x01')], ['id', 'a', 'b'], copy_format='csv')
+        
+        sql, data = self.payloads[0]
+        self.assertIn('FORMAT csv', sql)
+        self.assertEqual(data, '"1",,""\n"2","say ""hi""","\\x01"\n')
+    
+    def test_copy_binary_format(self):
+        """Test binary format encodes values with the target column types"""
+        # Target catalog lookup for binary encoders
+        self.tgt_cur.fetchall.return_value = [('id', 'int4'), ('blob', 'bytea')]
+        self._migrate([(1, b'\x00\x01'), (2, None)], ['id', 'blob'], copy_format='binary')
+        
+        sql, data = self.payloads[0]
+        self.assertIn('FORMAT binary', sql)
+        self.assertTrue(data.startswith(b'PGCOPY\n\xff\r\n\x00'))
+        self.assertIn(b'\x00\x02\x00\x00\x00\x04\x00\x00\x00\x01\x00\x00\x00\x02\x00\x01', data)
+        self.assertIn(b'\xff\xff\xff\xff', data)  # NULL bytea
+        self.assertTrue(data.endswith(b'\xff\xff'))
+    
+    def test_copy_error_rolls_back_chunk(self):
+        """Test that a failing COPY rolls back the chunk like the INSERT path"""
+        self.tgt_cur.copy_expert.side_effect = Exception("invalid input syntax")
+        self._migrate([(1, 'a')], ['id', 'name'])
+        
+        self.tgt_conn.rollback.assert_called_once()
+        self.tgt_conn.commit.assert_not_called()
+    
+    def test_invalid_load_mode_exits(self):
+        """Test that an unknown load mode aborts the migration"""
+        with self.assertRaises(SystemExit):
+            self._migrate([(1,)], ['id'], load_mode='bogus')
+
+
+class TestServerSideCursor(unittest.TestCase):
+    """Test streaming reads through a named (server-side) cursor"""
+    
+    def setUp(self):
+        """Set up mocked connections with separate client and named cursors"""
+        self.conf = {'host': 'h', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+        self.src_conn = MagicMock()
+        self.tgt_conn = MagicMock()
+        self.meta_cur = MagicMock()
+        self.stream_cur = MagicMock()
+        self.tgt_cur = MagicMock()
+        self.src_conn.cursor.side_effect = lambda name=None: self.stream_cur if name else self.meta_cur
+        self.tgt_conn.cursor.return_value = self.tgt_cur
+        self.meta_cur.fetchall.return_value = [('id',), ('name',)]
+    
+    def _migrate(self, **kwargs):
+        with patch('datatrasnfer.setup_logger'), \
+                patch('datatrasnfer.get_connection', side_effect=[self.src_conn, self.tgt_conn]):
+            dt.migrate_table(self.conf, self.conf, 'public', 'big', 'public', 'big', **kwargs)
+    
+    def test_server_cursor_streams_chunks(self):
+        """Test that rows are read from a named cursor in chunk-sized slices"""
+        self.stream_cur.__iter__.return_value = iter([(i, f'r{i}') for i in range(5)])
+        
+        self._migrate(chunk_size=2, server_cursor=True, itersize=1000)
+        
+        self.src_conn.cursor.assert_any_call(name='datatransfer_big')
+        self.assertEqual(self.stream_cur.itersize, 1000)
+        self.assertIn('SELECT id, name FROM "public"."big"', self.stream_cur.execute.call_args[0][0])
+        self.stream_cur.fetchmany.assert_not_called()
+        # 5 rows with chunk_size=2 -> 3 chunks, 3 commits
+        self.assertEqual(self.tgt_conn.commit.call_count, 3)
+    
+    def test_server_cursor_itersize_defaults_to_chunk_size(self):
+        """Test that itersize falls back to chunk_size"""
+        self.stream_cur.__iter__.return_value = iter([])
+        
+        self._migrate(chunk_size=750, server_cursor=True)
+        
+        self.assertEqual(self.stream_cur.itersize, 750)
+        self.tgt_conn.commit.assert_not_called()
+    
+    def test_client_cursor_is_default(self):
+        """Test that without server_cursor no named cursor is opened"""
+        self.meta_cur.fetchmany.side_effect = [[(1, 'a')], []]
+        
+        self._migrate(chunk_size=10)
+        
+        for c in self.src_conn.cursor.call_args_list:
+            self.assertNotIn('name', c.kwargs)
+        self.tgt_conn.commit.assert_called_once()
+
+
+class TestCopyPassthrough(unittest.TestCase):
+    """Test the COPY TO -> COPY FROM passthrough mode"""
+    
+    def setUp(self):
+        """Set up mocked connections wired to a real CopyPipe"""
+        self.conf = {'host': 'h', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+        self.src_conn = MagicMock()
+        self.tgt_conn = MagicMock()
+        self.src_cur = MagicMock()
+        self.tgt_cur = MagicMock()
+        self.src_conn.cursor.return_value = self.src_cur
+        self.tgt_conn.cursor.return_value = self.tgt_cur
+        self.src_cur.fetchall.return_value = [('id',), ('blob_data',)]
+        self.received = []
+        
+        def copy_in(sql, pipe, size=8192):
+            while True:
+                data = pipe.read(size)
+                if not data:
+                    break
+                self.received.append(data)
+        self.tgt_cur.copy_expert.side_effect = copy_in
+    
+    def _migrate(self, **kwargs):
+        with patch('datatrasnfer.setup_logger'), \
+                patch('datatrasnfer.get_connection', side_effect=[self.src_conn, self.tgt_conn]):
+            dt.migrate_table(self.conf, self.conf, 'public', 'documents', 'public', 'documents',
+                             load_mode='passthrough', **kwargs)
+    
+    def test_passthrough_streams_raw_bytes(self):
+        """Test that the source COPY output reaches the target COPY unchanged"""
+        payload = [b'PGCOPY\n\xff\r\n\x00', b'\x00\x00' * 1000, b'\xff\xff']
+        
+        def copy_out(sql, pipe):
+            for block in payload:
+                pipe.write(block)
+        self.src_cur.copy_expert.side_effect = copy_out
+        
+        self._migrate(copy_format='binary', buffer_bytes=16)
+        
+        out_sql = self.src_cur.copy_expert.call_args[0][0]
+        in_sql = self.tgt_cur.copy_expert.call_args[0][0]
+        self.assertEqual(out_sql, 'COPY (SELECT id, blob_data FROM "public"."documents") TO STDOUT WITH (FORMAT binary)')
+        self.assertEqual(in_sql, 'COPY "public"."documents" (id, blob_data) FROM STDIN WITH (FORMAT binary)')
+        self.assertEqual(b''.join(self.received), b''.join(payload))
+        self.src_cur.fetchmany.assert_not_called()
+        self.tgt_conn.commit.assert_called_once()
+    
+    @patch('sys.exit')
+    def test_passthrough_source_error_rolls_back(self, mock_exit):
+        """Test that a failing COPY TO fails the target COPY instead of committing a partial table"""
+        def copy_out(sql, pipe):
+            pipe.write(b'partial')
+            raise Exception("connection lost")
+        self.src_cur.copy_expert.side_effect = copy_out
+        
+        self._migrate(copy_format='binary')
+        
+        self.tgt_conn.rollback.assert_called_once()
+        self.tgt_conn.commit.assert_not_called()
+        mock_exit.assert_called_once_with(1)
+    
+    def test_pipe_abort_unblocks_writer(self):
+        """Test that aborting the pipe releases a writer blocked on a full buffer"""
+        pipe = dt.CopyPipe(max_bytes=4)
+        pipe.write(b'1234')
+        pipe.abort()
+        
+        with self.assertRaises(IOError):
+            pipe.write(b'5678')
+
+
+class TestParallelRanges(unittest.TestCase):
+    """Test range-partitioned parallel reads sharing an exported snapshot"""
+    
+    def test_split_bounds_covers_whole_range(self):
+        """Test that bounds are contiguous and cover low..high"""
+        bounds = dt._split_bounds(1, 10, 3)
+        self.assertEqual(bounds, [(1, 5), (5, 9), (9, 13)])
+        self.assertEqual(dt._split_bounds(5, 6, 4), [(5, 6), (6, 7)])
+    
+    def test_plan_ranges_by_integer_primary_key(self):
+        """Test that an integer primary key is split into key ranges"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('id', 'int8')]
+        cur.fetchone.return_value = (1, 100)
+        
+        ranges = dt.plan_ranges(cur, 'public', 't', 4)
+        
+        self.assertEqual(ranges, [
+            'id >= 1 AND id < 26', 'id >= 26 AND id < 51', 'id >= 51 AND id < 76', 'id >= 76',
+        ])
+    
+    def test_plan_ranges_falls_back_to_ctid(self):
+        """Test that tables without an integer key are split by ctid block ranges"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('code', 'text')]
+        cur.fetchone.return_value = (10,)
+        
+        ranges = dt.plan_ranges(cur, 'public', 't', 2)
+        
+        self.assertEqual(ranges, ["ctid >= '(0,0)'::tid AND ctid < '(5,0)'::tid", "ctid >= '(5,0)'::tid"])
+    
+    def test_plan_ranges_empty_table(self):
+        """Test that an empty table yields a single unbounded range"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('id', 'int4')]
+        cur.fetchone.return_value = (None, None)
+        
+        self.assertEqual(dt.plan_ranges(cur, 'public', 't', 4), [None])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_table_parallel_workers_share_snapshot(self, mock_setup_logger):
+        """Test that each range runs on its own connections importing the exported snapshot"""
+        source_conf = {'host': 'src', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+        target_conf = {'host': 'tgt', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+        opened = {'src': [], 'tgt': []}
+        
+        def connect(conf):
+            conn = MagicMock()
+            cur = MagicMock()
+            conn.cursor.return_value = cur
+            if conf is source_conf and not opened['src']:
+                # Coordinator: columns, primary key, snapshot and key bounds
+                cur.fetchall.side_effect = [[('id',), ('name',)], [('id', 'int4')]]
+                cur.fetchone.side_effect = [('00000003-0000001B-1',), (1, 90)]
+            else:
+                cur.fetchmany.side_effect = [[(1, 'a'), (2, 'b')], []]
+            opened['src' if conf is source_conf else 'tgt'].append(conn)
+            return conn
+        
+        with patch('datatrasnfer.get_connection', side_effect=connect):
+            dt.migrate_table(source_conf, target_conf, 'public', 't', 'public', 't', workers=3)
+        
+        # One coordinator plus one connection per range on each side
+        self.assertEqual(len(opened['src']), 4)
+        self.assertEqual(len(opened['tgt']), 4)
+        coordinator = opened['src'][0]
+        coordinator.set_session.assert_called_once_with(isolation_level='REPEATABLE READ', readonly=True)
+        predicates = []
+        for conn in opened['src'][1:]:
+            conn.set_session.assert_called_once_with(isolation_level='REPEATABLE READ', readonly=True)
+            executed = [c[0] for c in conn.cursor.return_value.execute.call_args_list]
+            self.assertEqual(executed[0], ("SET TRANSACTION SNAPSHOT %s", ('00000003-0000001B-1',)))
+            predicates.append(executed[1][0].split(' WHERE ')[1])
+            conn.close.assert_called_once()
+        self.assertEqual(sorted(predicates), ['id >= 1 AND id < 31', 'id >= 31 AND id < 61', 'id >= 61'])
+        for conn in opened['tgt'][1:]:
+            conn.commit.assert_called_once()
+
+
+class TestReaderWriterPipeline(unittest.TestCase):
+    """Test the bounded-queue pipeline between the reader and the writer"""
+    
+    def test_prefetch_preserves_order(self):
+        """Test that chunks are yielded in the order they are read"""
+        chunks = [[(i,)] for i in range(20)]
+        
+        self.assertEqual(list(dt.prefetch(iter(chunks), 2)), chunks)
+    
+    def test_prefetch_reads_ahead_up_to_depth(self):
+        """Test that the reader fetches ahead while the writer is busy, bounded by the queue depth"""
+        read = []
+        
+        def chunks():
+            for i in range(10):
+                read.append(i)
+                yield [(i,)]
+        
+        pipeline = dt.prefetch(chunks(), 2)
+        next(pipeline)
+        # One chunk handed to the writer, two queued and one held by the blocked reader
+        for _ in range(50):
+            if len(read) >= 4:
+                break
+            threading.Event().wait(0.01)
+        threading.Event().wait(0.05)
+        self.assertEqual(len(read), 4)
+        pipeline.close()
+    
+    def test_prefetch_propagates_reader_errors(self):
+        """Test that a failing fetch surfaces in the writer"""
+        def chunks():
+            yield [(1,)]
+            raise Exception("server closed the connection")
+        
+        pipeline = dt.prefetch(chunks(), 1)
+        self.assertEqual(next(pipeline), [(1,)])
+        with self.assertRaises(Exception):
+            next(pipeline)
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_table_with_queue_depth(self, mock_get_conn, mock_setup_logger):
+        """Test that migrate_table commits every chunk when the pipeline is enabled"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        src_cur.fetchall.return_value = [('id',)]
+        src_cur.fetchmany.side_effect = [[(1,), (2,)], [(3,), (4,)], [(5,)], []]
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 't', 'public', 't',
+                         chunk_size=2, queue_depth=2)
+        
+        self.assertEqual(tgt_conn.commit.call_count, 3)
+
+
+class TestAsyncMultiTableEngine(unittest.TestCase):
+    """Test concurrent migration of many tables with asyncio"""
+    
+    def test_parse_table_spec(self):
+        """Test the supported table spec formats"""
+        self.assertEqual(dt.parse_table_spec('public.users'), ('public', 'users', 'public', 'users'))
+        self.assertEqual(dt.parse_table_spec('src.a:dst.b'), ('src', 'a', 'dst', 'b'))
+        self.assertEqual(dt.parse_table_spec(('s', 't')), ('s', 't', 's', 't'))
+        self.assertEqual(dt.parse_table_spec(('s', 't', 'd', 'u')), ('s', 't', 'd', 'u'))
+        with self.assertRaises(ValueError):
+            dt.parse_table_spec('users')
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_tables_runs_concurrently_with_limit(self, mock_setup_logger):
+        """Test that tables run concurrently, never above the concurrency limit"""
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+        
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table,
+                          on_commit=None, **options):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            threading.Event().wait(0.05)
+            on_commit(10)
+            on_commit(5)
+            with lock:
+                state['running'] -= 1
+            return 15
+        
+        progress = []
+        tables = [f'public.t{i}' for i in range(6)]
+        with patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            results = asyncio.run(dt.migrate_tables({}, {}, tables, concurrency=2,
+                                                    on_progress=lambda t, n: progress.append((t, n))))
+        
+        self.assertEqual(results, {f'public.t{i}': 15 for i in range(6)})
+        self.assertEqual(state['peak'], 2)
+        self.assertIn(('public.t0', 10), progress)
+        self.assertIn(('public.t0', 15), progress)
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_tables_reports_failures_without_aborting(self, mock_setup_logger):
+        """Test that one failing table does not stop the others"""
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, *args, **kwargs):
+            if src_table == 'bad':
+                raise Exception("relation does not exist")
+            return 1
+        
+        with patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            results = asyncio.run(dt.migrate_tables({}, {}, ['public.ok', 'public.bad'], chunk_size=100))
+        
+        self.assertEqual(results['public.ok'], 1)
+        self.assertIsInstance(results['public.bad'], Exception)
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_tables_uses_migrate_table_chunking(self, mock_get_conn, mock_setup_logger):
+        """Test that each table goes through the same column discovery and chunk loop"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        src_cur.fetchall.return_value = [('id',)]
+        src_cur.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        
+        results = asyncio.run(dt.migrate_tables({}, {}, ['public.t'], chunk_size=2))
+        
+        self.assertEqual(results, {'public.t': 3})
+        self.assertIn('information_schema.columns', src_cur.execute.call_args_list[0][0][0])
+        src_cur.fetchmany.assert_called_with(2)
+        self.assertEqual(tgt_conn.commit.call_count, 2)
+
+
+class TestJobScheduler(unittest.TestCase):
+    """Test the size-aware multi-table job scheduler"""
+    
+    def test_estimate_table_sizes_from_pg_class(self):
+        """Test that sizes come from pg_class and missing tables count as empty"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('public', 'big', 1000, 50000.0), ('public', 'new', 0, -1.0)]
+        specs = [('public', 'big', 'public', 'big'), ('public', 'new', 'public', 'new'),
+                 ('public', 'gone', 'public', 'gone')]
+        
+        sizes = dt.estimate_table_sizes(cur, specs)
+        
+        self.assertIn('pg_class', cur.execute.call_args[0][0])
+        self.assertEqual(cur.execute.call_args[0][1], (['public'] * 3, ['big', 'new', 'gone']))
+        self.assertEqual(sizes, [(1000, 50000.0), (0, 0.0), (0, 0.0)])
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_jobs_runs_largest_first(self, mock_get_conn, mock_setup_logger):
+        """Test LPT ordering: jobs are dispatched from the largest table down"""
+        mock_get_conn.return_value.cursor.return_value.fetchall.return_value = [
+            ('public', 'small', 10, 100.0),
+            ('public', 'large', 5000, 1e6),
+            ('public', 'medium', 300, 9000.0),
+        ]
+        started = []
+        
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, tgt_schema, tgt_table, **options):
+            started.append(src_table)
+            self.assertEqual(options, {'chunk_size': 1000, 'workers': 4})
+            return 1
+        
+        with patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            results = dt.migrate_jobs({}, {}, ['public.small', 'public.large', 'public.medium:arch.medium'],
+                                      concurrency=1, chunk_size=1000, workers=4)
+        
+        self.assertEqual(started, ['large', 'medium', 'small'])
+        self.assertEqual(results, {'public.small': 1, 'public.large': 1, 'public.medium': 1})
+        mock_get_conn.return_value.close.assert_called_once()
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_jobs_keeps_going_after_failure(self, mock_get_conn, mock_setup_logger):
+        """Test that a failing job is reported and the others still run"""
+        mock_get_conn.return_value.cursor.return_value.fetchall.return_value = []
+        
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, *args, **options):
+            if src_table == 'bad':
+                raise Exception("permission denied")
+            return 7
+        
+        with patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            results = dt.migrate_jobs({}, {}, ['public.bad', 'public.good'], concurrency=2)
+        
+        self.assertEqual(results['public.good'], 7)
+        self.assertIsInstance(results['public.bad'], Exception)
+
+
+class TestAdaptiveChunkSizing(unittest.TestCase):
+    """Test byte- and latency-budgeted adaptive chunk sizing"""
+    
+    def test_probe_then_shrink_on_blob_rows(self):
+        """Test that wide blob rows shrink the fetch size to the byte budget"""
+        chunker = dt.AdaptiveChunker(chunk_size=500, chunk_bytes=8 * 1024 * 1024)
+        self.assertEqual(chunker.size, chunker.PROBE_ROWS)
+        
+        blob = b'\x00' * (2 * 1024 * 1024)
+        chunker.observe_read([(i, blob) for i in range(16)])
+        
+        self.assertEqual(chunker.size, 3)
+    
+    def test_grow_on_narrow_rows(self):
+        """Test that narrow rows grow the fetch size up to the byte budget"""
+        chunker = dt.AdaptiveChunker(chunk_size=500, chunk_bytes=1024 * 1024, max_rows=1000000)
+        
+        chunker.observe_read([(i, 'abc') for i in range(16)])
+        
+        # Each row is estimated at 39 bytes (tuple overhead, an int and a short string)
+        self.assertEqual(chunker.size, (1024 * 1024) // 39)
+    
+    def test_never_below_one_row(self):
+        """Test that a single row larger than the budget is still fetched"""
+        chunker = dt.AdaptiveChunker(chunk_size=10, chunk_bytes=1024)
+        
+        chunker.observe_read([(b'x' * 10000,)])
+        
+        self.assertEqual(chunker.size, 1)
+    
+    def test_latency_target(self):
+        """Test that the observed write rate drives the size towards the latency target"""
+        chunker = dt.AdaptiveChunker(chunk_size=1000, chunk_seconds=0.5)
+        
+        chunker.observe_write(1000, 2.0)  # 500 rows/s -> 250 rows per 0.5s
+        self.assertEqual(chunker.size, 250)
+        
+        chunker.observe_write(250, 0.01)  # very fast: growth capped at 2x per chunk
+        self.assertEqual(chunker.size, 500)
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_table_adapts_fetch_size(self, mock_get_conn, mock_setup_logger):
+        """Test that migrate_table fetches with the adapted size after the probe"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        src_cur.fetchall.return_value = [('id',), ('file_data',)]
+        large_binary = b'\x00' * (1024 * 1024)
+        sizes = []
+        
+        def stream():
+            # Server-side cursor: record the fetch size in effect for every row
+            for key in range(20):
+                sizes.append(src_cur.itersize)
+                yield (key, large_binary)
+        src_cur.__iter__.return_value = stream()
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 'large_files', 'public', 'large_files',
+                         chunk_size=500, chunk_bytes=3 * 1024 * 1024)
+        
+        # chunk_bytes implies a named cursor: the whole result set is never pulled into client memory
+        self.assertEqual(src_conn.cursor.call_args[1], {'name': 'datatransfer_large_files'})
+        src_cur.fetchmany.assert_not_called()
+        self.assertEqual(sizes, [16] * 16 + [2] * 4)
+        self.assertEqual(tgt_conn.commit.call_count, 3)
+
+
+class TestCheckpointResume(unittest.TestCase):
+    """Test checkpointing after each commit and keyset-based resume"""
+    
+    def setUp(self):
+        """Create a temporary checkpoint file location"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'checkpoint.json')
+        self.conf = {'host': 'h', 'port': 5432, 'database': 'db', 'user': 'u', 'password': 'p'}
+    
+    def tearDown(self):
+        """Remove the checkpoint file"""
+        for name in os.listdir(self.temp_dir):
+            os.remove(os.path.join(self.temp_dir, name))
+        os.rmdir(self.temp_dir)
+    
+    def test_keyset_query(self):
+        """Test the ordered keyset predicate used to resume"""
+        sql, params = dt._keyset_query('SELECT a, b FROM t', 'a >= 1 AND a < 10', ['a', 'b'], [5, 'x'])
+        
+        self.assertEqual(sql, 'SELECT a, b FROM t WHERE (a >= 1 AND a < 10) AND (a, b) > (%s, %s) ORDER BY a, b')
+        self.assertEqual(params, (5, 'x'))
+        self.assertEqual(dt._keyset_query('SELECT a FROM t', None, ['a'], None), ('SELECT a FROM t ORDER BY a', None))
+    
+    def test_store_persists_progress(self):
+        """Test that progress survives reopening the checkpoint file"""
+        import datetime
+        store = dt.CheckpointStore(self.path)
+        store.reset('s.t->s.t')
+        store.advance('s.t->s.t', '*', [0], [(1, b'ab'), (datetime.date(2025, 1, 2), b'cd')])
+        
+        progress = dt.CheckpointStore(self.path).get('s.t->s.t', '*')
+        
+        self.assertEqual(progress['last_key'], ['2025-01-02'])
+        self.assertEqual(progress['rows'], 2)
+        self.assertGreater(progress['bytes'], 0)
+        self.assertFalse(progress['done'])
+    
+    def test_stores_sharing_a_file_keep_each_other(self):
+        """Test that tables checkpointing into one file do not overwrite each other's progress"""
+        first, second = dt.CheckpointStore(self.path), dt.CheckpointStore(self.path)
+        first.reset('s.a->s.a')
+        second.reset('s.b->s.b')
+        first.advance('s.a->s.a', '*', [0], [(7,)])
+        second.finish('s.b->s.b', '*')
+        
+        reopened = dt.CheckpointStore(self.path)
+        self.assertEqual(reopened.get('s.a->s.a', '*')['last_key'], [7])
+        self.assertTrue(reopened.get('s.b->s.b', '*')['done'])
+    
+    def test_concurrent_writers_leave_valid_file(self):
+        """Test that parallel updates of one state file are serialized and merged"""
+        errors = []
+        
+        def write(index):
+            try:
+                store = dt.CheckpointStore(self.path)
+                for key in range(25):
+                    store.advance(f's.t{index}->s.t{index}', '*', [0], [(key,)])
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        store = dt.CheckpointStore(self.path)
+        for index in range(4):
+            self.assertEqual(store.get(f's.t{index}->s.t{index}', '*')['rows'], 25)
+        self.assertEqual(os.listdir(self.temp_dir), ['checkpoint.json'])
+    
+    def test_failed_checkpoint_save_is_not_a_failed_load(self):
+        """Test that an error after the commit is not retried as a load failure"""
+        load = MagicMock()
+        rejects = MagicMock()
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        
+        with self.assertRaises(OSError):
+            dt.transfer_chunks(src_conn, tgt_conn, 'SELECT id FROM t', load,
+                               checkpoint=MagicMock(side_effect=OSError('disk full')), rejects=rejects)
+        
+        load.assert_called_once()
+        tgt_conn.commit.assert_called_once()
+        tgt_conn.rollback.assert_not_called()
+        rejects.write.assert_not_called()
+    
+    def _migrate(self, fetches, **kwargs):
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        src_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        # Column discovery, then primary key lookup
+        src_cur.fetchall.side_effect = [[('id',), ('name',)], [('id', 'int8')]]
+        src_cur.fetchmany.side_effect = fetches
+        with patch('datatrasnfer.setup_logger'), \
+                patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]):
+            dt.migrate_table(self.conf, self.conf, 'public', 't', 'public', 't', chunk_size=2,
+                             checkpoint_file=self.path, **kwargs)
+        return src_cur, tgt_conn
+    
+    def test_checkpoint_written_after_each_commit(self):
+        """Test that the last committed key is persisted and the read is ordered by key"""
+        src_cur, tgt_conn = self._migrate([[(1, 'a'), (2, 'b')], [(3, 'c')], []])
+        
+        select = src_cur.execute.call_args_list[-1][0]
+        self.assertEqual(select, ('SELECT id, name FROM "public"."t" ORDER BY id', None))
+        with open(self.path) as f:
+            progress = json.load(f)['public.t->public.t']['progress']['*']
+        self.assertEqual(progress['last_key'], [3])
+        self.assertEqual(progress['rows'], 3)
+        self.assertTrue(progress['done'])
+    
+    def test_resume_restarts_after_last_key(self):
+        """Test that resume reads only the rows after the checkpoint"""
+        store = dt.CheckpointStore(self.path)
+        store.reset('public.t->public.t')
+        store.advance('public.t->public.t', '*', [0], [(1, 'a'), (2, 'b')])
+        
+        src_cur, tgt_conn = self._migrate([[(3, 'c')], []], resume=True)
+        
+        select = src_cur.execute.call_args_list[-1][0]
+        self.assertEqual(select, ('SELECT id, name FROM "public"."t" WHERE (id) > (%s) ORDER BY id', (2,)))
+        progress = dt.CheckpointStore(self.path).get('public.t->public.t', '*')
+        self.assertEqual(progress['rows'], 3)
+        self.assertEqual(progress['last_key'], [3])
+    
+    def test_resume_skips_completed_table(self):
+        """Test that a completed range is not read again"""
+        store = dt.CheckpointStore(self.path)
+        store.reset('public.t->public.t')
+        store.finish('public.t->public.t', '*')
+        
+        src_cur, tgt_conn = self._migrate([], resume=True)
+        
+        src_cur.fetchmany.assert_not_called()
+        tgt_conn.commit.assert_not_called()
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    @patch('sys.exit')
+    def test_checkpoint_requires_primary_key(self, mock_exit, mock_get_conn, mock_setup_logger):
+        """Test that checkpointing a table without primary key aborts"""
+        src_cur = mock_get_conn.return_value.cursor.return_value
+        src_cur.fetchall.side_effect = [[('id',)], []]
+        
+        dt.migrate_table(self.conf, self.conf, 'public', 't', 'public', 't', checkpoint_file=self.path)
+        
+        mock_exit.assert_called_once_with(1)
+
+
+class TestBisectingErrorIsolation(unittest.TestCase):
+    """Test isolation of bad rows by bisecting failed chunks"""
+    
+    def setUp(self):
+        """Create a temporary dead-letter file location"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'rejects.jsonl')
+    
+    def tearDown(self):
+        """Remove the dead-letter file"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rmdir(self.temp_dir)
+    
+    @staticmethod
+    def _failing_load(bad_ids, loaded):
+        def load(cur, rows):
+            if any(row[0] in bad_ids for row in rows):
+                raise Exception("duplicate key value violates unique constraint")
+            loaded.extend(rows)
+        return load
+    
+    def test_bisect_load_isolates_bad_rows(self):
+        """Test that only the offending rows are rejected"""
+        cur = MagicMock()
+        loaded = []
+        rows = [(i, f'r{i}') for i in range(1, 101)]
+        
+        count, rejects = dt.bisect_load(cur, self._failing_load({17, 64}, loaded), rows)
+        
+        self.assertEqual(count, 98)
+        self.assertEqual([row[0] for row, _ in rejects], [17, 64])
+        self.assertEqual(sorted(row[0] for row in loaded), [i for i in range(1, 101) if i not in (17, 64)])
+        statements = [c[0][0] for c in cur.execute.call_args_list]
+        self.assertEqual(statements.count('SAVEPOINT datatransfer_bisect'),
+                         statements.count('RELEASE SAVEPOINT datatransfer_bisect'))
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_table_writes_rejects_and_keeps_good_rows(self, mock_get_conn, mock_setup_logger):
+        """Test that a failing chunk commits its good rows and dead-letters the bad one"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        tgt_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        tgt_conn.cursor.return_value = tgt_cur
+        src_cur.fetchall.return_value = [('id',), ('data',)]
+        src_cur.fetchmany.side_effect = [[(1, b'ok'), (2, b'\x00bad'), (3, b'ok'), (4, None)], []]
+        
+        def execute(sql, params=None):
+            if params and params[0] == 2:
+                raise Exception("invalid byte sequence")
+        tgt_cur.execute.side_effect = execute
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 't', 'public', 't', chunk_size=10,
+                         load_mode='insert', reject_file=self.path)
+        
+        tgt_conn.rollback.assert_called_once()
+        tgt_conn.commit.assert_called_once()
+        with open(self.path) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual(len(rejects), 1)
+        self.assertEqual(rejects[0]['row'], [2, '\\x00626164'])
+        self.assertEqual(rejects[0]['chunk'], 1)
+        self.assertIn('invalid byte sequence', rejects[0]['error'])
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_without_reject_file_chunk_is_dropped(self, mock_get_conn, mock_setup_logger):
+        """Test that the original drop-the-chunk behaviour is unchanged by default"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        tgt_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        tgt_conn.cursor.return_value = tgt_cur
+        src_cur.fetchall.return_value = [('id',)]
+        src_cur.fetchmany.side_effect = [[(1,), (2,)], []]
+        tgt_cur.copy_expert.side_effect = Exception("bad row")
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 't', 'public', 't')
+        
+        tgt_conn.commit.assert_not_called()
+        # Only the json/jsonb column lookup, no per-row retry
+        tgt_cur.execute.assert_called_once()
+
+
+class TestValuesBatchInsert(unittest.TestCase):
+    """Test the multi-row INSERT ... VALUES load mode"""
+    
+    @patch('datatrasnfer.psycopg2.extras.execute_values')
+    def test_values_loader_sends_one_batch_per_chunk(self, mock_execute_values):
+        """Test that a chunk is sent through execute_values with the page size"""
+        cur = MagicMock()
+        rows = [(i, f'r{i}') for i in range(500)]
+        
+        load = dt.make_loader(cur, 'public', 'dst', ['id', 'name'], load_mode='values', page_size=250)
+        load(cur, rows)
+        
+        mock_execute_values.assert_called_once_with(
+            cur, 'INSERT INTO "public"."dst" (id, name) VALUES %s', rows, page_size=250)
+        cur.execute.assert_not_called()
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    @patch('datatrasnfer.psycopg2.extras.execute_values')
+    def test_migrate_table_values_mode(self, mock_execute_values, mock_get_conn, mock_setup_logger):
+        """Test that migrate_table commits each chunk loaded in values mode"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = src_conn.cursor.return_value
+        src_cur.fetchall.return_value = [('id',)]
+        src_cur.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 't', 'public', 't', chunk_size=2,
+                         load_mode='values')
+        
+        self.assertEqual(mock_execute_values.call_count, 2)
+        self.assertEqual(mock_execute_values.call_args.kwargs['page_size'], 1000)
+        self.assertEqual(tgt_conn.commit.call_count, 2)
+
+
+class TestUpsertLoadMode(unittest.TestCase):
+    """Test the staging + INSERT ... ON CONFLICT load mode"""
+    
+    def test_upsert_loader_stages_and_merges(self):
+        """Test that a chunk is copied into a temp staging table and merged on the primary key"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('id', 'int4')]
+        
+        load = dt.make_loader(cur, 'public', 'users', ['id', 'name', 'email'], load_mode='upsert')
+        cur.execute.reset_mock()
+        load(cur, [(1, 'Alice', 'a@example.com'), (2, 'Bob', None)])
+        
+        prepare, merge = [c[0][0] for c in cur.execute.call_args_list]
+        self.assertEqual(prepare, 'CREATE TEMP TABLE IF NOT EXISTS "pg_temp"."datatransfer_stg_users" '
+                                  '(LIKE "public"."users" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS; '
+                                  'TRUNCATE "pg_temp"."datatransfer_stg_users"')
+        self.assertEqual(merge, 'INSERT INTO "public"."users" (id, name, email) OVERRIDING SYSTEM VALUE '
+                                'SELECT id, name, email '
+                                'FROM "pg_temp"."datatransfer_stg_users" '
+                                'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, email = EXCLUDED.email')
+        copy_sql = cur.copy_expert.call_args[0][0]
+        self.assertEqual(copy_sql, 'COPY "pg_temp"."datatransfer_stg_users" (id, name, email) '
+                                   'FROM STDIN WITH (FORMAT text)')
+    
+    def test_upsert_key_only_table_does_nothing_on_conflict(self):
+        """Test that a table made only of key columns skips existing rows"""
+        cur = MagicMock()
+        cur.fetchall.return_value = [('user_id', 'int4'), ('group_id', 'int4')]
+        
+        load = dt.make_loader(cur, 'public', 'members', ['user_id', 'group_id'], load_mode='upsert')
+        load(cur, [(1, 2)])
+        
+        self.assertTrue(cur.execute.call_args[0][0].endswith('ON CONFLICT (user_id, group_id) DO NOTHING'))
+    
+    def test_upsert_requires_primary_key(self):
+        """Test that upsert mode refuses targets without a primary key"""
+        cur = MagicMock()
+        cur.fetchall.return_value = []
+        
+        with self.assertRaises(ValueError):
+            dt.make_loader(cur, 'public', 'logs', ['id', 'msg'], load_mode='upsert')
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.get_connection')
+    def test_migrate_table_upsert_commits_per_chunk(self, mock_get_conn, mock_setup_logger):
+        """Test that re-runs merge chunk by chunk with the usual commit semantics"""
+        src_conn = MagicMock()
+        tgt_conn = MagicMock()
+        mock_get_conn.side_effect = [src_conn, tgt_conn]
+        src_cur = MagicMock()
+        tgt_cur = MagicMock()
+        src_conn.cursor.return_value = src_cur
+        tgt_conn.cursor.return_value = tgt_cur
+        src_cur.fetchall.return_value = [('id',), ('name',)]
+        src_cur.fetchmany.side_effect = [[(1, 'a'), (2, 'b')], [(3, 'c')], []]
+        tgt_cur.fetchall.return_value = [('id', 'int8')]
+        
+        dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 't', 'public', 't', chunk_size=2,
+                         load_mode='upsert')
+        
+        merges = [c for c in tgt_cur.execute.call_args_list if 'ON CONFLICT' in c[0][0]]
+        self.assertEqual(len(merges), 2)
+        self.assertEqual(tgt_conn.commit.call_count, 2)
+
+
+class TestIncrementalSync(unittest.TestCase):
+    """Test watermark-based incremental sync"""
+    
+    def setUp(self):
+        """Set up mocked connections and a temporary watermark file"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'watermarks.json')
+        self.src_conn = MagicMock()
+        self.tgt_conn = MagicMock()
+        self.src_cur = MagicMock()
+        self.tgt_cur = MagicMock()
+        self.src_conn.cursor.return_value = self.src_cur
+        self.tgt_conn.cursor.return_value = self.tgt_cur
+        self.src_cur.fetchall.return_value = [('id',), ('updated_at',)]
+        self.src_cur.mogrify.side_effect = lambda sql, params: sql.replace('%s', repr(params[0])).encode()
+        self.tgt_cur.fetchall.return_value = [('id', 'int4')]
+    
+    def tearDown(self):
+        """Remove the watermark file"""
+        for name in os.listdir(self.temp_dir):
+            os.remove(os.path.join(self.temp_dir, name))
+        os.rmdir(self.temp_dir)
+    
+    def _migrate(self, high_water, fetches, **kwargs):
+        self.src_cur.fetchone.return_value = (high_water,)
+        self.src_cur.fetchmany.side_effect = fetches
+        with patch('datatrasnfer.setup_logger'), \
+                patch('datatrasnfer.get_connection', side_effect=[self.src_conn, self.tgt_conn]):
+            dt.migrate_table({'host': 'h'}, {'host': 'h'}, 'public', 'orders', 'public', 'orders',
+                             watermark_column='updated_at', watermark_file=self.path, **kwargs)
+    
+    def _select(self):
+        return [c[0][0] for c in self.src_cur.execute.call_args_list if c[0][0].startswith('SELECT id')][-1]
+    
+    def test_first_run_copies_up_to_high_water_and_stores_it(self):
+        """Test that the first run reads everything up to the current maximum"""
+        self._migrate('2025-01-31 23:00:00', [[(1, '2025-01-01')], []])
+        
+        self.assertIn("SELECT max(updated_at) FROM \"public\".\"orders\"",
+                      [c[0][0] for c in self.src_cur.execute.call_args_list])
+        self.assertTrue(self._select().endswith("WHERE updated_at <= '2025-01-31 23:00:00'"))
+        self.assertEqual(dt.read_watermark(self.path, 'public.orders->public.orders'), '2025-01-31 23:00:00')
+        # Incremental runs merge into the target by default
+        self.assertTrue(any('ON CONFLICT (id)' in c[0][0] for c in self.tgt_cur.execute.call_args_list))
+    
+    def test_next_run_reads_only_rows_above_watermark(self):
+        """Test that later runs only read the changed rows"""
+        dt.write_watermark(self.path, 'public.orders->public.orders', '2025-01-31 23:00:00')
+        
+        self._migrate('2025-02-01 23:00:00', [[(7, '2025-02-01')], []])
+        
+        self.assertTrue(self._select().endswith(
+            "WHERE updated_at > '2025-01-31 23:00:00' AND updated_at <= '2025-02-01 23:00:00'"))
+        self.assertEqual(dt.read_watermark(self.path, 'public.orders->public.orders'), '2025-02-01 23:00:00')
+    
+    def test_failed_chunk_keeps_old_watermark(self):
+        """Test that the watermark does not advance past rows that were not loaded"""
+        dt.write_watermark(self.path, 'public.orders->public.orders', 10)
+        self.tgt_cur.copy_expert.side_effect = Exception("deadlock detected")
+        
+        self._migrate(20, [[(11, 'x')], []])
+        
+        self.assertEqual(dt.read_watermark(self.path, 'public.orders->public.orders'), 10)
+    
+    def test_parallel_tables_keep_their_watermarks(self):
+        """Test that concurrent tables sharing the watermark file do not lose each other's marks"""
+        def write(index):
+            for value in range(50):
+                dt.write_watermark(self.path, f'public.t{index}->public.t{index}', value)
+        
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        for index in range(4):
+            self.assertEqual(dt.read_watermark(self.path, f'public.t{index}->public.t{index}'), 49)
+        self.assertEqual(os.listdir(self.temp_dir), ['watermarks.json'])
+    
+    def test_xmin_watermark_expression(self):
+        """Test that xmin is compared as an integer"""
+        self.assertEqual(dt._watermark_expression('xmin'), 'xmin::text::bigint')
+        self.assertEqual(dt._watermark_expression('updated_at'), 'updated_at')
+
+
+class TestLogicalReplicationCDC(unittest.TestCase):
+    """Test the logical replication CDC follower"""
+    
+    def test_parse_test_decoding_insert(self):
+        """Test parsing of an INSERT with quoted, NULL and array values"""
+        change = dt.parse_test_decoding(
+            "table public.data: INSERT: id[integer]:1 data[text]:'it''s here' "
+            "ts[timestamp without time zone]:'2025-01-01 10:00:00' tags[text[]]:'{a,b}' note[text]:null")
+        
+        self.assertEqual(change['op'], 'INSERT')
+        self.assertEqual((change['schema'], change['table']), ('public', 'data'))
+        self.assertEqual(change['new'], {'id': '1', 'data': "it's here", 'ts': '2025-01-01 10:00:00',
+                                         'tags': '{a,b}', 'note': None})
+    
+    def test_parse_test_decoding_update_with_old_key(self):
+        """Test parsing of a key-changing UPDATE with quoted identifiers and unchanged TOAST"""
+        change = dt.parse_test_decoding(
+            'table "My Schema"."Items": UPDATE: old-key: id[integer]:1 new-tuple: id[integer]:2 '
+            '"Long Text"[text]:unchanged-toast-datum')
+        
+        self.assertEqual((change['schema'], change['table']), ('My Schema', 'Items'))
+        self.assertEqual(change['old'], {'id': '1'})
+        self.assertIs(change['new']['Long Text'], dt.UNCHANGED_TOAST)
+    
+    def test_parse_test_decoding_ignores_transaction_markers(self):
+        """Test that BEGIN and COMMIT are not changes"""
+        self.assertIsNone(dt.parse_test_decoding('BEGIN'))
+        self.assertIsNone(dt.parse_test_decoding('COMMIT'))
+    
+    def test_parse_test_decoding_truncate(self):
+        """Test that TRUNCATE messages list every truncated relation and the flags"""
+        change = dt.parse_test_decoding('table public.items, "Sales"."Order ""x""": TRUNCATE: restart_seqs cascade')
+        self.assertEqual(change, {'op': 'TRUNCATE', 'restart_seqs': True,
+                                  'relations': [('public', 'items'), ('Sales', 'Order "x"')]})
+        change = dt.parse_test_decoding('table public.items: TRUNCATE: (no-flags)')
+        self.assertFalse(change['restart_seqs'])
+    
+    def test_apply_change_statements(self):
+        """Test the statements generated for insert, update and delete"""
+        cur = MagicMock()
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'INSERT', 'old': None,
+                              'new': {'id': '1', 'name': 'a'}}, 'd', 't', ['id'])
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'UPDATE', 'old': {'id': '1'},
+                              'new': {'id': '2', 'name': 'b', 'blob': dt.UNCHANGED_TOAST}}, 'd', 't', ['id'])
+        # Unchanged key: without an old tuple, or with REPLICA IDENTITY FULL
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'UPDATE', 'old': None,
+                              'new': {'id': '2', 'name': 'c'}}, 'd', 't', ['id'])
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'UPDATE', 'old': {'id': '2', 'name': 'c'},
+                              'new': {'id': '2', 'name': 'd'}}, 'd', 't', ['id'])
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'UPDATE', 'old': None,
+                              'new': {'id': '2'}}, 'd', 't', ['id'])
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'DELETE', 'old': None,
+                              'new': {'id': '2'}}, 'd', 't', ['id'])
+        dt.apply_change(cur, {'schema': 's', 'table': 't', 'op': 'DELETE', 'old': None, 'new': {}}, 'd', 't', ['id'])
+        
+        self.assertEqual(cur.execute.call_args_list, [
+            call('INSERT INTO "d"."t" (id, name) OVERRIDING SYSTEM VALUE VALUES (%s, %s) '
+                 'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name', ['1', 'a']),
+            call('UPDATE "d"."t" SET id = %s, name = %s WHERE id = %s', ['2', 'b', '1']),
+            call('UPDATE "d"."t" SET name = %s WHERE id = %s', ['c', '2']),
+            call('UPDATE "d"."t" SET name = %s WHERE id = %s', ['d', '2']),
+            call('DELETE FROM "d"."t" WHERE id = %s', ['2']),
+        ])
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.transfer_table', return_value=3)
+    @patch('datatrasnfer.get_replication_connection')
+    def test_start_cdc_copies_at_slot_snapshot(self, mock_repl, mock_transfer, mock_setup_logger):
+        """Test that the bulk copy imports the snapshot exported by the new slot"""
+        repl_cur = mock_repl.return_value.cursor.return_value
+        repl_cur.fetchone.return_value = ('datatransfer', '0/16B3748', '00000003-00000002-1', 'test_decoding')
+        
+        totals = dt.start_cdc({}, {}, ['public.items'], slot_name='datatransfer', chunk_size=1000)
+        
+        repl_cur.execute.assert_called_once_with(
+            'CREATE_REPLICATION_SLOT "datatransfer" LOGICAL test_decoding EXPORT_SNAPSHOT')
+        mock_transfer.assert_called_once_with({}, {}, 'public', 'items', 'public', 'items',
+                                              snapshot='00000003-00000002-1', chunk_size=1000)
+        self.assertEqual(totals, {'public.items': 3})
+        mock_repl.return_value.close.assert_called_once()
+    
+    @patch('datatrasnfer.setup_logger')
+    @patch('datatrasnfer.select.select')
+    @patch('datatrasnfer.get_replication_connection')
+    @patch('datatrasnfer.get_connection')
+    def test_follow_changes_applies_batches_and_confirms(self, mock_get_conn, mock_repl, mock_select,
+                                                         mock_setup_logger):
+        """Test that whole source transactions are applied, committed, then confirmed to the slot"""
+        tgt_conn = mock_get_conn.return_value
+        tgt_cur = tgt_conn.cursor.return_value
+        tgt_cur.fetchall.return_value = [('id', 'int4')]
+        repl_cur = mock_repl.return_value.cursor.return_value
+        
+        def message(payload, lsn):
+            return Mock(payload=payload, data_start=lsn)
+        repl_cur.read_message.side_effect = [
+            message('BEGIN', 100),
+            message("table public.items: INSERT: id[integer]:4 name[text]:'d'", 101),
+            message("table public.other: INSERT: id[integer]:9", 102),
+            message('COMMIT', 103),
+            message('BEGIN', 104),
+            message('table public.items: DELETE: id[integer]:2', 105),
+            message('COMMIT', 106),
+            message('BEGIN', 107),
+            message('table public.other, public.items: TRUNCATE: (no-flags)', 108),
+            message('COMMIT', 109),
+            None,
+        ]
+        
+        applied = dt.follow_changes({}, {}, ['public.items:archive.items'], batch_size=1000, idle_timeout=0)
+        
+        self.assertEqual(applied, 3)
+        statements = [c[0][0] for c in tgt_cur.execute.call_args_list if 'pg_index' not in c[0][0]]
+        self.assertTrue(statements[0].startswith('INSERT INTO "archive"."items" (id, name)'))
+        self.assertEqual(statements[1], 'DELETE FROM "archive"."items" WHERE id = %s')
+        self.assertEqual(statements[2], 'TRUNCATE "archive"."items"')
+        repl_cur.start_replication.assert_called_once()
+        repl_cur.send_feedback.assert_called_with(flush_lsn=109)
+        # Schema lookup commit plus one batch commit
+        self.assertEqual(tgt_conn.commit.call_count, 2)
+    
+    @unittest.skipUnless(os.environ.get('DATATRANSFER_TEST_DSN'),
+                         'set DATATRANSFER_TEST_DSN to a PostgreSQL instance with wal_level=logical')
+    @patch('datatrasnfer.setup_logger')
+    def test_cdc_against_local_postgres(self, mock_setup_logger):
+        """Test bulk copy plus CDC end to end on a real server"""
+        from psycopg2.extensions import parse_dsn
+        params = parse_dsn(os.environ['DATATRANSFER_TEST_DSN'])
+        conf = {'host': params.get('host', 'localhost'), 'port': params.get('port', 5432),
+                'database': params['dbname'], 'user': params.get('user'), 'password': params.get('password')}
+        conn = dt.get_connection(conf)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("""
+            DROP SCHEMA IF EXISTS cdc_src CASCADE; DROP SCHEMA IF EXISTS cdc_dst CASCADE;
+            CREATE SCHEMA cdc_src; CREATE SCHEMA cdc_dst;
+            CREATE TABLE cdc_src.items (id int PRIMARY KEY, name text);
+            CREATE TABLE cdc_dst.items (id int PRIMARY KEY, name text);
+            INSERT INTO cdc_src.items VALUES (1, 'a'), (2, 'b'), (3, 'c');
+            SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots
+            WHERE slot_name = 'datatransfer_test';""")
+        try:
+            dt.start_cdc(conf, conf, ['cdc_src.items:cdc_dst.items'], slot_name='datatransfer_test')
+            cur.execute("""
+                INSERT INTO cdc_src.items VALUES (4, 'd');
+                UPDATE cdc_src.items SET name = 'it''s changed' WHERE id = 1;
+                DELETE FROM cdc_src.items WHERE id = 2;""")
+            dt.follow_changes(conf, conf, ['cdc_src.items:cdc_dst.items'], slot_name='datatransfer_test',
+                              idle_timeout=2)
+            cur.execute('SELECT id, name FROM cdc_dst.items ORDER BY id')
+            self.assertEqual(cur.fetchall(), [(1, "it's changed"), (3, 'c'), (4, 'd')])
+        finally:
+            dt.drop_cdc_slot(conf, 'datatransfer_test')
+            cur.execute('DROP SCHEMA cdc_src CASCADE; DROP SCHEMA cdc_dst CASCADE')
+            conn.close()
+
+
+class TestChecksumVerification(unittest.TestCase):
+    """Test cases for range checksum verification"""
+    
+    def test_range_checksum_is_computed_server_side(self):
+        """Test that only the count and the hash sum of a range are fetched"""
+        cur = MagicMock()
+        cur.fetchone.return_value = (3, 12345)
+        
+        result = dt.range_checksum(cur, 'public', 'items', ['id', 'name'], 'id', 10, 20)
+        
+        self.assertEqual(result, (3, 12345))
+        sql, params = cur.execute.call_args[0]
+        self.assertIn('md5(ROW(id, name)::text)', sql)
+        self.assertIn('FROM "public"."items" WHERE id >= %s AND id < %s', sql)
+        self.assertEqual(params, (10, 20))
+        cur.fetchall.assert_not_called()
+    
+    def _compare(self, checksum, **options):
+        with patch('datatrasnfer.get_connection', side_effect=lambda conf: MagicMock()), \
+             patch('datatrasnfer.get_columns', return_value=['id', 'name']), \
+             patch('datatrasnfer.get_primary_key', return_value=[('id', 'int4')]), \
+             patch('datatrasnfer.key_bounds', side_effect=[(0, 9999), (0, 9999)]), \
+             patch('datatrasnfer.range_checksum', side_effect=checksum) as mock_checksum:
+            key, mismatches = dt.compare_ranges({}, {}, 'public', 'items', 'public', 'items', workers=2,
+                                                segments=10, min_range=100, **options)
+        return key, mismatches, mock_checksum
+    
+    def test_matching_ranges_are_not_split(self):
+        """Test that identical tables cost one checksum per segment and side"""
+        key, mismatches, mock_checksum = self._compare(
+            lambda cur, schema, table, columns, key, low, high: (high - low, low))
+        
+        self.assertEqual(key, 'id')
+        self.assertEqual(mismatches, [])
+        self.assertEqual(mock_checksum.call_count, 2 * 10)
+    
+    def test_reports_leaf_ranges_that_differ(self):
+        """Test that a single divergent key is narrowed down to a small range"""
+        lock = threading.Lock()
+        seen = {}
+        
+        def checksum(cur, schema, table, columns, key, low, high):
+            # The first call for each range comes from either side; make the second one differ
+            with lock:
+                side = seen.setdefault((low, high), 0)
+                seen[(low, high)] += 1
+            if side == 1 and low <= 4321 < high:
+                return (high - low - 1, low)
+            return (high - low, low)
+        
+        key, mismatches, mock_checksum = self._compare(checksum)
+        
+        self.assertEqual(len(mismatches), 1)
+        mismatch = mismatches[0]
+        self.assertTrue(mismatch['low'] <= 4321 < mismatch['high'])
+        self.assertLessEqual(mismatch['high'] - mismatch['low'], 100)
+        self.assertEqual(abs(mismatch['source_rows'] - mismatch['target_rows']), 1)
+        # 10 segments, then 16 sub-ranges of the divergent one
+        self.assertEqual(mock_checksum.call_count, 2 * (10 + 16))
+    
+    def test_requires_integer_primary_key(self):
+        """Test that tables without an integer primary key are rejected"""
+        with patch('datatrasnfer.get_connection', side_effect=lambda conf: MagicMock()), \
+             patch('datatrasnfer.get_columns', return_value=['code']), \
+             patch('datatrasnfer.get_primary_key', return_value=[('code', 'text')]):
+            with self.assertRaises(ValueError):
+                dt.compare_ranges({}, {}, 'public', 'items', 'public', 'items')
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_verify_table_returns_mismatches(self, mock_setup_logger):
+        """Test that verify_table reports the divergent ranges"""
+        mismatch = {'low': 10, 'high': 20, 'source_rows': 10, 'target_rows': 9}
+        with patch('datatrasnfer.compare_ranges', return_value=('id', [mismatch])):
+            with self.assertLogs(level='WARNING') as logs:
+                result = dt.verify_table({}, {}, 'public', 'items', 'public', 'items')
+        self.assertEqual(result, [mismatch])
+        self.assertIn('[10, 20)', logs.output[0])
+
+
+class TestSyncMode(unittest.TestCase):
+    """Test cases for re-copying only divergent ranges"""
+    
+    def test_repair_range_deletes_and_copies_in_one_transaction(self):
+        """Test that a range is deleted and reloaded before a single commit"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_cur, tgt_cur = MagicMock(), MagicMock()
+        src_conn.cursor.return_value = src_cur
+        tgt_conn.cursor.return_value = tgt_cur
+        src_cur.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        tgt_cur.rowcount = 2
+        load = MagicMock()
+        committed = MagicMock()
+        
+        total = dt.repair_range(src_conn, tgt_conn, 'SELECT id FROM "public"."items"', load, 'public', 'items',
+                                'id >= 1 AND id < 4', chunk_size=2, on_commit=committed)
+        
+        self.assertEqual(total, 3)
+        tgt_cur.execute.assert_called_once_with('DELETE FROM "public"."items" WHERE id >= 1 AND id < 4')
+        src_cur.execute.assert_called_once_with('SELECT id FROM "public"."items" WHERE id >= 1 AND id < 4')
+        self.assertEqual(load.call_count, 2)
+        tgt_conn.commit.assert_called_once()
+        committed.assert_called_once_with(3)
+    
+    def test_repair_range_rolls_back_on_error(self):
+        """Test that a failed load keeps the original target rows"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        load = MagicMock(side_effect=Exception('duplicate key'))
+        
+        with self.assertRaises(Exception):
+            dt.repair_range(src_conn, tgt_conn, 'SELECT id FROM t', load, 'public', 'items', 'id >= 1 AND id < 2')
+        tgt_conn.rollback.assert_called_once()
+        tgt_conn.commit.assert_not_called()
+    
+    def test_adjacent_ranges_are_merged(self):
+        """Test that contiguous divergent ranges are repaired together"""
+        mismatches = [{'low': 200, 'high': 300}, {'low': 0, 'high': 100}, {'low': 100, 'high': 200},
+                      {'low': 500, 'high': 600}]
+        self.assertEqual(dt._merge_ranges(mismatches), [[0, 300], [500, 600]])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_sync_repairs_only_divergent_ranges(self, mock_setup_logger):
+        """Test that migrate_table(sync=True) only re-copies ranges reported by the comparison"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',), ('name',)]
+        mismatches = [{'low': 100, 'high': 163, 'source_rows': 63, 'target_rows': 62},
+                      {'low': 900, 'high': 963, 'source_rows': 63, 'target_rows': 63}]
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.compare_ranges', return_value=('id', mismatches)) as mock_compare, \
+             patch('datatrasnfer.repair_range', return_value=63) as mock_repair:
+            dt.migrate_table({}, {}, 'public', 'items', 'public', 'items', sync=True, min_range=64)
+        
+        self.assertEqual(mock_compare.call_args[1]['min_range'], 64)
+        predicates = [c[0][6] for c in mock_repair.call_args_list]
+        self.assertEqual(predicates, ['id >= 100 AND id < 163', 'id >= 900 AND id < 963'])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_sync_with_identical_tables_copies_nothing(self, mock_setup_logger):
+        """Test that nothing is written when all checksums match"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.compare_ranges', return_value=('id', [])), \
+             patch('datatrasnfer.repair_range') as mock_repair:
+            total = dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', sync=True)
+        
+        self.assertEqual(total, 0)
+        mock_repair.assert_not_called()
+        tgt_conn.commit.assert_not_called()
+    
+    def test_sync_rejects_incompatible_options(self):
+        """Test that sync cannot be combined with incremental or checkpointed runs"""
+        with self.assertRaises(ValueError):
+            dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', sync=True, watermark_column='id')
+
+
+class TestDeferredIndexes(unittest.TestCase):
+    """Test cases for dropping and rebuilding secondary indexes around the load"""
+    
+    DDL = {'indexes': [{'name': 'items_name_idx', 'definition': 'CREATE INDEX items_name_idx ON public.items (name)'},
+                       {'name': 'items_ts_idx', 'definition': 'CREATE INDEX items_ts_idx ON public.items (ts)'}],
+           'constraints': [{'name': 'items_owner_fkey',
+                            'definition': 'FOREIGN KEY (owner) REFERENCES public.owners(id)'}]}
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ddl_file = os.path.join(self.tmpdir.name, 'ddl.json')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_get_deferrable_ddl_reads_catalog(self):
+        """Test that index and constraint definitions come from pg_catalog"""
+        cur = MagicMock()
+        cur.fetchall.side_effect = [[('items_name_idx', 'CREATE INDEX items_name_idx ON public.items (name)')],
+                                    [('items_owner_fkey', 'FOREIGN KEY (owner) REFERENCES public.owners(id)')]]
+        
+        ddl = dt.get_deferrable_ddl(cur, 'public', 'items')
+        
+        self.assertEqual(ddl['indexes'][0]['name'], 'items_name_idx')
+        self.assertEqual(ddl['constraints'][0]['name'], 'items_owner_fkey')
+        index_sql = cur.execute.call_args_list[0][0][0]
+        self.assertIn('pg_get_indexdef', index_sql)
+        self.assertIn('NOT x.indisprimary', index_sql)
+        self.assertEqual(cur.execute.call_args_list[0][0][1], ('"public"."items"',))
+    
+    def test_drop_deferred(self):
+        """Test that constraints are dropped before indexes"""
+        cur = MagicMock()
+        dt.drop_deferred(cur, 'public', 'items', self.DDL)
+        statements = [c[0][0] for c in cur.execute.call_args_list]
+        self.assertEqual(statements, [
+            'ALTER TABLE "public"."items" DROP CONSTRAINT IF EXISTS "items_owner_fkey"',
+            'DROP INDEX IF EXISTS "public"."items_name_idx"',
+            'DROP INDEX IF EXISTS "public"."items_ts_idx"'])
+    
+    def test_rebuild_skips_existing_objects(self):
+        """Test that indexes are rebuilt on separate connections and existing ones are skipped"""
+        conns = []
+        def connect(conf):
+            conn = MagicMock()
+            conn.cursor.return_value.fetchall.side_effect = [[('items_ts_idx',)], []]
+            conns.append(conn)
+            return conn
+        
+        with patch('datatrasnfer.get_connection', side_effect=connect):
+            rebuilt = dt.rebuild_deferred({}, 'public', 'items', self.DDL, workers=2, maintenance_work_mem='2GB')
+        
+        self.assertEqual(rebuilt, 2)
+        # Catalog lookup, one index build, one connection for constraints
+        self.assertEqual(len(conns), 3)
+        statements = [c[0][0] for conn in conns for c in conn.cursor.return_value.execute.call_args_list]
+        self.assertIn('CREATE INDEX items_name_idx ON public.items (name)', statements)
+        self.assertNotIn('CREATE INDEX items_ts_idx ON public.items (ts)', statements)
+        self.assertIn('ALTER TABLE "public"."items" ADD CONSTRAINT "items_owner_fkey" '
+                      'FOREIGN KEY (owner) REFERENCES public.owners(id)', statements)
+        for conn in conns:
+            self.assertTrue(conn.autocommit)
+            first = conn.cursor.return_value.execute.call_args_list[0][0]
+            self.assertEqual(first[1], ('2GB',))
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_table_defers_and_rebuilds(self, mock_setup_logger):
+        """Test that the DDL is saved before dropping and cleared after the rebuild"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',), ('name',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1, 'a')], []]
+        saved = []
+        
+        def drop(cur, schema, table, ddl):
+            with open(self.ddl_file) as f:
+                saved.append(json.load(f))
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.get_deferrable_ddl', return_value=self.DDL), \
+             patch('datatrasnfer.drop_deferred', side_effect=drop), \
+             patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+            total = dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert',
+                                      defer_indexes=True, ddl_file=self.ddl_file, index_workers=3)
+        
+        self.assertEqual(total, 1)
+        self.assertEqual(saved, [{'public.items': self.DDL}])
+        mock_rebuild.assert_called_once_with({}, 'public', 'items', self.DDL, 3, '1GB', None)
+        with open(self.ddl_file) as f:
+            self.assertEqual(json.load(f), {})
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_parallel_table_entries_survive(self, mock_setup_logger):
+        """Test that DDL saved by another table while this one saves its own is not overwritten"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = Exception('connection lost')
+        other = {'indexes': [{'name': 'o', 'definition': 'CREATE INDEX o ON public.other (x)'}], 'constraints': []}
+        
+        def read_catalog(cur, schema, table):
+            # Another table of the same run saves its DDL meanwhile
+            writer = threading.Thread(target=dt._update_json,
+                                      args=(self.ddl_file, lambda state: state.update({'public.other': other})))
+            writer.start()
+            writer.join(0.2)
+            self.writers.append(writer)
+            return self.DDL
+        
+        self.writers = []
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.get_deferrable_ddl', side_effect=read_catalog), \
+             patch('datatrasnfer.drop_deferred'):
+            with self.assertRaises(Exception):
+                dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert',
+                                  defer_indexes=True, ddl_file=self.ddl_file)
+        self.writers[0].join()
+        
+        with open(self.ddl_file) as f:
+            self.assertEqual(json.load(f), {'public.items': self.DDL, 'public.other': other})
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_failed_run_keeps_ddl_for_restore(self, mock_setup_logger):
+        """Test that a failed load leaves the DDL on disk and restore_deferred rebuilds it"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = Exception('connection lost')
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.get_deferrable_ddl', return_value=self.DDL), \
+             patch('datatrasnfer.drop_deferred'), \
+             patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+            with self.assertRaises(Exception):
+                dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert',
+                                  defer_indexes=True, ddl_file=self.ddl_file)
+            mock_rebuild.assert_not_called()
+            
+            mock_rebuild.return_value = 3
+            restored = dt.restore_deferred({}, self.ddl_file)
+        
+        self.assertEqual(restored, 3)
+        mock_rebuild.assert_called_once_with({}, 'public', 'items', self.DDL, 4, '1GB')
+        with open(self.ddl_file) as f:
+            self.assertEqual(json.load(f), {})
+
+
+class TestTriggerSuppression(unittest.TestCase):
+    """Test cases for suppressing target triggers during the load"""
+    
+    TRIGGERS = [('audit_items', 'O', False), ('RI_ConstraintTrigger_c_1', 'O', True),
+                ('replicated_only', 'R', False), ('disabled_one', 'D', False)]
+    
+    def test_replica_mode_sets_session_role(self):
+        """Test that replica mode sets session_replication_role and reports what it suppresses"""
+        tgt_conn = MagicMock()
+        tgt_conn.cursor.return_value.fetchall.return_value = self.TRIGGERS
+        
+        with self.assertLogs(level='INFO') as logs:
+            suppressed = dt.suppress_table_triggers({}, tgt_conn, 'public', 'items', 'replica')
+        
+        self.assertEqual(suppressed, [('audit_items', 'O')])
+        tgt_conn.cursor.return_value.execute.assert_called_with("SET session_replication_role = replica")
+        self.assertTrue(any('audit_items' in line and '1 trigger interni' in line for line in logs.output))
+        self.assertTrue(any('replicated_only' in line for line in logs.output if 'WARNING' in line))
+    
+    def test_user_mode_disables_enabled_user_triggers(self):
+        """Test that only enabled user triggers are disabled, on a dedicated connection"""
+        tgt_conn, ddl_conn = MagicMock(), MagicMock()
+        tgt_conn.cursor.return_value.fetchall.return_value = self.TRIGGERS
+        
+        with patch('datatrasnfer.get_connection', return_value=ddl_conn):
+            suppressed = dt.suppress_table_triggers({}, tgt_conn, 'public', 'items', 'user')
+        
+        self.assertEqual(suppressed, [('audit_items', 'O'), ('replicated_only', 'R')])
+        statements = [c[0][0] for c in ddl_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(statements, ['ALTER TABLE "public"."items" DISABLE TRIGGER "audit_items"',
+                                      'ALTER TABLE "public"."items" DISABLE TRIGGER "replicated_only"'])
+        ddl_conn.commit.assert_called_once()
+        ddl_conn.close.assert_called_once()
+    
+    def test_user_mode_restores_previous_state(self):
+        """Test that each trigger is re-enabled with its original firing mode"""
+        ddl_conn = MagicMock()
+        with patch('datatrasnfer.get_connection', return_value=ddl_conn):
+            dt.restore_table_triggers({}, MagicMock(), 'public', 'items', 'user',
+                                      [('audit_items', 'O'), ('replicated_only', 'R')])
+        statements = [c[0][0] for c in ddl_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(statements, ['ALTER TABLE "public"."items" ENABLE TRIGGER "audit_items"',
+                                      'ALTER TABLE "public"."items" ENABLE REPLICA TRIGGER "replicated_only"'])
+    
+    def test_invalid_mode(self):
+        """Test that unknown suppression modes are rejected"""
+        with self.assertRaises(ValueError):
+            dt.suppress_table_triggers({}, MagicMock(), 'public', 'items', 'all')
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_role_is_restored_after_failed_load(self, mock_setup_logger):
+        """Test that session_replication_role is reset even when the transfer raises"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = Exception('connection lost')
+        tgt_conn.cursor.return_value.fetchall.return_value = self.TRIGGERS
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]):
+            with self.assertRaises(Exception):
+                dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert',
+                                  suppress_triggers='replica')
+        
+        statements = [c[0][0] for c in tgt_conn.cursor.return_value.execute.call_args_list]
+        self.assertIn("SET session_replication_role = replica", statements)
+        self.assertEqual(statements[-1], "RESET session_replication_role")
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_range_workers_load_in_replica_mode(self, mock_setup_logger):
+        """Test that every range worker's target session also uses the replica role"""
+        prepared = []
+        with patch('datatrasnfer.get_connection', side_effect=lambda conf: MagicMock()):
+            dt.migrate_ranges({}, {}, 'snap', ['a', 'b'], lambda src, tgt, predicate, label: 1, 2,
+                              prepare_target=prepared.append)
+        self.assertEqual(len(prepared), 2)
+
+
+class TestSwapLoad(unittest.TestCase):
+    """Test cases for the UNLOGGED staging load with atomic swap"""
+    
+    def _catalog_cursor(self, dependents=()):
+        cur = MagicMock()
+        cur.fetchall.side_effect = [
+            list(dependents),
+            [('items_pkey', 'items_pkey', 'CREATE UNIQUE INDEX items_pkey ON public.items USING btree (id)',
+              'items_pkey', 'p', False, False),
+             ('items_name_idx', 'items_name_idx', 'CREATE INDEX items_name_idx ON public.items USING btree (name)',
+              None, None, None, None)],
+            [('items_owner_fkey', 'f', 'FOREIGN KEY (owner) REFERENCES owners(id)')],
+            [('CREATE TRIGGER audit AFTER INSERT ON public.items FOR EACH ROW EXECUTE FUNCTION audit()',)],
+            [('public.items_id_seq', 'id', 'a')],
+            [('reporting', 'SELECT', False)],
+        ]
+        cur.fetchone.return_value = ('public.items', 'loader', True)
+        return cur
+    
+    def test_prepare_swap_refuses_referenced_tables(self):
+        """Test that tables referenced by foreign keys or views are not swapped"""
+        cur = self._catalog_cursor(dependents=[('public.orders', 'orders_item_fkey')])
+        with self.assertRaises(ValueError) as ctx:
+            dt.prepare_swap(cur, 'public', 'items')
+        self.assertIn('public.orders', str(ctx.exception))
+        statements = [c[0][0] for c in cur.execute.call_args_list]
+        self.assertFalse(any('CREATE UNLOGGED' in sql for sql in statements))
+    
+    def test_prepare_swap_plans_rebuild_on_staging(self):
+        """Test that indexes, constraints and triggers are redirected to the staging table"""
+        cur = self._catalog_cursor()
+        
+        plan = dt.prepare_swap(cur, 'public', 'items')
+        
+        self.assertEqual(plan['staging'], 'items__dt_new')
+        self.assertEqual(plan['ddl']['indexes'], [
+            {'name': 'items__dt_new_1',
+             'definition': 'CREATE UNIQUE INDEX "items__dt_new_1" ON "public"."items__dt_new" USING btree (id)'},
+            {'name': 'items__dt_new_2',
+             'definition': 'CREATE INDEX "items__dt_new_2" ON "public"."items__dt_new" USING btree (name)'}])
+        self.assertEqual(plan['ddl']['constraints'], [
+            {'name': 'items__dt_new_1', 'definition': 'PRIMARY KEY USING INDEX "items__dt_new_1"'},
+            {'name': 'items_owner_fkey', 'definition': 'FOREIGN KEY (owner) REFERENCES owners(id)'}])
+        self.assertEqual(plan['triggers'], ['CREATE TRIGGER audit AFTER INSERT ON "public"."items__dt_new" '
+                                            'FOR EACH ROW EXECUTE FUNCTION audit()'])
+        self.assertEqual(plan['grants'], ['GRANT SELECT ON "public"."items__dt_new" TO reporting'])
+        self.assertEqual(plan['renames'], [
+            'ALTER TABLE "public"."items" RENAME CONSTRAINT "items__dt_new_1" TO "items_pkey"',
+            'ALTER INDEX "public"."items__dt_new_2" RENAME TO "items_name_idx"'])
+        self.assertIsNone(plan['owner'])
+        self.assertEqual(cur.execute.call_args_list[-1][0][0],
+                         'CREATE UNLOGGED TABLE "public"."items__dt_new" '
+                         '(LIKE "public"."items" INCLUDING ALL EXCLUDING INDEXES)')
+    
+    def test_swap_name_fits_identifier_limit(self):
+        """Test that long table names are shortened before the suffix"""
+        name = dt._swap_name('x' * 63, '__dt_new')
+        self.assertEqual(len(name), 63)
+        self.assertTrue(name.endswith('__dt_new'))
+    
+    def test_finish_swap_order(self):
+        """Test that indexes are built before the short swap transaction"""
+        plan = {'staging': 'items__dt_new', 'owner': None, 'ddl': {'indexes': [], 'constraints': []},
+                'triggers': [], 'grants': [], 'sequences': [('public.items_id_seq', 'id', 'a')],
+                'renames': ['ALTER INDEX "public"."items__dt_new_2" RENAME TO "items_name_idx"']}
+        tgt_conn = MagicMock()
+        
+        with patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+            dt.finish_swap({}, tgt_conn, 'public', 'items', plan)
+        
+        mock_rebuild.assert_called_once()
+        statements = [c[0][0] for c in tgt_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(statements, [
+            'ALTER TABLE "public"."items__dt_new" SET LOGGED',
+            'ANALYZE "public"."items__dt_new"',
+            'LOCK TABLE "public"."items" IN ACCESS EXCLUSIVE MODE',
+            'ALTER SEQUENCE public.items_id_seq OWNED BY "public"."items__dt_new"."id"',
+            'DROP TABLE "public"."items"',
+            'ALTER TABLE "public"."items__dt_new" RENAME TO "items"',
+            'ALTER INDEX "public"."items__dt_new_2" RENAME TO "items_name_idx"'])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_table_loads_staging_then_swaps(self, mock_setup_logger):
+        """Test that rows go to the staging table and the swap happens after the load"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,), (2,)], []]
+        plan = {'staging': 'items__dt_new'}
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.prepare_swap', return_value=plan), \
+             patch('datatrasnfer.finish_swap') as mock_finish:
+            total = dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert', swap=True)
+        
+        self.assertEqual(total, 2)
+        inserts = [c[0][0] for c in tgt_conn.cursor.return_value.execute.call_args_list]
+        self.assertTrue(all(sql.startswith('INSERT INTO "public"."items__dt_new"') for sql in inserts))
+        mock_finish.assert_called_once()
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_failed_chunks_cancel_the_swap(self, mock_setup_logger):
+        """Test that the live table is kept when part of the load failed"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        tgt_conn.cursor.return_value.execute.side_effect = Exception('bad row')
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.prepare_swap', return_value={'staging': 'items__dt_new'}), \
+             patch('datatrasnfer.drop_staging') as mock_drop, \
+             patch('datatrasnfer.finish_swap') as mock_finish:
+            with self.assertRaises(RuntimeError):
+                dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert', swap=True)
+        
+        mock_finish.assert_not_called()
+        mock_drop.assert_called_once()
+
+
+class TestSessionSettings(unittest.TestCase):
+    """Test cases for per-connection session settings"""
+    
+    def setUp(self):
+        self.conf = {'host': 'localhost', 'port': 5432, 'database': 'test_db', 'user': 'test_user',
+                     'password': 'test_password'}
+    
+    @patch('datatrasnfer.psycopg2.connect')
+    def test_settings_are_sent_at_connect_time(self, mock_connect):
+        """Test that settings become startup options of the connection"""
+        conf = dict(self.conf, settings={'synchronous_commit': 'off', 'application_name': 'data transfer'})
+        
+        dt.get_connection(conf)
+        
+        self.assertEqual(mock_connect.call_args[1]['options'],
+                         '-c synchronous_commit=off -c application_name=data\\ transfer')
+    
+    def test_bulk_load_preset_with_overrides(self):
+        """Test that explicit settings override the preset"""
+        settings = dt.session_settings({'preset': 'bulk_load', 'settings': {'work_mem': '256MB'}})
+        self.assertEqual(settings['synchronous_commit'], 'off')
+        self.assertEqual(settings['work_mem'], '256MB')
+    
+    def test_no_settings_no_options(self):
+        """Test that plain configurations do not send startup options"""
+        self.assertEqual(dt._connect_options(self.conf), {})
+    
+    def test_invalid_preset_and_names(self):
+        """Test that unknown presets and malformed setting names are rejected"""
+        with self.assertRaises(ValueError):
+            dt.session_settings({'preset': 'fast'})
+        with self.assertRaises(ValueError):
+            dt._connect_options({'settings': {'work_mem=1GB -c role': 'admin'}})
+    
+    @patch('datatrasnfer.psycopg2.connect')
+    def test_replication_connection_uses_settings(self, mock_connect):
+        """Test that the replication connection gets the same options"""
+        dt.get_replication_connection(dict(self.conf, settings={'statement_timeout': 0}))
+        self.assertEqual(mock_connect.call_args[1]['options'], '-c statement_timeout=0')
+    
+    @patch('datatrasnfer.psycopg2.connect')
+    def test_replication_connection_from_pool(self, mock_connect):
+        """Test that a pool is accepted and a dedicated replication connection is opened"""
+        pool = dt.ConnectionPool(self.conf)
+        dt.get_replication_connection(pool)
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertEqual(mock_connect.call_args[1]['host'], self.conf['host'])
+        self.assertIs(mock_connect.call_args[1]['connection_factory'], dt.psycopg2.extras.LogicalReplicationConnection)
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Test cases for the connection pool"""
+    
+    def _connection(self):
+        conn = MagicMock()
+        conn.closed = 0
+        return conn
+    
+    def test_connections_are_reused_and_reset(self):
+        """Test that a released connection is reset and handed out again"""
+        conn = self._connection()
+        with patch('datatrasnfer.get_connection', return_value=conn) as mock_get_conn:
+            pool = dt.ConnectionPool({}, max_size=2)
+            first = pool.getconn()
+            pool.putconn(first)
+            second = pool.getconn()
+        
+        self.assertIs(first, second)
+        mock_get_conn.assert_called_once()
+        conn.rollback.assert_called()
+        conn.cursor.return_value.execute.assert_called_with("DISCARD ALL")
+        self.assertFalse(conn.autocommit)
+    
+    def test_expired_connections_are_replaced(self):
+        """Test that connections older than max_lifetime are closed instead of reused"""
+        old, new = self._connection(), self._connection()
+        with patch('datatrasnfer.get_connection', side_effect=[old, new]):
+            pool = dt.ConnectionPool({}, max_lifetime=0)
+            pool.putconn(pool.getconn())
+            conn = pool.getconn()
+        
+        self.assertIs(conn, new)
+        old.close.assert_called_once()
+    
+    def test_health_check_discards_broken_connections(self):
+        """Test that an idle connection failing the health check is replaced"""
+        broken, fresh = self._connection(), self._connection()
+        with patch('datatrasnfer.get_connection', side_effect=[broken, fresh]):
+            pool = dt.ConnectionPool({}, check_interval=-1)
+            pool.putconn(pool.getconn())
+            broken.cursor.return_value.execute.side_effect = Exception('server closed the connection')
+            conn = pool.getconn()
+        
+        self.assertIs(conn, fresh)
+        broken.close.assert_called_once()
+    
+    def test_exhausted_pool_times_out(self):
+        """Test that getconn gives up when all connections stay in use"""
+        with patch('datatrasnfer.get_connection', side_effect=lambda conf: self._connection()):
+            pool = dt.ConnectionPool({}, max_size=1, timeout=0.05)
+            pool.getconn()
+            with self.assertRaises(RuntimeError):
+                pool.getconn()
+    
+    def test_waiting_caller_gets_released_connection(self):
+        """Test that a blocked getconn is woken up by putconn"""
+        conn = self._connection()
+        with patch('datatrasnfer.get_connection', return_value=conn):
+            pool = dt.ConnectionPool({}, max_size=1, timeout=5)
+            held = pool.getconn()
+            timer = threading.Timer(0.05, pool.putconn, args=(held,))
+            timer.start()
+            self.assertIs(pool.getconn(), conn)
+            timer.join()
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_transfer_table_returns_connections_to_pool(self, mock_setup_logger):
+        """Test that transfer_table releases pooled connections instead of closing them"""
+        src_conn, tgt_conn = self._connection(), self._connection()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]):
+            source, target = dt.ConnectionPool({}), dt.ConnectionPool({})
+            dt.transfer_table(source, target, 'public', 'items', 'public', 'items', load_mode='insert')
+            # Reused without new connections
+            self.assertIs(source.getconn(), src_conn)
+            self.assertIs(target.getconn(), tgt_conn)
+        src_conn.close.assert_not_called()
+        tgt_conn.close.assert_not_called()
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_jobs_shares_pools(self, mock_setup_logger):
+        """Test that pool_size makes all jobs draw from the same connections"""
+        conns = []
+        
+        def connect(conf):
+            conn = self._connection()
+            conn.cursor.return_value.fetchall.return_value = []
+            conns.append(conn)
+            return conn
+        
+        def fake_transfer(source, target, *args, **options):
+            dt.release(source, dt.acquire(source))
+            dt.release(target, dt.acquire(target))
+            return 1
+        
+        with patch('datatrasnfer.get_connection', side_effect=connect), \
+             patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            results = dt.migrate_jobs({}, {}, ['public.a', 'public.b', 'public.c'], concurrency=1, pool_size=4)
+        
+        self.assertEqual(results, {'public.a': 1, 'public.b': 1, 'public.c': 1})
+        # One source and one target connection for the whole run, closed at the end
+        self.assertEqual(len(conns), 2)
+        for conn in conns:
+            conn.close.assert_called_once()
+
+
+class TestCatalogCache(unittest.TestCase):
+    """Test cases for the single-query catalog cache"""
+    
+    ROWS = [('public', 'items', 120, 5000.0, ['id', 'name', 'ts'], ['int4', 'text', 'timestamptz'],
+             [True, False, False], [], ['id'], 'fp-items'),
+            ('public', 'logs', 0, -1.0, ['line'], ['text'], [False], None, None, 'fp-logs')]
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'catalog.json')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_single_query_serves_all_tables(self):
+        """Test that one pg_catalog query answers every metadata lookup"""
+        cur = MagicMock()
+        cur.fetchall.return_value = self.ROWS
+        catalog = dt.CatalogCache()
+        
+        catalog.load(cur, [('public', 'items'), ('public', 'logs')])
+        
+        self.assertEqual(cur.execute.call_count, 1)
+        sql, params = cur.execute.call_args[0]
+        self.assertIn('pg_catalog.pg_attribute', sql)
+        self.assertNotIn('information_schema', sql)
+        self.assertEqual(params, (['public', 'public'], ['items', 'logs']))
+        self.assertEqual(dt.get_columns(cur, 'public', 'items', catalog), ['id', 'name', 'ts'])
+        self.assertEqual(dt.get_column_types(cur, 'public', 'items', ['ts', 'id'], catalog), ['timestamptz', 'int4'])
+        self.assertEqual(dt.get_primary_key(cur, 'public', 'items', catalog), [('id', 'int4')])
+        self.assertEqual(dt.get_primary_key(cur, 'public', 'logs', catalog), [])
+        self.assertEqual(dt.get_generated_columns(cur, 'public', 'items', catalog), [])
+        self.assertEqual(catalog.size('public', 'logs'), (0, 0.0))
+        self.assertEqual(cur.execute.call_count, 1)
+    
+    def test_missing_tables_are_loaded_lazily(self):
+        """Test that tables outside the preloaded set are fetched on first use"""
+        cur = MagicMock()
+        cur.fetchall.side_effect = [self.ROWS[:1], []]
+        catalog = dt.CatalogCache()
+        catalog.load(cur, [('public', 'items')])
+        
+        with self.assertRaises(ValueError):
+            catalog.columns(cur, 'public', 'missing')
+        self.assertEqual(cur.execute.call_args[0][1], (['public'], ['missing']))
+    
+    def test_disk_cache_is_keyed_by_server(self):
+        """Test that the disk cache is reused only for the same cluster and catalog version"""
+        cur = MagicMock()
+        cur.fetchone.return_value = (7012345678901234567, 202307071)
+        cur.fetchall.return_value = self.ROWS
+        dt.CatalogCache(self.path).load(cur, [('public', 'items'), ('public', 'logs')])
+        
+        warm = MagicMock()
+        warm.fetchone.return_value = (7012345678901234567, 202307071)
+        warm.fetchall.return_value = [('public', 'items', 130, 5200.0, 'fp-items'),
+                                      ('public', 'logs', 0, 0.0, 'fp-logs')]
+        catalog = dt.CatalogCache(self.path)
+        catalog.load(warm, [('public', 'items'), ('public', 'logs')])
+        self.assertEqual(catalog.columns(warm, 'public', 'items'), ['id', 'name', 'ts'])
+        # Only the pg_control_system() lookup and the fingerprint check, which also refreshes the sizes
+        self.assertEqual(warm.execute.call_count, 2)
+        self.assertEqual(catalog.size('public', 'items'), (130, 5200.0))
+        
+        other = MagicMock()
+        other.fetchone.return_value = (1, 202307071)
+        other.fetchall.return_value = self.ROWS
+        dt.CatalogCache(self.path).load(other, [('public', 'items')])
+        self.assertEqual(other.execute.call_count, 2)
+    
+    def test_changed_tables_are_reloaded_from_disk_cache(self):
+        """Test that entries whose catalog fingerprint changed after DDL are queried again"""
+        cur = MagicMock()
+        cur.fetchone.return_value = (1, 1)
+        cur.fetchall.return_value = self.ROWS
+        dt.CatalogCache(self.path).load(cur, [('public', 'items'), ('public', 'logs')])
+        
+        altered = ('public', 'items', 120, 5000.0, ['id', 'name', 'ts', 'note'],
+                   ['int4', 'text', 'timestamptz', 'text'], [True, False, False, False], [], ['id'], 'fp-items-2')
+        warm = MagicMock()
+        warm.fetchone.return_value = (1, 1)
+        # items altered (ADD COLUMN), logs dropped
+        warm.fetchall.side_effect = [[('public', 'items', 120, 5000.0, 'fp-items-2')], [altered]]
+        catalog = dt.CatalogCache(self.path)
+        catalog.load(warm, [('public', 'items')])
+        
+        fingerprint_sql = warm.execute.call_args_list[1][0][0]
+        self.assertIn('pg_catalog.pg_attribute', fingerprint_sql)
+        self.assertIn('xmin', fingerprint_sql)
+        self.assertEqual(warm.execute.call_args_list[2][0][1], (['public'], ['items']))
+        self.assertEqual(catalog.columns(warm, 'public', 'items'), ['id', 'name', 'ts', 'note'])
+        with open(self.path) as f:
+            self.assertEqual([entry[1] for entry in json.load(f)['tables']], ['items'])
+    
+    def test_refresh_clears_disk_cache(self):
+        """Test that refresh forgets the cached metadata"""
+        cur = MagicMock()
+        cur.fetchone.return_value = (1, 1)
+        cur.fetchall.return_value = self.ROWS
+        catalog = dt.CatalogCache(self.path)
+        catalog.load(cur, [('public', 'items')])
+        catalog.refresh()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(catalog.size('public', 'items'), (0, 0.0))
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_transfer_table_uses_catalog(self, mock_setup_logger):
+        """Test that transfer_table skips information_schema when a catalog is given"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1, 'a', None)], []]
+        catalog = dt.CatalogCache()
+        cur = MagicMock()
+        cur.fetchall.return_value = self.ROWS
+        catalog.load(cur, [('public', 'items')])
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]):
+            total = dt.transfer_table({}, {}, 'public', 'items', 'public', 'items', load_mode='insert',
+                                      catalog=catalog)
+        
+        self.assertEqual(total, 1)
+        source_sql = [c[0][0] for c in src_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(source_sql, ['SELECT id, name, ts FROM "public"."items"'])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_jobs_preloads_and_sizes_from_catalog(self, mock_setup_logger):
+        """Test that the scheduler loads all tables in one query and orders them by cached size"""
+        conn = MagicMock()
+        conn.cursor.return_value.fetchall.return_value = self.ROWS
+        started = []
+        
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, *args, **options):
+            started.append(src_table)
+            return 1
+        
+        with patch('datatrasnfer.get_connection', return_value=conn), \
+             patch('datatrasnfer.transfer_table', side_effect=fake_transfer):
+            dt.migrate_jobs({}, {}, ['public.logs', 'public.items'], concurrency=1, catalog=dt.CatalogCache())
+        
+        self.assertEqual(started, ['items', 'logs'])
+        self.assertEqual(conn.cursor.return_value.execute.call_count, 1)
+
+
+class TestCreateTarget(unittest.TestCase):
+    """Test cases for creating the target table from source metadata"""
+    
+    DDL = {
+        'qualified': 'public.items',
+        'columns': [('id', 'integer', True, "nextval('items_id_seq'::regclass)", '', '', 'public.items_id_seq'),
+                    ('code', 'bigint', True, None, 'a', '', None),
+                    ('name', 'character varying(40)', False, "'n/a'::character varying", '', '', None),
+                    ('total', 'numeric(10,2)', False, 'price * qty', '', 's', None)],
+        'constraints': [('items_pkey', 'p', 'PRIMARY KEY (id)'), ('items_name_key', 'u', 'UNIQUE (name)'),
+                        ('items_owner_fkey', 'f', 'FOREIGN KEY (owner) REFERENCES owners(id)')],
+        'indexes': [('items_name_idx', 'items_name_idx',
+                     'CREATE INDEX items_name_idx ON public.items USING btree (lower((name)::text))')],
+    }
+    
+    def test_creates_table_and_defers_secondary_objects(self):
+        """Test the generated CREATE TABLE and the deferred index and constraint list"""
+        src_cur, tgt_cur = MagicMock(), MagicMock()
+        tgt_cur.fetchone.return_value = (None,)
+        
+        with patch('datatrasnfer.get_table_ddl', return_value=self.DDL):
+            deferred = dt.create_target_table(src_cur, tgt_cur, 'public', 'items', 'archive', 'items_2024')
+        
+        statements = [c[0][0] for c in tgt_cur.execute.call_args_list[1:]]
+        self.assertEqual(statements[0], 'CREATE SCHEMA IF NOT EXISTS "archive"')
+        self.assertEqual(statements[1], 'CREATE SEQUENCE IF NOT EXISTS "archive"."items_2024_id_seq" AS integer')
+        self.assertEqual(statements[2], 'CREATE TABLE "archive"."items_2024" (\n'
+                         '    "id" integer DEFAULT nextval(\'"archive"."items_2024_id_seq"\'::regclass) NOT NULL,\n'
+                         '    "code" bigint GENERATED ALWAYS AS IDENTITY NOT NULL,\n'
+                         '    "name" character varying(40) DEFAULT \'n/a\'::character varying,\n'
+                         '    "total" numeric(10,2) GENERATED ALWAYS AS (price * qty) STORED,\n'
+                         '    CONSTRAINT "items_2024_pkey" PRIMARY KEY (id)\n)')
+        self.assertEqual(statements[3], 'ALTER SEQUENCE "archive"."items_2024_id_seq" '
+                         'OWNED BY "archive"."items_2024"."id"')
+        self.assertEqual(deferred['indexes'], [{
+            'name': 'items_2024_name_idx',
+            'definition': 'CREATE INDEX "items_2024_name_idx" ON "archive"."items_2024" USING btree (lower((name)::text))'}])
+        self.assertEqual([c['name'] for c in deferred['constraints']], ['items_2024_name_key', 'items_2024_owner_fkey'])
+    
+    def test_existing_target_is_left_alone(self):
+        """Test that nothing is created when the target already exists"""
+        src_cur, tgt_cur = MagicMock(), MagicMock()
+        tgt_cur.fetchone.return_value = ('archive.items',)
+        
+        with patch('datatrasnfer.get_table_ddl') as mock_ddl:
+            self.assertIsNone(dt.create_target_table(src_cur, tgt_cur, 'public', 'items', 'archive', 'items'))
+        mock_ddl.assert_not_called()
+        tgt_cur.execute.assert_called_once()
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_table_builds_indexes_after_load(self, mock_setup_logger):
+        """Test that deferred objects are built in parallel once the rows are in"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,), (2,)], []]
+        deferred = {'indexes': [{'name': 'i', 'definition': 'CREATE INDEX i ON t (x)'}], 'constraints': []}
+        events = []
+        
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.create_target_table', return_value=deferred,
+                   side_effect=lambda *args: events.append('create') or deferred), \
+             patch('datatrasnfer.get_generated_columns', return_value=[]), \
+             patch('datatrasnfer.rebuild_deferred', side_effect=lambda *args: events.append('rebuild')) as mock_rebuild:
+            tgt_conn.cursor.return_value.execute.side_effect = lambda *args: events.append('load')
+            total = dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', load_mode='insert',
+                                      create_target=True, index_workers=6,
+                                      ddl_file=os.path.join(tmpdir, 'ddl.json'))
+        
+        self.assertEqual(total, 2)
+        self.assertEqual(events, ['create', 'load', 'load', 'rebuild'])
+        self.assertEqual(mock_rebuild.call_args[0][:5], ({}, 'archive', 'items', deferred, 6))
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_early_exit_keeps_created_objects_for_next_run(self, mock_setup_logger):
+        """Test that the DDL of a created table is saved before its commit and built by the next run"""
+        deferred = {'indexes': [{'name': 'i', 'definition': 'CREATE INDEX i ON t (x)'}], 'constraints': []}
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ddl_file = os.path.join(tmpdir, 'ddl.json')
+            src_conn, tgt_conn = MagicMock(), MagicMock()
+            src_conn.cursor.return_value.fetchall.return_value = [('id',), ('ts',)]
+            # Empty source: the incremental run returns before the load
+            src_conn.cursor.return_value.fetchone.return_value = (None,)
+            saved_at_commit = []
+            tgt_conn.commit.side_effect = lambda: saved_at_commit.append(dt._read_json(ddl_file))
+            with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+                 patch('datatrasnfer.create_target_table', return_value=deferred), \
+                 patch('datatrasnfer.get_generated_columns', return_value=[]), \
+                 patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+                total = dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', create_target=True,
+                                          watermark_column='ts', watermark_file=os.path.join(tmpdir, 'wm.json'),
+                                          ddl_file=ddl_file)
+            self.assertEqual(total, 0)
+            self.assertEqual(saved_at_commit[0], {'archive.items': deferred})
+            mock_rebuild.assert_not_called()
+            
+            src_conn, tgt_conn = MagicMock(), MagicMock()
+            src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+            src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+            with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+                 patch('datatrasnfer.create_target_table', return_value=None), \
+                 patch('datatrasnfer.get_generated_columns', return_value=[]), \
+                 patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+                dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', load_mode='insert',
+                                  create_target=True, ddl_file=ddl_file)
+            self.assertEqual(mock_rebuild.call_args[0][3], deferred)
+            self.assertEqual(dt._read_json(ddl_file), {})
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_generated_columns_are_not_loaded(self, mock_setup_logger):
+        """Test that columns generated on the created target are left out of SELECT and COPY"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_cur, tgt_cur = src_conn.cursor.return_value, tgt_conn.cursor.return_value
+        src_cur.fetchall.return_value = [('id',), ('price',), ('total',)]
+        src_cur.fetchmany.side_effect = [[(1, 5)], []]
+        tgt_cur.fetchall.return_value = [('total',)]
+        
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.create_target_table', return_value={'indexes': [], 'constraints': []}), \
+             patch('datatrasnfer.rebuild_deferred'):
+            total = dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', create_target=True,
+                                      ddl_file=os.path.join(tmpdir, 'ddl.json'))
+        
+        self.assertEqual(total, 1)
+        lookup = tgt_cur.execute.call_args_list[0][0]
+        self.assertIn("is_generated = 'ALWAYS'", lookup[0])
+        self.assertEqual(lookup[1], ('archive', 'items'))
+        self.assertEqual(src_cur.execute.call_args_list[-1][0][0], 'SELECT id, price FROM "public"."items"')
+        copy_sql, data = tgt_cur.copy_expert.call_args[0]
+        self.assertIn('COPY "archive"."items" (id, price) FROM STDIN', copy_sql)
+        self.assertEqual(data.read(), '1\t5\n')
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_created_objects_are_built_with_defer_indexes(self, mock_setup_logger):
+        """Test that defer_indexes does not replace the objects returned by create_target_table"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        deferred = {'indexes': [{'name': 'i', 'definition': 'CREATE INDEX i ON t (x)'}],
+                    'constraints': [{'name': 'c', 'definition': 'UNIQUE (x)'}]}
+        saved = {'indexes': [{'name': 'old', 'definition': 'CREATE INDEX old ON t (y)'}], 'constraints': []}
+        
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.create_target_table', return_value=deferred), \
+             patch('datatrasnfer.get_deferrable_ddl') as mock_ddl, \
+             patch('datatrasnfer.drop_deferred') as mock_drop, \
+             patch('datatrasnfer.rebuild_deferred') as mock_rebuild:
+            ddl_file = os.path.join(tmpdir, 'ddl.json')
+            with open(ddl_file, 'w') as f:
+                json.dump({'archive.items': saved}, f)
+            dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', load_mode='insert',
+                              create_target=True, defer_indexes=True, ddl_file=ddl_file)
+        
+        mock_ddl.assert_not_called()
+        mock_drop.assert_not_called()
+        built = mock_rebuild.call_args[0][3]
+        self.assertEqual([index['name'] for index in built['indexes']], ['i', 'old'])
+        self.assertEqual(built['constraints'], deferred['constraints'])
+
+
+class TestSequenceResync(unittest.TestCase):
+    """Test cases for advancing target sequences after the load"""
+    
+    def test_one_discovery_and_one_batched_setval(self):
+        """Test that all sequences of all tables are advanced with a single statement"""
+        cur = MagicMock()
+        cur.fetchall.side_effect = [
+            [('public.items', 'id', 'public.items_id_seq'), ('archive.orders', 'order_no', 'archive.orders_order_no_seq')],
+            [('public.items_id_seq', 4200)],
+        ]
+        
+        advanced = dt.advance_sequences(cur, [('public', 'items'), ('archive', 'orders')])
+        
+        self.assertEqual(advanced, {'public.items_id_seq': 4200})
+        self.assertEqual(cur.execute.call_count, 2)
+        discovery_sql, discovery_params = cur.execute.call_args_list[0][0]
+        self.assertIn("d.deptype IN ('a', 'i')", discovery_sql)
+        self.assertEqual(discovery_params, (['public', 'archive'], ['items', 'orders']))
+        setval_sql, setval_params = cur.execute.call_args_list[1][0]
+        self.assertEqual(setval_sql.count('UNION ALL'), 1)
+        self.assertIn('SELECT max(id) AS m FROM public.items', setval_sql)
+        self.assertIn('SELECT max(order_no) AS m FROM archive.orders', setval_sql)
+        self.assertIn('pg_sequence_last_value', setval_sql)
+        self.assertEqual(setval_params, ['public.items_id_seq'] * 3 + ['archive.orders_order_no_seq'] * 3)
+    
+    def test_tables_without_sequences(self):
+        """Test that no setval is issued when there is nothing to advance"""
+        cur = MagicMock()
+        cur.fetchall.return_value = []
+        self.assertEqual(dt.advance_sequences(cur, [('public', 'logs')]), {})
+        self.assertEqual(cur.execute.call_count, 1)
+        self.assertEqual(dt.advance_sequences(cur, []), {})
+        self.assertEqual(cur.execute.call_count, 1)
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_transfer_table_resyncs_after_load(self, mock_setup_logger):
+        """Test that resync_sequences runs once the rows are committed"""
+        src_conn, tgt_conn = MagicMock(), MagicMock()
+        src_conn.cursor.return_value.fetchall.return_value = [('id',)]
+        src_conn.cursor.return_value.fetchmany.side_effect = [[(1,)], []]
+        
+        with patch('datatrasnfer.get_connection', side_effect=[src_conn, tgt_conn]), \
+             patch('datatrasnfer.advance_sequences') as mock_advance:
+            dt.transfer_table({}, {}, 'public', 'items', 'archive', 'items', load_mode='insert',
+                              resync_sequences=True)
+        
+        self.assertEqual(mock_advance.call_args[0][1], [('archive', 'items')])
+        self.assertEqual(tgt_conn.commit.call_count, 2)
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_jobs_batches_successful_tables(self, mock_setup_logger):
+        """Test that the scheduler advances sequences of all successful tables in one pass"""
+        conn = MagicMock()
+        conn.cursor.return_value.fetchall.return_value = []
+        
+        def fake_transfer(source_conf, target_conf, src_schema, src_table, *args, **options):
+            self.assertNotIn('resync_sequences', options)
+            if src_table == 'bad':
+                raise Exception('permission denied')
+            return 1
+        
+        with patch('datatrasnfer.get_connection', return_value=conn), \
+             patch('datatrasnfer.transfer_table', side_effect=fake_transfer), \
+             patch('datatrasnfer.advance_sequences') as mock_advance:
+            dt.migrate_jobs({}, {}, ['public.a', 'public.bad', 'public.c:arch.c'], concurrency=2,
+                            resync_sequences=True)
+        
+        mock_advance.assert_called_once()
+        self.assertEqual(sorted(mock_advance.call_args[0][1]), [('arch', 'c'), ('public', 'a')])
+    
+    @patch('datatrasnfer.setup_logger')
+    def test_migrate_tables_batches_sequences(self, mock_setup_logger):
+        """Test that the asyncio driver also resyncs once at the end"""
+        with patch('datatrasnfer.get_connection', return_value=MagicMock()), \
+             patch('datatrasnfer.transfer_table', return_value=5), \
+             patch('datatrasnfer.advance_sequences') as mock_advance:
+            results = asyncio.run(dt.migrate_tables({}, {}, ['public.a', 'public.b'], resync_sequences=True))
+        
+        self.assertEqual(results, {'public.a': 5, 'public.b': 5})
+        self.assertEqual(mock_advance.call_args[0][1], [('public', 'a'), ('public', 'b')])
+
+
+class TestBinaryEncoder(unittest.TestCase):
+    """Test cases for the PGCOPY binary chunk encoder"""
+    
+    def _field(self, typname, value):
+        buf = bytearray()
+        dt._BINARY_ENCODERS[typname](buf, value)
+        length = struct.unpack('!i', buf[:4])[0]
+        self.assertEqual(length, len(buf) - 4)
+        return bytes(buf[4:])
+    
+    def test_numeric(self):
+        """Test numeric values in base-10000 digit groups"""
+        self.assertEqual(self._field('numeric', decimal.Decimal('123.45')),
+                         struct.pack('!hhHhhh', 2, 0, 0, 2, 123, 4500))
+        self.assertEqual(self._field('numeric', decimal.Decimal('-0.0001')),
+                         struct.pack('!hhHhh', 1, -1, 0x4000, 4, 1))
+        self.assertEqual(self._field('numeric', decimal.Decimal('100000')),
+                         struct.pack('!hhHhh', 1, 1, 0, 0, 10))
+        self.assertEqual(self._field('numeric', decimal.Decimal('0.00')), struct.pack('!hhHh', 0, 0, 0, 2))
+        self.assertEqual(self._field('numeric', decimal.Decimal('NaN')), struct.pack('!hhHh', 0, 0, 0xC000, 0))
+        self.assertEqual(self._field('numeric', 42), struct.pack('!hhHhh', 1, 0, 0, 0, 42))
+    
+    def test_timestamps_and_time(self):
+        """Test microseconds since 2000-01-01 and since midnight"""
+        self.assertEqual(self._field('timestamp', datetime.datetime(2000, 1, 2, 0, 0, 1, 5)),
+                         struct.pack('!q', 86400000000 + 1000005))
+        self.assertEqual(self._field('timestamp', datetime.datetime(1999, 12, 31, 23, 59, 59)),
+                         struct.pack('!q', -1000000))
+        rome = datetime.timezone(datetime.timedelta(hours=1))
+        self.assertEqual(self._field('timestamptz', datetime.datetime(2000, 1, 1, 1, 0, tzinfo=rome)),
+                         struct.pack('!q', 0))
+        self.assertEqual(self._field('time', datetime.time(1, 2, 3, 4)), struct.pack('!q', 3723000004))
+    
+    def test_bytea_from_memoryview(self):
+        """Test that memoryview values from psycopg2 are written as-is"""
+        self.assertEqual(self._field('bytea', memoryview(b'\x00\x01\xff')), b'\x00\x01\xff')
+        self.assertEqual(self._field('bytea', bytearray(b'ab')), b'ab')
+    
+    def test_fixed_width_types(self):
+        """Test that fixed-width values carry their length prefix"""
+        self.assertEqual(self._field('bool', True), b'\x01')
+        self.assertEqual(self._field('int8', -2), struct.pack('!q', -2))
+        self.assertEqual(self._field('date', datetime.date(2000, 1, 31)), struct.pack('!i', 30))
+        self.assertEqual(len(self._field('uuid', '12345678-1234-5678-1234-567812345678')), 16)
+    
+    def test_json_values_are_serialized_as_json(self):
+        """Test that decoded JSON arrays, scalars and objects are written back as JSON"""
+        self.assertEqual(self._field('json', [1, 2]), b'[1, 2]')
+        self.assertEqual(self._field('json', True), b'true')
+        self.assertEqual(self._field('json', 'abc'), b'"abc"')
+        self.assertEqual(self._field('jsonb', {'a': None}), b'\x01{"a": null}')
+    
+    def test_chunk_is_one_contiguous_buffer(self):
+        """Test the full PGCOPY layout of a chunk"""
+        encoders = dt._binary_encoders(['int4', 'text'])
+        data = dt._copy_binary_chunk([(1, 'à'), (2, None)], encoders)
+        
+        self.assertIsInstance(data, bytearray)
+        self.assertEqual(bytes(data), b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0) +
+                         struct.pack('!hii', 2, 4, 1) + struct.pack('!i', 2) + 'à'.encode() +
+                         struct.pack('!hiii', 2, 4, 2, -1) + struct.pack('!h', -1))
+    
+    def test_unsupported_type(self):
+        """Test that types without a binary writer are reported"""
+        with self.assertRaises(ValueError):
+            dt._binary_encoders(['int4', 'interval'])
+
+
 if __name__ == '__main__':
     unittest.main()